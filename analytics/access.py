@@ -0,0 +1,135 @@
+# analytics/access.py
+"""
+Права пользователя: редактирование handle (загрузка, смена статуса, editable в карточках)
+и членство в группах (long_session, superadmins, ...).
+
+Набор handle, которые пользователь может редактировать (HandleRegistry.allowed_users),
+читается одним запросом и:
+  - кэшируется на объекте пользователя — на время запроса (request.user один на запрос);
+  - кэшируется в общем кэше по user_id — сбрасывается сигналами при изменении allowed_users
+    (см. analytics/signals.py).
+Дальше проверки — простое членство в множестве. Суперпользователь может всё.
+Группы пользователя — так же: один запрос, память запроса + кэш, сброс по m2m_changed.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from ingest.models import HandleRegistry
+
+EDIT_CACHE = "access:edit:{gen}:{user_id}"
+GEN_CACHE = "access:edit:gen"
+_USER_ATTR = "_editable_handles"
+
+GROUPS_CACHE = "access:groups:{gen}:{user_id}"
+GROUPS_GEN_CACHE = "access:groups:gen"
+_GROUPS_ATTR = "_group_names"
+
+
+def _timeout() -> int:
+    return int(getattr(settings, "ACCESS_CACHE_TIMEOUT", 10 * 60))
+
+
+def _gen(gen_key: str = GEN_CACHE):
+    gen = cache.get(gen_key)
+    if gen is None:
+        cache.add(gen_key, 1, timeout=None)
+        gen = cache.get(gen_key) or 1
+    return gen
+
+
+def _bump_gen(gen_key: str):
+    try:
+        cache.incr(gen_key)
+    except ValueError:
+        cache.set(gen_key, 2, timeout=None)
+
+
+def _key(user_id: int) -> str:
+    return EDIT_CACHE.format(gen=_gen(), user_id=user_id)
+
+
+def editable_handles(user) -> frozenset:
+    """Handle, назначенные пользователю (allowed_users). Для суперпользователя не нужен — см. can_edit_handle."""
+    if not user or not user.is_authenticated:
+        return frozenset()
+    cached = getattr(user, _USER_ATTR, None)
+    if cached is not None:
+        return cached
+
+    key = _key(user.id)
+    handles = cache.get(key)
+    if handles is None:
+        handles = frozenset(
+            HandleRegistry.objects.filter(allowed_users=user).values_list("handle", flat=True)
+        )
+        cache.set(key, handles, timeout=_timeout())
+    setattr(user, _USER_ATTR, handles)
+    return handles
+
+
+def can_edit_handle(user, handle: str) -> bool:
+    if not user or not user.is_authenticated:
+        return False
+    if getattr(user, "is_superuser", False):
+        return True
+    return handle in editable_handles(user)
+
+
+def filter_editable(user, handles) -> set[str]:
+    """Из списка handles — те, которые пользователь может редактировать."""
+    handles = {h for h in handles if h}
+    if not user or not user.is_authenticated or not handles:
+        return set()
+    if getattr(user, "is_superuser", False):
+        return handles
+    return handles & editable_handles(user)
+
+
+def forget_users(*user_ids):
+    """Сбросить кэш прав у этих пользователей (после изменения allowed_users)."""
+    ids = [i for i in user_ids if i]
+    if ids:
+        gen = _gen()
+        cache.delete_many([EDIT_CACHE.format(gen=gen, user_id=i) for i in ids])
+
+
+def forget_all():
+    """Сбросить кэш прав у всех (например, удалили HandleRegistry — m2m-сигналов при этом нет)."""
+    _bump_gen(GEN_CACHE)
+
+
+# ---------------------------
+# Группы
+# ---------------------------
+
+def group_names(user) -> frozenset:
+    """Имена групп пользователя."""
+    if not user or not user.is_authenticated:
+        return frozenset()
+    cached = getattr(user, _GROUPS_ATTR, None)
+    if cached is not None:
+        return cached
+
+    key = GROUPS_CACHE.format(gen=_gen(GROUPS_GEN_CACHE), user_id=user.id)
+    names = cache.get(key)
+    if names is None:
+        names = frozenset(user.groups.values_list("name", flat=True))
+        cache.set(key, names, timeout=_timeout())
+    setattr(user, _GROUPS_ATTR, names)
+    return names
+
+
+def in_group(user, name: str) -> bool:
+    return name in group_names(user)
+
+
+def forget_groups(*user_ids):
+    ids = [i for i in user_ids if i]
+    if ids:
+        gen = _gen(GROUPS_GEN_CACHE)
+        cache.delete_many([GROUPS_CACHE.format(gen=gen, user_id=i) for i in ids])
+
+
+def forget_all_groups():
+    """Переименовали/удалили группу — сбросить у всех."""
+    _bump_gen(GROUPS_GEN_CACHE)
@@ -1,4 +1,17 @@
 from django.contrib import admin
 
-from analytics.models import Dashboard, ChartConfig
+from analytics.models import Dashboard, ChartConfig, ApiKey
 
+
+@admin.register(ApiKey)
+class ApiKeyAdmin(admin.ModelAdmin):
+    list_display = ("name", "prefix", "is_active", "rate_per_minute", "burst", "daily_row_quota", "last_used_at")
+    list_filter = ("is_active",)
+    search_fields = ("name", "prefix")
+    fields = ("name", "prefix", "handles", "is_active", "rate_per_minute", "burst", "daily_row_quota",
+              "created_at", "last_used_at")
+    readonly_fields = ("prefix", "created_at", "last_used_at")
+
+    def has_add_permission(self, request):
+        # ключ выпускается командой create_api_key — сырое значение показывается один раз
+        return False
@@ -0,0 +1,731 @@
+# analytics/aggregation.py
+"""
+Агрегации по строкам датасета (DatasetRow.data, JSONB) — целиком в PostgreSQL,
+без вытаскивания строк в Python: /api/aggregate — один SELECT ... GROUP BY, графики —
+один проход по датасету на все серии всех графиков (GROUPING SETS + FILTER).
+
+Используется /api/aggregate и /api/charts/<id>/data/ (ChartConfig).
+
+Значения в data бывают числами JSON или текстом ("1 234,5") — числа приводятся
+безопасно: всё, что не похоже на число, даёт NULL и в агрегат не попадает.
+Обёртка {"parsed": {...}} (как в _merge_rows_data) раскрывается.
+
+Если у датасета есть типизированная проекция (DatasetTypedRow, analytics.typed_values), числа
+и даты её ключей берутся из numeric[]/date[] без разбора текста (RowSource). Строки архивных
+датасетов (ingest.archive) читаются из развёрнутой копии DatasetArchiveRow — SQL тот же.
+
+Данные опубликованных графиков хранятся в ChartResult по (график, датасет, версия, хэш параметров)
+и пересчитываются в фоне при изменении данных handle — просмотр графика становится выборкой по ключу.
+"""
+import hashlib
+import json
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection, IntegrityError
+
+from ingest.archive import stage_archives
+from ingest.models import Dataset, DatasetRow, DatasetArchiveRow, DatasetTypedRow
+from .downsampling import DOWNSAMPLE_METHODS, OTHER_KEY, bound_payload, top_n, downsample as downsample_payload
+from .models import ChartConfig, ChartResult
+from .views_resolve import parse_client_date
+
+METRICS = ("count", "sum", "avg", "min", "max")
+# шаг оси времени (date_trunc) для bucket=
+BUCKETS = ("day", "week", "month", "quarter", "year")
+
+# строка данных без обёртки {"parsed": {...}}
+ROW_DATA_SQL = (
+    "CASE WHEN jsonb_typeof(r.data -> 'parsed') = 'object' THEN r.data -> 'parsed' ELSE r.data END"
+)
+
+# текст числа: пробелы (в т.ч. неразрывные) убраны, запятая -> точка
+_NUM_TEXT_SQL = "regexp_replace(replace(d.data ->> %s, ',', '.'), '[\\s\\u00a0]', '', 'g')"
+NUM_RE = r"^[-+]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][-+]?[0-9]+)?$"
+
+
+class AggregationError(ValueError):
+    """Некорректные параметры агрегации (-> 400)."""
+
+
+def parse_metric(metric: str, field: str = "") -> tuple[str, str]:
+    """'sum:amount' -> ('sum', 'amount'); 'count' / 'count:id' -> ('count', '')."""
+    metric = (metric or "count").strip()
+    func, _, name = metric.partition(":")
+    func = func.strip().lower()
+    name = (name or field or "").strip()
+    if func not in METRICS:
+        raise AggregationError(f"metric must be one of: {', '.join(METRICS)}")
+    if func == "count":
+        return func, ""
+    if not name:
+        raise AggregationError(f"metric '{func}' requires a field (e.g. {func}:amount)")
+    return func, name
+
+
+def numeric_sql(key: str) -> tuple[str, list]:
+    """SQL-выражение «значение key как numeric или NULL» и его параметры."""
+    text = _NUM_TEXT_SQL
+    sql = (
+        "CASE WHEN jsonb_typeof(d.data -> %s) = 'number' THEN (d.data ->> %s)::numeric "
+        f"WHEN {text} ~ %s THEN ({text})::numeric ELSE NULL END"
+    )
+    return sql, [key, key, key, NUM_RE, key]
+
+
+def date_sql(key: str) -> tuple[str, list]:
+    """
+    SQL-выражение «значение key как date или NULL» (YYYY-MM-DD... или DD.MM.YYYY).
+    Через IMMUTABLE analytics_row_date (analytics/db_functions.py) по исходному r.data — ровно
+    в таком виде, как в индексах create_date_indexes, чтобы планировщик их использовал.
+    """
+    return "analytics_row_date(d.raw, %s)", [key]
+
+
+def typed_layouts(dataset_ids) -> dict:
+    """{dataset_id: {"num": [...], "date": [...]}} — датасеты с типизированной проекцией (DatasetTypedRow)."""
+    out = {}
+    for ds_id, schema in Dataset.objects.filter(
+        id__in=[int(i) for i in dataset_ids], inferred_schema__has_key="typed",
+    ).values_list("id", "inferred_schema"):
+        layout = schema.get("typed")
+        if isinstance(layout, dict):
+            out[ds_id] = layout
+    return out
+
+
+def common_layout(layouts: list) -> dict | None:
+    """Общая раскладка нескольких датасетов: ключ годится, только если его позиция в массивах везде одна."""
+    if not layouts or not all(layouts):
+        return None
+    out = {}
+    for kind in ("num", "date"):
+        first = list(layouts[0].get(kind) or [])
+        out[kind] = [
+            k if all(len(l.get(kind) or []) > i and l[kind][i] == k for l in layouts[1:]) else None
+            for i, k in enumerate(first)
+        ]
+    return out
+
+
+class RowSource:
+    """
+    Откуда берутся значения строк в запросе: JSON строки (d.data / d.raw) или
+    типизированная проекция (d.tn — numeric[], d.td — date[], см. DatasetTypedRow).
+
+    Числа и даты ключей из раскладки — из проекции, остальное — из JSON. Если JSON запросу
+    не понадобился (метрики и даты только по типизированным ключам, без group_by/filters),
+    строки датасета не читаются вовсе — только DatasetTypedRow.
+
+    staged — строки архивных датасетов: из DatasetArchiveRow (ingest.archive.stage_archives).
+    """
+
+    def __init__(self, layout: dict | None = None, staged: bool = False):
+        layout = (None if staged else layout) or {}
+        self.staged = staged
+        self.num_pos = {k: i + 1 for i, k in enumerate(layout.get("num") or []) if k is not None}
+        self.date_pos = {k: i + 1 for i, k in enumerate(layout.get("date") or []) if k is not None}
+        self.typed = bool(layout)
+        self.json_used = not self.typed
+
+    def num(self, key: str) -> tuple[str, list]:
+        if key in self.num_pos:
+            return "d.tn[%s]", [self.num_pos[key]]
+        self.json_used = True
+        return numeric_sql(key)
+
+    def date(self, key: str) -> tuple[str, list]:
+        if key in self.date_pos:
+            return "d.td[%s]", [self.date_pos[key]]
+        self.json_used = True
+        return date_sql(key)
+
+    def text(self, key: str) -> tuple[str, list]:
+        self.json_used = True
+        return "d.data ->> %s", [key]
+
+    def from_sql(self, dataset_where: str = "r.dataset_id = %s") -> str:
+        """Подзапрос строк (колонки id, dataset_id, raw/data и/или tn/td); вызывать после всех выражений."""
+        rows = DatasetRow._meta.db_table
+        typed = DatasetTypedRow._meta.db_table
+        if self.staged:
+            return (
+                f"SELECT r.row_id AS id, r.dataset_id, r.data AS raw, {ROW_DATA_SQL} AS data "
+                f"FROM {DatasetArchiveRow._meta.db_table} r WHERE {dataset_where}"
+            )
+        if not self.typed:
+            return (
+                f"SELECT r.id, r.dataset_id, r.data AS raw, {ROW_DATA_SQL} AS data "
+                f"FROM {rows} r WHERE {dataset_where}"
+            )
+        if not self.json_used:
+            return (
+                "SELECT r.row_id AS id, r.dataset_id, r.nums AS tn, r.dates AS td "
+                f"FROM {typed} r WHERE {dataset_where}"
+            )
+        return (
+            f"SELECT r.id, r.dataset_id, r.data AS raw, {ROW_DATA_SQL} AS data, t.nums AS tn, t.dates AS td "
+            f"FROM {rows} r LEFT JOIN {typed} t ON t.row_id = r.id WHERE {dataset_where}"
+        )
+
+
+def row_sources(dataset_ids) -> dict:
+    """{dataset_id: RowSource} — с проекцией, из развёрнутого архива или просто по JSON строк."""
+    ids = {int(i) for i in dataset_ids}
+    layouts = typed_layouts(ids)
+    staged = stage_archives(ids)
+    return {ds_id: RowSource(layouts.get(ds_id), staged=ds_id in staged) for ds_id in ids}
+
+
+def _metric_sql(func: str, field: str, src: RowSource | None = None) -> tuple[str, list]:
+    if func == "count":
+        return "count(*)", []
+    num, params = (src or RowSource()).num(field)
+    return f"{func}({num})", params
+
+
+def _group_sql(group_by: str = "", bucket: str = "", date_field: str = "",
+               src: RowSource | None = None) -> tuple[str, list]:
+    """Ключ группировки: начало периода (bucket по date_field), значение group_by или NULL."""
+    src = src or RowSource()
+    if bucket:
+        if bucket not in BUCKETS:
+            raise AggregationError(f"bucket must be one of: {', '.join(BUCKETS)}")
+        if not date_field:
+            raise AggregationError("bucket requires date_field")
+        expr, expr_params = src.date(date_field)
+        return f"to_char(date_trunc(%s, ({expr})::timestamp), 'YYYY-MM-DD')", [bucket] + expr_params
+    if group_by:
+        return src.text(group_by)
+    return "NULL::text", []
+
+
+def _where_sql(filters=None, exclude=None, date_field="", date_from=None, date_to=None,
+               src: RowSource | None = None) -> tuple[str, list]:
+    """
+    WHERE-часть по данным строки:
+      filters {key: [values]} — значение key входит в список (AND между ключами);
+      exclude {key: [values]} — не входит (или ключа нет);
+      date_field + date_from/date_to — диапазон дат (включительно).
+    """
+    src = src or RowSource()
+    parts, params = [], []
+    for key, values in (filters or {}).items():
+        values = [str(v) for v in _as_list(values)]
+        if key and values:
+            expr, expr_params = src.text(key)
+            parts.append(f"({expr}) = ANY(%s)")
+            params += expr_params + [values]
+    for key, values in (exclude or {}).items():
+        values = [str(v) for v in _as_list(values)]
+        if key and values:
+            expr, expr_params = src.text(key)
+            parts.append(f"(({expr}) IS NULL OR NOT ({expr}) = ANY(%s))")
+            params += expr_params + expr_params + [values]
+    if date_field and (date_from or date_to):
+        expr, expr_params = src.date(date_field)
+        if date_from:
+            parts.append(f"({expr}) >= %s")
+            params += expr_params + [date_from]
+        if date_to:
+            parts.append(f"({expr}) <= %s")
+            params += expr_params + [date_to]
+    return (" AND ".join(parts) or "TRUE"), params
+
+
+def _as_list(values):
+    if values is None:
+        return []
+    return list(values) if isinstance(values, (list, tuple, set)) else [values]
+
+
+def _to_json_number(v):
+    if isinstance(v, Decimal):
+        return int(v) if v == v.to_integral_value() and abs(v) < 2 ** 53 else float(v)
+    return v
+
+
+def max_groups() -> int:
+    return int(getattr(settings, "AGGREGATE_MAX_GROUPS", 1000))
+
+
+def downsample_max_input() -> int:
+    """Сколько групп читается из БД для downsample (до прореживания в Python)."""
+    return int(getattr(settings, "AGGREGATE_DOWNSAMPLE_MAX_INPUT", max_groups() * 50))
+
+
+def _stored_key_type(dataset_id: int, key: str) -> str | None:
+    """Тип ключа из сохранённой статистики (analytics.dataset_keys); None — статистики нет."""
+    schema = Dataset.objects.filter(pk=dataset_id).values_list("inferred_schema", flat=True).first()
+    stats = schema.get("keys") if isinstance(schema, dict) else None
+    if not isinstance(stats, dict):
+        return None
+    return next((item.get("type") for item in stats.get("keys") or [] if item.get("key") == key), None)
+
+
+def aggregate(dataset_id: int, metric: str = "count", field: str = "", group_by: str = "",
+              filters=None, exclude=None, date_field: str = "", date_from=None, date_to=None,
+              limit: int | None = None, bucket: str = "", top: int | None = None,
+              downsample: int | None = None, downsample_method: str = "lttb") -> list[dict]:
+    """
+    [{"key": <значение group_by или None>, "value": <агрегат>}, ...] по ключу (по возрастанию).
+    Без group_by — одна строка с key=None.
+    bucket (day/week/month/quarter/year) — группировка по периодам date_field вместо group_by:
+    key — начало периода в ISO (YYYY-MM-DD).
+
+    Ограничение размера ответа (иначе — первые limit групп по ключу):
+      top=N — N групп с наибольшим значением (по убыванию) + {"key": "other", "other": true}
+              с агрегатом остальных — в SQL;
+      downsample=N — для упорядоченной оси (bucket, числа, даты): не больше N точек
+              (LTTB или minmax, analytics.downsampling). group_by с типом text/bool по статистике
+              ключей — AggregationError; групп больше downsample_max_input() — тоже.
+    """
+    func, field = parse_metric(metric, field)
+    if downsample and not (top or bucket) and group_by \
+            and _stored_key_type(dataset_id, group_by) not in (None, "number", "date"):
+        raise AggregationError("downsample requires an ordered axis: bucket or a number/date group_by")
+    src = row_sources([dataset_id])[int(dataset_id)]
+    value_sql, value_params = _metric_sql(func, field, src)
+    where_sql, where_params = _where_sql(filters, exclude, date_field, date_from, date_to, src)
+    limit = max(1, min(int(limit or max_groups()), max_groups()))
+
+    key_sql, key_params = _group_sql(group_by, bucket, date_field, src)
+    extra_sql, extra_params = "", []
+    if top and func == "avg":
+        # среднее «прочих» — из сумм и количеств, а не среднее средних
+        num, num_params = src.num(field)
+        extra_sql, extra_params = f", sum({num}) AS s, count({num}) AS c", num_params + num_params
+    base_sql = f"""
+        FROM ({src.from_sql()}) d
+        WHERE {where_sql}
+        GROUP BY 1
+    """
+    base_params = [int(dataset_id)] + where_params
+
+    if top:
+        return _aggregate_top(func, key_sql, key_params, value_sql, value_params, extra_sql, extra_params,
+                              base_sql, base_params, min(int(top), limit))
+
+    sql = f"SELECT {key_sql} AS k, {value_sql} AS v {base_sql} ORDER BY 1 NULLS LAST"
+    params = key_params + value_params + base_params
+    # для downsample — все точки оси, но не больше downsample_max_input() (+1 — узнать о превышении)
+    max_input = downsample_max_input()
+    sql += " LIMIT %s"
+    params.append(max_input + 1 if downsample else limit)
+    with connection.cursor() as cur:
+        cur.execute(sql, params)
+        fetched = cur.fetchall()
+
+    if downsample:
+        if len(fetched) > max_input:
+            raise AggregationError(f"too many groups to downsample (more than {max_input}): use bucket or date_from/date_to")
+        # ось — ключи в порядке SQL; точки выбираются на полной серии, в ответ — не больше N
+        payload = downsample_payload(
+            {"x": [k for k, _ in fetched], "series": [{"data": [_to_json_number(v) for _, v in fetched]}]},
+            min(int(downsample), limit), downsample_method,
+        )
+        return [{"key": k, "value": v} for k, v in zip(payload["x"], payload["series"][0]["data"])]
+    return [{"key": k, "value": _to_json_number(v)} for k, v in fetched]
+
+
+def _aggregate_top(func, key_sql, key_params, value_sql, value_params, extra_sql, extra_params,
+                   base_sql, base_params, top):
+    """
+    top групп по значению + «other»: ранжирование и свёртка остальных — в том же запросе.
+    Для avg extra_sql — суммы s и количества c по группам.
+    """
+    combine = {
+        "count": "sum(v)", "sum": "sum(v)", "min": "min(v)", "max": "max(v)", "avg": "sum(s) / nullif(sum(c), 0)",
+    }[func]
+
+    sql = f"""
+        WITH g AS (
+            SELECT {key_sql} AS k, {value_sql} AS v {extra_sql}
+            {base_sql}
+        ), ranked AS (
+            SELECT g.*, least(row_number() OVER (ORDER BY v DESC NULLS LAST, k NULLS LAST), %s) AS rn
+            FROM g
+        )
+        SELECT rn, (array_agg(k))[1], {combine}
+        FROM ranked
+        GROUP BY rn
+        ORDER BY rn
+    """
+    params = key_params + value_params + extra_params + base_params + [top + 1]
+    with connection.cursor() as cur:
+        cur.execute(sql, params)
+        fetched = cur.fetchall()
+
+    out = []
+    for rn, k, v in fetched:
+        if rn > top:
+            out.append({"key": OTHER_KEY, "value": _to_json_number(v), "other": True})
+        else:
+            out.append({"key": k, "value": _to_json_number(v)})
+    return out
+
+
+def aggregate_datasets(dataset_ids, metric: str = "sum", field: str = "", filters=None, exclude=None) -> dict:
+    """
+    {dataset_id: агрегат} — одна метрика сразу по нескольким датасетам, одним GROUP BY dataset_id.
+    metric — как в aggregate(), плюс 'last' — значение из самой новой строки, где оно число
+    (как слияние строк в resolve: новые перекрывают старые).
+    """
+    ids = sorted({int(i) for i in dataset_ids if i})
+    if not ids:
+        return {}
+    archived = stage_archives(ids)
+    hot = [i for i in ids if i not in archived]
+    # проекция — только если она есть у всех датасетов (иначе позиции ключей не сравнить)
+    layouts = typed_layouts(hot)
+    groups = []
+    if hot:
+        groups.append((hot, RowSource(common_layout([layouts.get(i) for i in hot]))))
+    if archived:
+        groups.append((sorted(archived), RowSource(staged=True)))
+
+    out = {}
+    for group_ids, src in groups:
+        out.update(_aggregate_datasets_sql(group_ids, src, metric, field, filters, exclude))
+    return out
+
+
+def _aggregate_datasets_sql(ids, src: RowSource, metric, field, filters, exclude) -> dict:
+    func, _, name = (metric or "").partition(":")
+    if func.strip().lower() == "last":
+        field = (name or field or "").strip()
+        if not field:
+            raise AggregationError("metric 'last' requires a field (e.g. last:amount)")
+        num, value_params = src.num(field)
+        value_sql = f"(array_agg({num} ORDER BY d.id DESC) FILTER (WHERE {num} IS NOT NULL))[1]"
+        value_params = value_params + value_params
+    else:
+        func, field = parse_metric(metric, field)
+        value_sql, value_params = _metric_sql(func, field, src)
+    where_sql, where_params = _where_sql(filters, exclude, src=src)
+
+    sql = f"""
+        SELECT d.dataset_id, {value_sql}
+        FROM ({src.from_sql("r.dataset_id = ANY(%s)")}) d
+        WHERE {where_sql}
+        GROUP BY d.dataset_id
+    """
+    with connection.cursor() as cur:
+        cur.execute(sql, value_params + [list(ids)] + where_params)
+        return {ds_id: _to_json_number(v) for ds_id, v in cur.fetchall()}
+
+
+def aggregate_params_filters(query_params) -> tuple[dict, dict]:
+    """(filters, exclude) из filters[k]=v / exclude[k]=v (значения можно повторять)."""
+    filters, exclude = {}, {}
+    for name in query_params:
+        for prefix, target in (("filters[", filters), ("exclude[", exclude)):
+            if name.startswith(prefix) and name.endswith("]"):
+                key = name[len(prefix):-1]
+                target.setdefault(key, []).extend(v for v in query_params.getlist(name) if v != "")
+    return filters, exclude
+
+
+def aggregate_params(query_params) -> dict:
+    """Параметры aggregate() из query string /api/aggregate (filters[k]=v, exclude[k]=v, ...)."""
+    filters, exclude = aggregate_params_filters(query_params)
+
+    try:
+        dataset_id = int(query_params.get("dataset_id") or "")
+    except ValueError:
+        raise AggregationError("dataset_id is required")
+    try:
+        limit = int(query_params.get("limit") or 0) or None
+    except ValueError:
+        raise AggregationError("limit must be integer")
+
+    try:
+        date_from = parse_client_date(query_params.get("date_from"))
+        date_to = parse_client_date(query_params.get("date_to"))
+    except ValueError:
+        raise AggregationError("date_from/date_to: DD.MM.YYYY or YYYY-MM-DD")
+
+    return {
+        "dataset_id": dataset_id,
+        "metric": query_params.get("metric") or "count",
+        "field": query_params.get("field") or "",
+        "group_by": query_params.get("group_by") or "",
+        "bucket": (query_params.get("bucket") or "").strip().lower(),
+        "filters": filters,
+        "exclude": exclude,
+        "date_field": query_params.get("date_field") or "",
+        "date_from": date_from,
+        "date_to": date_to,
+        "limit": limit,
+        **shape_params(query_params),
+    }
+
+
+def chart_series(chart) -> list[dict]:
+    """Серии ChartConfig: [{"name", "metric", "field"}]; без series — одна из metric."""
+    out = []
+    for i, s in enumerate(chart.series or []):
+        if not isinstance(s, dict):
+            continue
+        func, field = parse_metric(s.get("metric") or chart.metric, s.get("field") or "")
+        out.append({"name": s.get("name") or field or func or f"series {i + 1}", "metric": func, "field": field})
+    if not out:
+        func, field = parse_metric(chart.metric)
+        out.append({"name": chart.title or field or func, "metric": func, "field": field})
+    return out
+
+
+def chart_data(chart) -> dict:
+    """
+    Данные ChartConfig для ECharts: {"x": [ключи group_by], "series": [{"name", "data"}]}.
+    Все серии — одним проходом по датасету (см. charts_data).
+    """
+    return charts_data([chart])[chart.id]
+
+
+def shape_chart_payload(chart, payload: dict, top: int | None = None, downsample: int | None = None,
+                        downsample_method: str = "lttb") -> dict:
+    """top / downsample по запросу клиента поверх данных графика (в т.ч. сохранённых в ChartResult)."""
+    if top:
+        payload = top_n(payload, int(top), [s["metric"] for s in chart_series(chart)])
+    if downsample:
+        payload = downsample_payload(payload, int(downsample), downsample_method)
+    return payload
+
+
+def shape_params(query_params) -> dict:
+    """top / downsample / downsample_method из query string."""
+    try:
+        top = int(query_params.get("top") or 0) or None
+        downsample = int(query_params.get("downsample") or 0) or None
+    except ValueError:
+        raise AggregationError("top/downsample must be integers")
+    method = (query_params.get("downsample_method") or "lttb").strip().lower()
+    if method not in DOWNSAMPLE_METHODS:
+        raise AggregationError(f"downsample_method must be one of: {', '.join(DOWNSAMPLE_METHODS)}")
+    return {"top": top, "downsample": downsample, "downsample_method": method}
+
+
+# сколько наборов группировки в одном запросе: GROUPING(...) — битовая маска в integer
+_MAX_GROUPING_SETS = 31
+
+
+def charts_data(charts, errors: dict | None = None) -> dict:
+    """
+    {chart.id: chart_data} для нескольких графиков: на каждый датасет — один проход
+    (GROUP BY GROUPING SETS по ключам группировки графиков, серия — агрегат с FILTER (WHERE
+    <фильтры графика>)). Дашборд из 12 графиков по одному датасету читает его один раз.
+
+    errors=None — некорректный график поднимает AggregationError; иначе ошибка кладётся
+    в errors[chart.id], а график пропускается.
+    """
+    sources = row_sources({chart.dataset_id for chart in charts})
+    compiled = {}
+    for chart in charts:
+        try:
+            compiled[chart.id] = _compile_chart(chart, sources[chart.dataset_id])
+        except AggregationError as e:
+            if errors is None:
+                raise
+            errors[chart.id] = str(e)
+
+    by_dataset: dict[int, list] = {}
+    for chart in charts:
+        if chart.id in compiled:
+            by_dataset.setdefault(chart.dataset_id, []).append(chart.id)
+
+    out = {}
+    for dataset_id, chart_ids in by_dataset.items():
+        out.update(_scan_dataset(dataset_id, [compiled[i] for i in chart_ids], sources[dataset_id]))
+    return out
+
+
+def _compile_chart(chart, src: RowSource | None = None) -> dict:
+    """SQL-куски графика: ключ группировки, условие, агрегаты серий."""
+    group_sql, group_params = _group_sql(chart.group_by, chart.date_bucket, chart.date_field, src)
+    where_sql, where_params = _where_sql(
+        chart.filters if isinstance(chart.filters, dict) else {},
+        None, chart.date_field, chart.date_from, chart.date_to, src,
+    )
+    series = []
+    for s in chart_series(chart):
+        value_sql, value_params = _metric_sql(s["metric"], s["field"], src)
+        series.append({"name": s["name"], "metric": s["metric"], "sql": value_sql, "params": value_params})
+    return {
+        "id": chart.id,
+        # ось времени — упорядочена (её прореживаем), group_by — категории (top + other)
+        "ordered": bool(chart.date_bucket),
+        "group": (group_sql, tuple(group_params)),
+        "where": (where_sql, where_params),
+        "series": series,
+    }
+
+
+def _scan_dataset(dataset_id: int, compiled: list, src: RowSource) -> dict:
+    # одинаковые ключи группировки у разных графиков — один набор
+    groups = list(dict.fromkeys(c["group"] for c in compiled))
+    out = {}
+    for start in range(0, len(groups), _MAX_GROUPING_SETS):
+        chunk = groups[start:start + _MAX_GROUPING_SETS]
+        out.update(_scan_grouping_sets(dataset_id, chunk, [c for c in compiled if c["group"] in chunk], src))
+    return out
+
+
+def _scan_grouping_sets(dataset_id: int, groups: list, compiled: list, src: RowSource) -> dict:
+    n = len(groups)
+    select_sql, select_params = [], []
+    # на график: число строк под его условием (ключ есть на оси, только если > 0) + серии
+    for c in compiled:
+        where_sql, where_params = c["where"]
+        select_sql.append(f"count(*) FILTER (WHERE {where_sql})")
+        select_params += where_params
+        for s in c["series"]:
+            select_sql.append(f"{s['sql']} FILTER (WHERE {where_sql})")
+            select_params += s["params"] + where_params
+
+    inner_sql = ", ".join(f"{sql} AS g{i}" for i, (sql, _) in enumerate(groups))
+    inner_params = [p for _, params in groups for p in params]
+    cols = ", ".join(f"g{i}" for i in range(n))
+    sql = f"""
+        SELECT GROUPING({cols}), {cols}, {", ".join(select_sql)}
+        FROM (
+            SELECT d.*, {inner_sql}
+            FROM ({src.from_sql()}) d
+        ) d
+        GROUP BY GROUPING SETS ({", ".join(f"(g{i})" for i in range(n))})
+    """
+    with connection.cursor() as cur:
+        cur.execute(sql, select_params + inner_params + [int(dataset_id)])
+        fetched = cur.fetchall()
+
+    # GROUPING(g0..gn-1): бит 1 — колонка не участвует в группировке; g0 — старший бит
+    full = (1 << n) - 1
+    set_of_mask = {full & ~(1 << (n - 1 - i)): i for i in range(n)}
+    limit = max_groups()
+
+    out = {}
+    offset = 1 + n
+    for c in compiled:
+        gi = groups.index(c["group"])
+        values = {}
+        for row in fetched:
+            if set_of_mask.get(row[0]) != gi or not row[offset]:
+                continue
+            values[row[1 + gi]] = [_to_json_number(v) for v in row[offset + 1: offset + 1 + len(c["series"])]]
+        x = sorted(values, key=lambda k: (k is None, k or ""))
+        payload = {
+            "x": x,
+            "series": [
+                {"name": s["name"], "data": [values[k][j] for k in x]}
+                for j, s in enumerate(c["series"])
+            ],
+        }
+        out[c["id"]] = bound_payload(payload, limit, c["ordered"], [s["metric"] for s in c["series"]])
+        offset += 1 + len(c["series"])
+    return out
+
+
+# ---------------------------
+# Сохранённые результаты (ChartResult)
+# ---------------------------
+
+def chart_params_hash(chart) -> str:
+    """Хэш всего, что влияет на данные графика, кроме самого датасета."""
+    raw = json.dumps(
+        [chart.group_by, chart.metric, chart.series, chart.filters,
+         chart.date_field, chart.date_from, chart.date_to, chart.date_bucket],
+        sort_keys=True, ensure_ascii=False, default=str,
+    )
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _result_key(chart) -> dict:
+    return {
+        "chart_id": chart.id,
+        "dataset_id": chart.dataset_id,
+        "dataset_version": chart.dataset.version,
+        "params_hash": chart_params_hash(chart),
+    }
+
+
+def _store_result(key: dict, payload: dict):
+    try:
+        ChartResult.objects.update_or_create(defaults={"payload": payload}, **key)
+    except IntegrityError:
+        # параллельный запрос успел вставить тот же ключ — его результат не хуже
+        pass
+
+
+def stored_chart_data(chart) -> dict:
+    """
+    chart_data() опубликованного графика: из ChartResult, а при промахе — посчитать и сохранить.
+    chart — с select_related("dataset") (нужна версия).
+    """
+    key = _result_key(chart)
+    payload = ChartResult.objects.filter(**key).values_list("payload", flat=True).first()
+    if payload is None:
+        payload = chart_data(chart)
+        _store_result(key, payload)
+    return payload
+
+
+def stored_charts_data(charts, errors: dict | None = None) -> dict:
+    """
+    stored_chart_data() для многих графиков: сохранённые — одним запросом к ChartResult,
+    промахи — одним проходом на датасет (charts_data), с сохранением опубликованных.
+    """
+    keys = {c.id: _result_key(c) for c in charts if c.published}
+    stored = {}
+    if keys:
+        hashes = {k["params_hash"] for k in keys.values()}
+        dataset_ids = {k["dataset_id"] for k in keys.values()}
+        for chart_id, dataset_id, version, params_hash, payload in ChartResult.objects.filter(
+            chart_id__in=list(keys), dataset_id__in=dataset_ids, params_hash__in=hashes,
+        ).values_list("chart_id", "dataset_id", "dataset_version", "params_hash", "payload"):
+            # тот же ключ, что у stored_chart_data: график мог переехать на датасет с той же версией
+            if keys[chart_id] == {"chart_id": chart_id, "dataset_id": dataset_id,
+                                  "dataset_version": version, "params_hash": params_hash}:
+                stored[chart_id] = payload
+
+    missing = [c for c in charts if c.id not in stored]
+    computed = charts_data(missing, errors=errors) if missing else {}
+    for chart_id, payload in computed.items():
+        if chart_id in keys:
+            _store_result(keys[chart_id], payload)
+    return {**stored, **computed}
+
+
+def refresh_chart_results(handles=None, chart_ids=None) -> int:
+    """
+    Пересчитать ChartResult опубликованных графиков (по handle их датасетов и/или по id).
+    Результаты для прежних версий/параметров этих графиков удаляются. Возвращает число графиков.
+    """
+    qs = ChartConfig.objects.filter(published=True).select_related("dataset")
+    if handles is not None:
+        qs = qs.filter(dataset__sheet__workbook__handle__in=list(handles))
+    if chart_ids is not None:
+        qs = qs.filter(id__in=list(chart_ids))
+
+    charts = list(qs)
+    errors = {}
+    payloads = charts_data(charts, errors=errors)
+    # график настроен некорректно — отдаст 400 при просмотре, хранить нечего
+    if errors:
+        ChartResult.objects.filter(chart_id__in=list(errors)).delete()
+    for chart in charts:
+        if chart.id not in payloads:
+            continue
+        key = _result_key(chart)
+        _store_result(key, payloads[chart.id])
+        ChartResult.objects.filter(chart_id=chart.id).exclude(**key).delete()
+    return len(payloads)
+
+
+def invalidate_chart_results(handles=None, chart_ids=None):
+    """Удалить сохранённые результаты (данные handle изменились без смены версии датасета)."""
+    qs = ChartResult.objects.all()
+    if handles is not None:
+        qs = qs.filter(dataset__sheet__workbook__handle__in=list(handles))
+    if chart_ids is not None:
+        qs = qs.filter(chart_id__in=list(chart_ids))
+    qs.delete()
@@ -0,0 +1,131 @@
+# analytics/api_keys.py
+"""
+Ключи внешнего API (analytics.models.ApiKey): поиск по хэшу с кэшем,
+token bucket на запросы и суточная квота строк — всё в кэше (см. CACHES),
+чтобы опрос партнёра не доходил до БД чаще, чем нужно.
+"""
+import hashlib
+import secrets
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import ApiKey
+
+KEY_CACHE = "apikey:{key_hash}"
+BUCKET_CACHE = "apikey:bucket:{id}"
+ROWS_CACHE = "apikey:rows:{id}:{day}"
+TOUCH_CACHE = "apikey:touch:{id}"
+
+
+def hash_key(raw: str) -> str:
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def generate_key() -> tuple[str, str, str]:
+    """Новый ключ: (raw, prefix, key_hash). raw показывается один раз и нигде не хранится."""
+    prefix = secrets.token_hex(4)
+    raw = f"ak_{prefix}_{secrets.token_urlsafe(32)}"
+    return raw, prefix, hash_key(raw)
+
+
+def _key_info(obj: ApiKey) -> dict:
+    return {
+        "id": obj.id,
+        "name": obj.name,
+        "handles": list(obj.handles or []),
+        "is_active": obj.is_active,
+        "rate_per_minute": obj.rate_per_minute,
+        "burst": obj.burst,
+        "daily_row_quota": obj.daily_row_quota,
+    }
+
+
+def lookup_key(raw: str) -> dict | None:
+    """Активный ключ по сырому значению (dict из _key_info) или None. Промахи тоже кэшируются."""
+    if not raw:
+        return None
+    key_hash = hash_key(raw)
+    cache_key = KEY_CACHE.format(key_hash=key_hash)
+    info = cache.get(cache_key)
+    if info is None:
+        obj = ApiKey.objects.filter(key_hash=key_hash).first()
+        info = _key_info(obj) if obj else {}
+        timeout = int(getattr(settings, "API_KEY_CACHE_TIMEOUT", 300))
+        # несуществующий ключ помним недолго: перебор ключей не должен бить в БД
+        cache.set(cache_key, info, timeout=timeout if obj else min(timeout, 60))
+    if not info or not info["is_active"]:
+        return None
+    _touch(info["id"])
+    return info
+
+
+def forget_key(key_hash: str):
+    cache.delete(KEY_CACHE.format(key_hash=key_hash))
+
+
+def _touch(key_id: int):
+    """last_used_at — не чаще раза в 5 минут на ключ."""
+    if cache.add(TOUCH_CACHE.format(id=key_id), 1, timeout=300):
+        ApiKey.objects.filter(id=key_id).update(last_used_at=timezone.now())
+
+
+def key_allows_handle(info: dict, handle: str) -> bool:
+    handles = info.get("handles") or []
+    return "*" in handles or handle in handles
+
+
+def take_token(info: dict) -> float | None:
+    """
+    Token bucket: взять токен на запрос. None — можно, иначе — сколько секунд подождать.
+    Состояние (токены, время) хранится в кэше; при гонке параллельных запросов
+    ограничение приблизительное, но порядок величины держит.
+    """
+    rate = info["rate_per_minute"] / 60.0
+    burst = max(1, info["burst"])
+    if rate <= 0:
+        return None
+
+    cache_key = BUCKET_CACHE.format(id=info["id"])
+    now = time.time()
+    tokens, ts = cache.get(cache_key) or (burst, now)
+    tokens = min(burst, tokens + (now - ts) * rate)
+    if tokens < 1:
+        return (1 - tokens) / rate
+    # ведро полностью восстанавливается за burst / rate секунд — дольше хранить незачем
+    cache.set(cache_key, (tokens - 1, now), timeout=int(burst / rate) + 1)
+    return None
+
+
+def _day() -> str:
+    return timezone.localdate().isoformat()
+
+
+def rows_quota_left(info: dict) -> int | None:
+    """Сколько строк ещё можно выгрузить сегодня (None — без ограничения)."""
+    quota = info["daily_row_quota"]
+    if not quota:
+        return None
+    used = cache.get(ROWS_CACHE.format(id=info["id"], day=_day())) or 0
+    return max(0, quota - used)
+
+
+def consume_rows(info: dict, n: int):
+    if not info["daily_row_quota"] or n <= 0:
+        return
+    cache_key = ROWS_CACHE.format(id=info["id"], day=_day())
+    cache.add(cache_key, 0, timeout=2 * 24 * 60 * 60)
+    try:
+        cache.incr(cache_key, n)
+    except ValueError:
+        # ключ успел истечь между add и incr
+        cache.set(cache_key, n, timeout=2 * 24 * 60 * 60)
+
+
+def seconds_until_tomorrow() -> int:
+    now = timezone.localtime()
+    tomorrow = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return int((tomorrow - now).total_seconds()) + 1
@@ -4,3 +4,11 @@
 class AnalyticsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'analytics'
+
+    def ready(self):
+        import analytics.signals
+        import analytics.checks
+        from django.db.models.signals import post_migrate
+        from analytics.db_functions import install_db_functions
+
+        post_migrate.connect(install_db_functions, sender=self)
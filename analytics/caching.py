@@ -0,0 +1,96 @@
+# analytics/caching.py
+"""
+Кэш производных данных (карточки дашборда и т.п.).
+
+Инвалидация — через «поколение» handle: каждый ключ включает текущий токен поколения,
+а при изменении данных handle (approve, загрузка, импорт, правка HandleRegistry) токен
+меняется, и старые ключи просто перестают читаться (и вытесняются по TTL).
+
+Для нескольких процессов/воркеров кэш должен быть общим (Redis, см. CACHES в settings;
+без него manage.py check в проде падает — analytics/checks.py). Фоновые задачи
+ставятся через tasks.enqueue: ошибка задачи после коммита логируется, а не отдаёт 500.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+GEN_KEY = "analytics:gen:{handle}"
+USER_GEN_KEY = "analytics:user-gen:{user_id}"
+ALL_USERS_GEN_KEY = "analytics:user-gen:*"
+
+
+def _new_token() -> int:
+    return time.time_ns()
+
+
+def cache_timeout() -> int:
+    return int(getattr(settings, "DASHBOARD_CACHE_TIMEOUT", 6 * 60 * 60))
+
+
+def handle_generations(handles) -> dict:
+    """{handle: токен поколения} — один round-trip в кэш (плюс по одному на ещё не заведённые)."""
+    keys = {h: GEN_KEY.format(handle=h) for h in handles}
+    got = cache.get_many(list(keys.values()))
+    out = {}
+    for h, key in keys.items():
+        if key not in got:
+            # add(), а не set(): параллельный запрос мог уже завести токен
+            cache.add(key, _new_token(), timeout=None)
+            got[key] = cache.get(key)
+        out[h] = got[key]
+    return out
+
+
+def bump_handle_generation(*handles):
+    """Сбросить все кэши, привязанные к этим handle."""
+    handles = [h for h in handles if h]
+    if handles:
+        cache.set_many({GEN_KEY.format(handle=h): _new_token() for h in handles}, timeout=None)
+
+
+def handle_data_changed(handle: str, warm: bool = True):
+    """
+    Данные handle изменились (approve/draft, загрузка, импорт).
+    После коммита транзакции: сбросить кэши и (опц.) прогреть дашборд в фоне;
+    сохранённые данные графиков (ChartResult) по датасетам handle — удалить и пересчитать в фоне.
+    """
+    if not handle:
+        return
+
+    def _after_commit():
+        from .aggregation import invalidate_chart_results
+        from .tasks import enqueue, refresh_chart_results, warm_dashboard_cache
+
+        bump_handle_generation(handle)
+        invalidate_chart_results(handles=[handle])
+        enqueue(refresh_chart_results, handles=[handle])
+        if warm:
+            enqueue(warm_dashboard_cache, handles=[handle])
+
+    transaction.on_commit(_after_commit)
+
+
+def user_generation(user_id: int) -> str:
+    """
+    Токен поколения пользовательских кэшей (например, /api/auth/me): меняется при изменении
+    самого пользователя (bump_user_generation) или общих данных (bump_all_users_generation).
+    """
+    keys = [USER_GEN_KEY.format(user_id=user_id), ALL_USERS_GEN_KEY]
+    got = cache.get_many(keys)
+    for key in keys:
+        if key not in got:
+            cache.add(key, _new_token(), timeout=None)
+            got[key] = cache.get(key)
+    return f"{got[keys[1]]}.{got[keys[0]]}"
+
+
+def bump_user_generation(*user_ids):
+    user_ids = [i for i in user_ids if i]
+    if user_ids:
+        cache.set_many({USER_GEN_KEY.format(user_id=i): _new_token() for i in user_ids}, timeout=None)
+
+
+def bump_all_users_generation():
+    cache.set(ALL_USERS_GEN_KEY, _new_token(), timeout=None)
@@ -0,0 +1,41 @@
+# analytics/checks.py
+"""
+Проверки окружения (manage.py check): поколения кэшей, права доступа, отзыв API-ключей
+и token bucket лимитов живут в кэше и верны только при общем кэше для всех процессов.
+"""
+from django.conf import settings
+from django.core.checks import Error, Tags, Warning, register
+
+
+def _locmem_cache() -> bool:
+    backend = (getattr(settings, "CACHES", {}).get("default") or {}).get("BACKEND", "")
+    return backend.endswith("LocMemCache")
+
+
+def _production() -> bool:
+    # не settings.DEBUG: тест-раннер выставляет DEBUG=False перед проверками
+    return bool(getattr(settings, "SHARED_CACHE_REQUIRED", not settings.DEBUG))
+
+
+@register(Tags.caches)
+def shared_cache_check(app_configs, **kwargs):
+    if not _locmem_cache():
+        return []
+    msg = ("CACHES['default'] — LocMemCache: у каждого процесса свой кэш, инвалидация по поколениям, "
+           "права, отзыв API-ключей и лимиты запросов между процессами не видны.")
+    hint = "Задайте REDIS_CACHE_URL (общий Redis для веба и celery)."
+    if not _production():
+        return [Warning(msg, hint=hint, id="analytics.W001")]
+    return [Error(msg, hint=hint, id="analytics.E001")]
+
+
+@register()
+def celery_eager_check(app_configs, **kwargs):
+    if not _production() or not getattr(settings, "CELERY_TASK_ALWAYS_EAGER", False):
+        return []
+    return [Warning(
+        "CELERY_TASK_ALWAYS_EAGER: фоновые пересчёты (графики, прогрев дашборда, статистика ключей) "
+        "выполняются внутри запроса.",
+        hint="CELERY_TASK_ALWAYS_EAGER=0 и воркер на CELERY_BROKER_URL.",
+        id="analytics.W002",
+    )]
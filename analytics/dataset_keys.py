@@ -0,0 +1,208 @@
+# analytics/dataset_keys.py
+"""
+Ключи датасета и статистика по ним (для выбора group_by/метрик во фронте):
+тип (number/date/bool/text), доля заполненности, число различных значений,
+min/max для чисел и дат, самые частые значения.
+
+Считается одним запросом в PostgreSQL и хранится в Dataset.inferred_schema["keys"]:
+  - при записи (загрузка, импорт) — полный пересчёт в фоне (dataset_rows_changed);
+  - для старых датасетов без статистики — по первым KEYS_SAMPLE_ROWS строкам прямо в запросе
+    (без записи), полный пересчёт — в фоне, если есть воркер, и командой build_typed_values --all.
+Дальше /api/datasets/<id>/keys — чтение одного поля.
+"""
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils import timezone
+
+from ingest.models import Dataset, DatasetRow
+from .aggregation import ROW_DATA_SQL, NUM_RE
+from .typed_values import invalidate_typed_values
+
+# доля заполненных значений, после которой ключ считается числом/датой
+TYPE_THRESHOLD = 0.95
+
+_NUM_TEXT = "regexp_replace(replace(g.v, ',', '.'), '[\\s\\u00a0]', '', 'g')"
+
+STATS_SQL = f"""
+    WITH d AS (
+        SELECT {ROW_DATA_SQL} AS data
+        FROM {DatasetRow._meta.db_table} r
+        WHERE r.dataset_id = %(dataset_id)s
+        {{limit}}
+    ),
+    kv AS (
+        SELECT e.key, e.value #>> '{{{{}}}}' AS v, jsonb_typeof(e.value) AS t
+        FROM d CROSS JOIN LATERAL jsonb_each(
+            CASE WHEN jsonb_typeof(d.data) = 'object' THEN d.data ELSE '{{{{}}}}'::jsonb END
+        ) e
+    ),
+    g AS (
+        SELECT key, v, count(*) AS n, bool_or(t = 'number') AS is_num, bool_and(t = 'boolean') AS is_bool
+        FROM kv
+        GROUP BY key, v
+    ),
+    typed AS (
+        SELECT g.key, g.v, g.n, g.is_bool,
+               (g.v IS NULL OR g.v = '') AS empty,
+               CASE WHEN g.is_num THEN g.v::numeric
+                    WHEN {_NUM_TEXT} ~ %(num_re)s THEN ({_NUM_TEXT})::numeric END AS num,
+               analytics_text_date(g.v) AS dt,
+               row_number() OVER (PARTITION BY g.key ORDER BY (g.v IS NULL OR g.v = ''), g.n DESC, g.v) AS rn
+        FROM g
+    )
+    SELECT key,
+           coalesce(sum(n) FILTER (WHERE NOT empty), 0)::bigint AS filled,
+           count(*) FILTER (WHERE NOT empty) AS distinct_values,
+           coalesce(sum(n) FILTER (WHERE NOT empty AND num IS NOT NULL), 0)::bigint AS n_num,
+           coalesce(sum(n) FILTER (WHERE NOT empty AND dt IS NOT NULL), 0)::bigint AS n_date,
+           coalesce(sum(n) FILTER (WHERE NOT empty AND is_bool), 0)::bigint AS n_bool,
+           min(num), max(num), min(dt), max(dt),
+           jsonb_agg(jsonb_build_object('value', v, 'count', n) ORDER BY rn)
+               FILTER (WHERE NOT empty AND rn <= %(top)s) AS top,
+           (SELECT count(*) FROM d) AS total
+    FROM typed
+    GROUP BY key
+    ORDER BY key
+"""
+
+
+def _sample_rows() -> int:
+    return int(getattr(settings, "KEYS_SAMPLE_ROWS", 10000))
+
+
+def _number(v):
+    if v is None:
+        return None
+    return int(v) if v == v.to_integral_value() and abs(v) < 2 ** 53 else float(v)
+
+
+def _key_type(filled, n_num, n_date, n_bool) -> str:
+    if not filled:
+        return "empty"
+    if n_bool == filled:
+        return "bool"
+    if n_num >= filled * TYPE_THRESHOLD:
+        return "number"
+    if n_date >= filled * TYPE_THRESHOLD:
+        return "date"
+    return "text"
+
+
+def collect_key_stats(dataset_id: int, sample_rows: int | None = None, top: int = 5) -> dict:
+    """Статистика по ключам датасета; sample_rows — смотреть только столько строк."""
+    limit = "LIMIT %(sample_rows)s" if sample_rows else ""
+    with connection.cursor() as cur:
+        cur.execute(
+            STATS_SQL.format(limit=limit),
+            {"dataset_id": int(dataset_id), "num_re": NUM_RE, "top": int(top), "sample_rows": sample_rows},
+        )
+        fetched = cur.fetchall()
+
+    total = fetched[0][-1] if fetched else 0
+    sampled = bool(sample_rows) and total >= sample_rows
+    keys = []
+    for key, filled, distinct, n_num, n_date, n_bool, nmin, nmax, dmin, dmax, top_values, _ in fetched:
+        kind = _key_type(filled, n_num, n_date, n_bool)
+        item = {
+            "key": key,
+            "type": kind,
+            "fill_rate": round(filled / total, 4) if total else 0,
+            "distinct": distinct,
+            "min": None,
+            "max": None,
+            # jsonb из «сырого» курсора Django отдаёт строкой
+            "top": (json.loads(top_values) if isinstance(top_values, str) else top_values) or [],
+        }
+        if kind == "number":
+            item["min"], item["max"] = _number(nmin), _number(nmax)
+        elif kind == "date":
+            item["min"] = dmin.isoformat() if dmin else None
+            item["max"] = dmax.isoformat() if dmax else None
+        # по выборке почти уникальный ключ — во всём датасете различных значений больше
+        if sampled and filled and distinct >= filled * 0.9:
+            item["distinct_is_lower_bound"] = True
+        keys.append(item)
+
+    return {
+        "rows": total,
+        "sampled": sampled,
+        "computed_at": timezone.now().isoformat(),
+        "keys": keys,
+    }
+
+
+def _save_stats(dataset_id: int, stats: dict):
+    schema = Dataset.objects.filter(pk=dataset_id).values_list("inferred_schema", flat=True).first()
+    if schema is None:
+        return
+    schema = dict(schema) if isinstance(schema, dict) else {}
+    schema["keys"] = stats
+    Dataset.objects.filter(pk=dataset_id).update(inferred_schema=schema)
+
+
+def refresh_key_stats(dataset_id: int) -> dict:
+    """Полный пересчёт и сохранение в Dataset.inferred_schema["keys"]."""
+    archived = Dataset.objects.filter(pk=dataset_id, archived=True).values_list("inferred_schema", flat=True).first()
+    if archived is not None:
+        # строки в архиве (ingest.archive) не меняются — статистика снята до архивации
+        return (archived or {}).get("keys") or {}
+    stats = collect_key_stats(dataset_id)
+    _save_stats(dataset_id, stats)
+    return stats
+
+
+def dataset_rows_changed(dataset_id: int):
+    """
+    Строки датасета записаны/удалены — пересчитать статистику ключей (и типизированную
+    проекцию, analytics.typed_values) в фоне после коммита. Старая проекция отключается сразу.
+    """
+    if not dataset_id:
+        return
+    invalidate_typed_values(dataset_id)
+
+    def _after_commit():
+        from .tasks import enqueue, refresh_dataset_keys
+        enqueue(refresh_dataset_keys, dataset_id)
+
+    transaction.on_commit(_after_commit)
+
+
+def _schedule_refresh(dataset_id: int):
+    """
+    Полный пересчёт статистики из GET — только через брокер (при eager он шёл бы внутри запроса)
+    и не чаще раза в 10 минут на датасет; иначе — backfill командой build_typed_values --all.
+    """
+    if getattr(settings, "CELERY_TASK_ALWAYS_EAGER", False):
+        return
+    if cache.add(f"dataset-keys:refresh:{dataset_id}", 1, timeout=600):
+        from .tasks import enqueue, refresh_dataset_keys
+        enqueue(refresh_dataset_keys, dataset_id)
+
+
+def dataset_keys(dataset) -> dict:
+    """
+    Ответ /api/datasets/<id>/keys: keys_all / keys_text (не числа — для group_by) /
+    keys_number / keys_date и статистика по каждому ключу.
+    """
+    schema = dataset.inferred_schema if isinstance(dataset.inferred_schema, dict) else {}
+    stats = schema.get("keys")
+    if not isinstance(stats, dict) or "keys" not in stats:
+        # старый датасет: быстрый подсчёт по выборке, без записи в чтении; точный — в фоне
+        stats = collect_key_stats(dataset.id, sample_rows=_sample_rows())
+        _schedule_refresh(dataset.id)
+
+    keys = stats["keys"]
+    return {
+        "dataset_id": dataset.id,
+        "rows": stats["rows"],
+        "sampled": stats["sampled"],
+        "computed_at": stats["computed_at"],
+        "keys_all": [k["key"] for k in keys],
+        "keys_text": [k["key"] for k in keys if k["type"] in ("text", "bool", "date")],
+        "keys_number": [k["key"] for k in keys if k["type"] == "number"],
+        "keys_date": [k["key"] for k in keys if k["type"] == "date"],
+        "keys": keys,
+    }
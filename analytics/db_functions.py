@@ -0,0 +1,95 @@
+# analytics/db_functions.py
+"""
+SQL-функции для агрегаций по JSONB и индексы по выражениям на них.
+
+analytics_text_date(text)          — дата из 'YYYY-MM-DD...' или 'DD.MM.YYYY', иначе NULL
+                                     (без исключений: 31.02.2025 -> NULL);
+analytics_row_date(jsonb, text)    — то же для ключа строки DatasetRow.data
+                                     (с раскрытием обёртки {"parsed": {...}}).
+
+Обе IMMUTABLE — поэтому по ним можно строить индексы:
+    (dataset_id, analytics_row_date(data, '<ключ>'))
+и фильтр по диапазону дат / date_trunc по такому ключу не разбирает текст каждой строки.
+Функции ставятся на post_migrate (миграций с RunSQL в проекте нет), индексы — командой
+create_date_indexes для «горячих» ключей.
+"""
+import hashlib
+
+from django.db import connection
+
+from ingest.models import DatasetRow
+from ingest.partitioning import is_partitioned
+
+FUNCTIONS_SQL = r"""
+CREATE OR REPLACE FUNCTION analytics_text_date(v text) RETURNS date
+LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE AS $$
+    SELECT CASE
+        WHEN p.y BETWEEN 1 AND 9999 AND p.m BETWEEN 1 AND 12 AND p.d >= 1
+             AND p.d <= extract(day FROM make_date(p.y, p.m, 1) + interval '1 month - 1 day')
+        THEN make_date(p.y, p.m, p.d)
+    END
+    FROM (
+        SELECT
+            CASE WHEN v ~ '^[0-9]{4}-[0-9]{2}-[0-9]{2}' THEN substr(v, 1, 4)::int
+                 WHEN v ~ '^[0-9]{2}\.[0-9]{2}\.[0-9]{4}' THEN substr(v, 7, 4)::int END AS y,
+            CASE WHEN v ~ '^[0-9]{4}-[0-9]{2}-[0-9]{2}' THEN substr(v, 6, 2)::int
+                 WHEN v ~ '^[0-9]{2}\.[0-9]{2}\.[0-9]{4}' THEN substr(v, 4, 2)::int END AS m,
+            CASE WHEN v ~ '^[0-9]{4}-[0-9]{2}-[0-9]{2}' THEN substr(v, 9, 2)::int
+                 WHEN v ~ '^[0-9]{2}\.[0-9]{2}\.[0-9]{4}' THEN substr(v, 1, 2)::int END AS d
+    ) p
+$$;
+
+CREATE OR REPLACE FUNCTION analytics_row_date(data jsonb, key text) RETURNS date
+LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE AS $$
+    SELECT analytics_text_date(
+        CASE WHEN jsonb_typeof(data -> 'parsed') = 'object' THEN data -> 'parsed' ELSE data END ->> key
+    )
+$$;
+"""
+
+
+def install_db_functions(**kwargs):
+    """post_migrate: (пере)создать SQL-функции. Только для PostgreSQL."""
+    if connection.vendor != "postgresql":
+        return
+    with connection.cursor() as cur:
+        cur.execute(FUNCTIONS_SQL)
+
+
+def date_index_name(key: str) -> str:
+    """Имя индекса по ключу (ключи бывают кириллицей/с пробелами — берём хэш)."""
+    return "ingest_dsrow_date_" + hashlib.sha1(key.encode("utf-8")).hexdigest()[:12]
+
+
+def existing_date_indexes() -> set[str]:
+    with connection.cursor() as cur:
+        cur.execute(
+            "SELECT indexname FROM pg_indexes WHERE tablename = %s AND indexname LIKE 'ingest_dsrow_date_%%'",
+            [DatasetRow._meta.db_table],
+        )
+        return {r[0] for r in cur.fetchall()}
+
+
+def create_date_index(key: str, concurrently: bool = True) -> str:
+    """
+    Индекс (dataset_id, analytics_row_date(data, key)). CONCURRENTLY — только вне транзакции
+    (management-команда работает в autocommit) и не для секционированной таблицы
+    (там индекс создаётся на каждой секции обычным образом).
+    """
+    concurrently = concurrently and not is_partitioned()
+    name = date_index_name(key)
+    table = connection.ops.quote_name(DatasetRow._meta.db_table)
+    with connection.cursor() as cur:
+        # ключ — литералом: выражение индекса должно совпасть с выражением в запросе
+        literal = cur.mogrify("%s", [key]).decode("utf-8")
+        cur.execute(
+            f"CREATE INDEX {'CONCURRENTLY ' if concurrently else ''}IF NOT EXISTS {name} "
+            f"ON {table} (dataset_id, analytics_row_date(data, {literal}))"
+        )
+    return name
+
+
+def drop_date_index(key: str, concurrently: bool = True):
+    concurrently = concurrently and not is_partitioned()
+    with connection.cursor() as cur:
+        cur.execute(f"DROP INDEX {'CONCURRENTLY ' if concurrently else ''}IF EXISTS {date_index_name(key)}")
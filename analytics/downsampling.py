@@ -0,0 +1,148 @@
+# analytics/downsampling.py
+"""
+Ограничение размера данных графика: {"x": [...], "series": [{"name", "data"}]}.
+
+  - downsample — для упорядоченной оси (даты, числа): LTTB (Largest-Triangle-Three-Buckets)
+    или minmax (в каждом интервале — точки минимума и максимума); точки выбираются по первой
+    серии, остальные серии берутся в тех же точках — ось x у всех общая;
+  - top — N групп с наибольшим значением первой серии + группа «other» из остальных.
+
+Всё на NumPy, без циклов по точкам (цикл только по интервалам, их не больше N).
+"""
+from datetime import date
+
+import numpy as np
+
+DOWNSAMPLE_METHODS = ("lttb", "minmax")
+OTHER_KEY = "other"
+
+
+def x_positions(keys) -> np.ndarray:
+    """
+    Числовая ось для ключей: числа как есть, ISO-даты — по дням, иначе — порядковый номер.
+    Ключ None (строки без значения) — в конец оси.
+    """
+    for convert in (float, lambda k: date.fromisoformat(str(k)[:10]).toordinal()):
+        try:
+            pos = np.array([np.nan if k is None else convert(k) for k in keys], dtype=float)
+        except (TypeError, ValueError):
+            continue
+        if np.isnan(pos).all():
+            break
+        pos[np.isnan(pos)] = np.nanmax(pos) + 1
+        return pos
+    return np.arange(len(keys), dtype=float)
+
+
+def _values(data) -> np.ndarray:
+    """None -> 0 (для выбора точек; в ответ идут исходные значения)."""
+    return np.array([0 if v is None else v for v in data], dtype=float)
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n: int) -> np.ndarray:
+    """Индексы n точек по LTTB (первая и последняя точки сохраняются)."""
+    size = len(x)
+    if n >= size:
+        return np.arange(size)
+    if n < 3:
+        return np.array([0, size - 1])[:n]
+
+    # границы n-2 внутренних интервалов по точкам 1..size-2
+    edges = np.linspace(1, size - 1, n - 1).astype(int)
+    out = np.empty(n, dtype=int)
+    out[0], out[-1] = 0, size - 1
+    prev = 0
+    for i in range(n - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # среднее следующего интервала (для последнего — последняя точка)
+        nlo, nhi = (edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else (size - 1, size)
+        ax, ay = x[nlo:nhi].mean(), y[nlo:nhi].mean()
+        px, py = x[prev], y[prev]
+        area = np.abs((px - ax) * (y[lo:hi] - py) - (px - x[lo:hi]) * (ay - py))
+        prev = lo + int(area.argmax())
+        out[i + 1] = prev
+    return out
+
+
+def minmax_indices(y: np.ndarray, n: int) -> np.ndarray:
+    """Индексы не более n точек: в каждом из n/2 интервалов — минимум и максимум (по порядку оси)."""
+    size = len(y)
+    if n >= size:
+        return np.arange(size)
+    buckets = max(1, n // 2)
+    edges = np.linspace(0, size, buckets + 1).astype(int)
+    picked = []
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        if hi <= lo:
+            continue
+        part = y[lo:hi]
+        picked += [lo + int(part.argmin()), lo + int(part.argmax())]
+    return np.unique(np.array(picked, dtype=int))
+
+
+def downsample(payload: dict, n: int, method: str = "lttb") -> dict:
+    """Не больше n точек по оси x (ось должна быть упорядочена)."""
+    x = payload.get("x") or []
+    series = payload.get("series") or []
+    if n <= 0 or len(x) <= n or not series:
+        return payload
+    y = _values(series[0]["data"])
+    if method == "minmax":
+        idx = minmax_indices(y, n)
+    else:
+        idx = lttb_indices(x_positions(x), y, n)
+    idx = idx.tolist()
+    return {
+        **payload,
+        "x": [x[i] for i in idx],
+        "series": [{**s, "data": [s["data"][i] for i in idx]} for s in series],
+    }
+
+
+def _combine(values: np.ndarray, metric: str):
+    if metric in ("count", "sum"):
+        v = float(values.sum())
+    elif metric == "min":
+        v = float(values.min())
+    elif metric == "max":
+        v = float(values.max())
+    else:
+        # среднее «прочих» без числа строк в каждой группе не восстановить
+        return None
+    return int(v) if v.is_integer() and abs(v) < 2 ** 53 else v
+
+
+def top_n(payload: dict, n: int, metrics=None) -> dict:
+    """
+    n групп с наибольшим значением первой серии (по убыванию) + «other» из остальных.
+    metrics — метрика каждой серии (как объединять «прочие»: sum/count — сумма, min/max — min/max).
+    """
+    x = payload.get("x") or []
+    series = payload.get("series") or []
+    if n <= 0 or len(x) <= n + 1 or not series:
+        return payload
+    metrics = list(metrics or ["sum"] * len(series))
+    first = _values(series[0]["data"])
+    # уже свёрнутая «other» (данные ограничены при расчёте) в топ не попадает, а входит в новую
+    is_other = np.array([k == OTHER_KEY for k in x])
+    first[is_other] = -np.inf
+    # устойчивая сортировка: при равенстве — исходный порядок
+    order = np.argsort(-first, kind="stable")
+    top, rest = order[:n].tolist(), order[n:]
+
+    out_series = []
+    for s, metric in zip(series, metrics):
+        data = s["data"]
+        other_values = np.array([data[i] for i in rest.tolist() if data[i] is not None], dtype=float)
+        other = _combine(other_values, metric) if len(other_values) else None
+        out_series.append({**s, "data": [data[i] for i in top] + [other]})
+    return {**payload, "x": [x[i] for i in top] + [OTHER_KEY], "series": out_series}
+
+
+def bound_payload(payload: dict, limit: int, ordered: bool, metrics=None) -> dict:
+    """Размер ≤ limit точек: упорядоченную ось — прореживаем (LTTB), категории — top + other."""
+    if len(payload.get("x") or []) <= limit:
+        return payload
+    if ordered:
+        return downsample(payload, limit)
+    return top_n(payload, max(1, limit - 1), metrics)
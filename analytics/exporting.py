@@ -0,0 +1,148 @@
+# analytics/exporting.py
+"""
+Потоковая выгрузка всей истории handle (все approved-датасеты за диапазон дат)
+в NDJSON или CSV, опционально сразу в gzip.
+
+Память не зависит от объёма: строки читаются серверным курсором (.iterator()),
+кодируются и сжимаются кусками. Используется вьюхой ExternalHandleExportView
+и командой export_handle.
+"""
+import csv
+import io
+import json
+import zlib
+
+from django.db import connection
+
+from ingest.archive import iter_archive_records
+from ingest.models import Workbook, DatasetRow, DatasetArchive
+from .views_resolve import format_client_date, _pick_datasets_for_workbooks
+
+EXPORT_FORMATS = ("ndjson", "csv")
+CSV_META_FIELDS = ["period", "dataset_id", "version", "row_id", "imported_at"]
+
+
+def export_datasets(handle: str, date_from=None, date_to=None):
+    """[(workbook, approved dataset), ...] handle за диапазон дат — по периодам, от старых к новым."""
+    wb_qs = Workbook.objects.filter(handle=handle).order_by("period_date", "id")
+    if date_from:
+        wb_qs = wb_qs.filter(period_date__isnull=False, period_date__gte=date_from)
+    if date_to:
+        wb_qs = wb_qs.filter(period_date__isnull=False, period_date__lte=date_to)
+    wbs = list(wb_qs.only("id", "period_date"))
+    ds_by_wb = _pick_datasets_for_workbooks([wb.id for wb in wbs], "approved", strict=True)
+    return [(wb, ds_by_wb[wb.id]) for wb in wbs if wb.id in ds_by_wb]
+
+
+def iter_export_records(datasets, chunk_size: int = 2000, max_rows: int | None = None):
+    """
+    Строки датасетов по порядку (период, id) — dict'ы вида
+    {"period", "dataset_id", "version", "row_id", "imported_at", "data"}.
+    max_rows — остановиться после стольких строк (квота ключа).
+    """
+    if max_rows == 0:
+        return
+    n = 0
+    for wb, ds in datasets:
+        period = format_client_date(wb.period_date)
+        if ds.archived:
+            # архив (ingest.archive) распаковывается потоком, imported_at там уже в ISO
+            rows = ((rec["id"], rec.get("imported_at"), rec.get("data")) for rec in iter_archive_records(ds.id))
+        else:
+            rows = (DatasetRow.objects
+                    .filter(dataset_id=ds.id)
+                    .order_by("id")
+                    .values_list("id", "imported_at", "data")
+                    .iterator(chunk_size=chunk_size))
+        for row_id, imported_at, data in rows:
+            yield {
+                "period": period,
+                "dataset_id": ds.id,
+                "version": ds.version,
+                "row_id": row_id,
+                "imported_at": (imported_at.isoformat() if hasattr(imported_at, "isoformat") else imported_at),
+                "data": data if data is not None else {},
+            }
+            n += 1
+            if max_rows is not None and n >= max_rows:
+                return
+
+
+def csv_columns(datasets) -> list[str]:
+    """Колонки CSV: служебные + объединение верхнеуровневых ключей data (одним запросом в БД)."""
+    ds_ids = [ds.id for _, ds in datasets]
+    if not ds_ids:
+        return list(CSV_META_FIELDS)
+    with connection.cursor() as cur:
+        cur.execute(
+            f"""
+            SELECT k FROM (
+                SELECT DISTINCT jsonb_object_keys(data) AS k
+                FROM {DatasetRow._meta.db_table}
+                WHERE dataset_id = ANY(%s) AND jsonb_typeof(data) = 'object'
+            ) keys ORDER BY k
+            """,
+            [ds_ids],
+        )
+        keys = {r[0] for r in cur.fetchall()}
+    archived = [ds.id for _, ds in datasets if ds.archived]
+    if archived:
+        # ключи архивных датасетов сняты при архивации — без распаковки
+        for columns in DatasetArchive.objects.filter(dataset_id__in=archived).values_list("columns", flat=True):
+            keys.update(columns or [])
+    keys = sorted(keys)
+    return list(CSV_META_FIELDS) + [k for k in keys if k not in CSV_META_FIELDS]
+
+
+def _ndjson_lines(records):
+    for rec in records:
+        yield json.dumps(rec, ensure_ascii=False, default=str) + "\n"
+
+
+def _csv_lines(records, columns):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+
+    def _flush():
+        s = buf.getvalue()
+        buf.seek(0)
+        buf.truncate(0)
+        return s
+
+    writer.writerow(columns)
+    yield _flush()
+    data_columns = columns[len(CSV_META_FIELDS):]
+    for rec in records:
+        data = rec["data"] if isinstance(rec["data"], dict) else {}
+        row = [rec[c] for c in CSV_META_FIELDS]
+        for c in data_columns:
+            v = data.get(c)
+            # вложенные структуры — JSON-строкой
+            row.append(json.dumps(v, ensure_ascii=False, default=str) if isinstance(v, (dict, list)) else v)
+        writer.writerow(row)
+        yield _flush()
+
+
+def iter_export_chunks(records, fmt: str = "ndjson", gzip: bool = True, columns=None,
+                       chunk_bytes: int = 64 * 1024):
+    """Байтовые куски выгрузки (~chunk_bytes каждый); gzip — потоково через zlib (формат .gz)."""
+    lines = _csv_lines(records, columns or list(CSV_META_FIELDS)) if fmt == "csv" else _ndjson_lines(records)
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None
+
+    pending, size = [], 0
+    for line in lines:
+        b = line.encode("utf-8")
+        pending.append(b)
+        size += len(b)
+        if size >= chunk_bytes:
+            out = b"".join(pending)
+            pending, size = [], 0
+            out = compressor.compress(out) if compressor else out
+            if out:
+                yield out
+
+    out = b"".join(pending)
+    if compressor:
+        out = compressor.compress(out) + compressor.flush()
+    if out:
+        yield out
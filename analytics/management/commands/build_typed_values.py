@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from analytics.dataset_keys import refresh_key_stats
+from analytics.typed_values import build_typed_values, drop_typed_values, min_rows
+from ingest.models import Dataset
+
+
+class Command(BaseCommand):
+    help = (
+        "Типизированная проекция датасетов (numeric[]/date[] по числовым ключам и датам, DatasetTypedRow) "
+        "для существующих данных: агрегаты по ним не разбирают текст JSONB."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dataset", type=int, action="append", default=[], help="ID датасета (можно несколько раз)")
+        parser.add_argument("--all", action="store_true", help="Все датасеты без проекции")
+        parser.add_argument("--force", action="store_true",
+                            help="Строить и для датасетов меньше TYPED_VALUES_MIN_ROWS строк")
+        parser.add_argument("--drop", action="store_true", help="Удалить проекцию датасетов --dataset")
+
+    def handle(self, *args, **opts):
+        ids = list(dict.fromkeys(opts["dataset"]))
+        if opts["all"] and not opts["drop"]:
+            ids += list(
+                Dataset.objects.exclude(inferred_schema__has_key="typed").order_by("id").values_list("id", flat=True)
+            )
+        if not ids:
+            raise CommandError("нет датасетов: укажите --dataset или --all")
+
+        built = 0
+        for ds_id in ids:
+            if opts["drop"]:
+                drop_typed_values(ds_id)
+                self.stdout.write(f"drop #{ds_id}")
+                continue
+            schema = Dataset.objects.filter(pk=ds_id).values_list("inferred_schema", flat=True).first()
+            if schema is None:
+                self.stderr.write(f"#{ds_id}: not found")
+                continue
+            stats = (schema or {}).get("keys")
+            if not isinstance(stats, dict) or stats.get("sampled") or "keys" not in stats:
+                stats = refresh_key_stats(ds_id)
+            layout = build_typed_values(ds_id, stats, force=opts["force"])
+            if layout:
+                built += 1
+                self.stdout.write(self.style.SUCCESS(
+                    f"#{ds_id}: num={len(layout['num'])} date={len(layout['date'])}"
+                ))
+            else:
+                self.stdout.write(f"#{ds_id}: skip (rows < {min_rows()} or no number/date keys)")
+        self.stdout.write(f"built: {built}")
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from analytics.api_keys import generate_key
+from analytics.models import ApiKey
+
+
+class Command(BaseCommand):
+    help = "Выпустить ключ внешнего API (X-API-KEY). Ключ печатается один раз — в БД только хэш."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--name", required=True, help="Кому выдан ключ")
+        parser.add_argument("--handles", required=True, help="handle через запятую или * (все)")
+        parser.add_argument("--rate-per-minute", type=int, default=60)
+        parser.add_argument("--burst", type=int, default=20)
+        parser.add_argument("--daily-rows", type=int, default=0, help="Суточная квота строк (0 — без ограничения)")
+
+    def handle(self, *args, **opts):
+        handles = [h.strip() for h in opts["handles"].split(",") if h.strip()]
+        if not handles:
+            raise CommandError("--handles is empty")
+
+        raw, prefix, key_hash = generate_key()
+        obj = ApiKey.objects.create(
+            name=opts["name"],
+            prefix=prefix,
+            key_hash=key_hash,
+            handles=handles,
+            rate_per_minute=max(0, opts["rate_per_minute"]),
+            burst=max(1, opts["burst"]),
+            daily_row_quota=max(0, opts["daily_rows"]),
+        )
+        self.stdout.write(self.style.SUCCESS(f"ApiKey id={obj.id} ({obj.name}), handles={','.join(handles)}"))
+        self.stdout.write(raw)
@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from analytics.db_functions import (
+    install_db_functions, create_date_index, drop_date_index, date_index_name, existing_date_indexes,
+)
+from analytics.models import ChartConfig
+from ingest.models import Dataset
+
+
+class Command(BaseCommand):
+    help = (
+        "Индексы (dataset_id, analytics_row_date(data, ключ)) для «горячих» ключей дат: "
+        "фильтр date_from/date_to и bucket в /api/aggregate идут по индексу."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--key", action="append", default=[], help="Ключ даты (можно несколько раз)")
+        parser.add_argument("--auto", action="store_true",
+                            help="Ключи из ChartConfig.date_field и ключи с типом date в статистике датасетов")
+        parser.add_argument("--min-datasets", type=int, default=3,
+                            help="--auto: ключ даты должен встречаться хотя бы в стольких датасетах")
+        parser.add_argument("--drop", action="store_true", help="Удалить индексы по ключам --key")
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **opts):
+        install_db_functions()
+
+        keys = [k.strip() for k in opts["key"] if k.strip()]
+        if opts["auto"]:
+            keys += self._hot_keys(opts["min_datasets"])
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            raise CommandError("нет ключей: укажите --key или --auto")
+
+        existing = existing_date_indexes()
+        for key in keys:
+            name = date_index_name(key)
+            if opts["drop"]:
+                if not opts["dry_run"]:
+                    drop_date_index(key)
+                self.stdout.write(f"drop {name} ({key})")
+                continue
+            if name in existing:
+                self.stdout.write(f"exists {name} ({key})")
+                continue
+            if not opts["dry_run"]:
+                create_date_index(key)
+            self.stdout.write(self.style.SUCCESS(f"create {name} ({key})"))
+
+    def _hot_keys(self, min_datasets: int) -> list[str]:
+        keys = list(
+            ChartConfig.objects.exclude(date_field="").values_list("date_field", flat=True).distinct()
+        )
+        counts: dict[str, int] = {}
+        for schema in Dataset.objects.filter(inferred_schema__has_key="keys").values_list("inferred_schema", flat=True):
+            for item in (schema.get("keys") or {}).get("keys") or []:
+                if item.get("type") == "date":
+                    counts[item["key"]] = counts.get(item["key"], 0) + 1
+        keys += [k for k, n in sorted(counts.items(), key=lambda kv: -kv[1]) if n >= min_datasets]
+        return keys
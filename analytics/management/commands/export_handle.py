@@ -0,0 +1,50 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from analytics.exporting import EXPORT_FORMATS, export_datasets, iter_export_records, iter_export_chunks, csv_columns
+from analytics.views_resolve import parse_client_date
+
+
+class Command(BaseCommand):
+    help = "Выгрузить всю историю handle (approved-датасеты за диапазон дат) в NDJSON/CSV, потоково."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--handle", required=True)
+        parser.add_argument("--date-from", help="DD.MM.YYYY")
+        parser.add_argument("--date-to", help="DD.MM.YYYY")
+        parser.add_argument("--format", choices=EXPORT_FORMATS, default="ndjson")
+        parser.add_argument("--gzip", action="store_true", help="Сжать в gzip на лету")
+        parser.add_argument("--output", "-o", default="-", help="Файл (по умолчанию stdout)")
+        parser.add_argument("--chunk-size", type=int, default=2000, help="Строк за один fetch курсора")
+
+    def handle(self, *args, **opts):
+        date_from = parse_client_date(opts.get("date_from"))
+        date_to = parse_client_date(opts.get("date_to"))
+        if opts.get("date_from") and not date_from:
+            raise CommandError("bad --date-from")
+        if opts.get("date_to") and not date_to:
+            raise CommandError("bad --date-to")
+
+        datasets = export_datasets(opts["handle"], date_from, date_to)
+        if not datasets:
+            self.stderr.write(f"No approved datasets for handle={opts['handle']} in range")
+
+        fmt = opts["format"]
+        chunks = iter_export_chunks(
+            iter_export_records(datasets, chunk_size=max(1, opts["chunk_size"])),
+            fmt=fmt,
+            gzip=opts["gzip"],
+            columns=csv_columns(datasets) if fmt == "csv" else None,
+        )
+
+        out = sys.stdout.buffer if opts["output"] == "-" else open(opts["output"], "wb")
+        try:
+            total = 0
+            for chunk in chunks:
+                out.write(chunk)
+                total += len(chunk)
+        finally:
+            if out is not sys.stdout.buffer:
+                out.close()
+        self.stderr.write(f"datasets={len(datasets)} bytes={total}")
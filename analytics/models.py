@@ -1,5 +1,7 @@
 from django.db import models
 from django.conf import settings
+from django.contrib.postgres.fields import ArrayField
+from django.core.validators import RegexValidator
 from django.utils.text import slugify
 
 
@@ -33,6 +35,8 @@ class ChartConfig(models.Model):
     date_field = models.CharField(max_length=100, blank=True, default="")
     date_from = models.DateField(null=True, blank=True)
     date_to = models.DateField(null=True, blank=True)
+    # ось времени: day/week/month/quarter/year по date_field (вместо group_by)
+    date_bucket = models.CharField(max_length=10, blank=True, default="")
 
     def save(self, *args, **kwargs):
         if not self.slug:
@@ -45,3 +49,54 @@ class Meta:
             models.Index(fields=["dashboard", "order"]),
             models.Index(fields=["dataset", "published"]),
         ]
+
+
+class ChartResult(models.Model):
+    """
+    Посчитанные данные опубликованного графика ({"x", "series"}) для конкретной версии датасета
+    и набора параметров (params_hash — хэш metric/series/group_by/filters/дат ChartConfig).
+    Пересчитываются в фоне при изменении данных handle (analytics.aggregation.refresh_chart_results).
+    """
+    chart = models.ForeignKey(ChartConfig, on_delete=models.CASCADE, related_name="results")
+    dataset = models.ForeignKey('ingest.Dataset', on_delete=models.CASCADE, related_name="+")
+    dataset_version = models.PositiveIntegerField()
+    params_hash = models.CharField(max_length=40)
+    payload = models.JSONField(default=dict)
+    computed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["chart", "dataset", "dataset_version", "params_hash"],
+                name="uniq_chart_result",
+            ),
+        ]
+
+
+# handle (slug) или "*" — все handle
+handle_or_wildcard = RegexValidator(r"^(\*|[-a-zA-Z0-9_]+)\Z", "Введите handle (буквы, цифры, - и _) или *.")
+
+
+class ApiKey(models.Model):
+    """
+    Ключ внешнего API (заголовок X-API-KEY). Сам ключ не хранится — только sha256;
+    prefix — первые символы, чтобы узнать ключ в админке/логах.
+    """
+    name = models.CharField(max_length=200)
+    prefix = models.CharField(max_length=16, db_index=True)
+    key_hash = models.CharField(max_length=64, unique=True)
+    # к каким handle есть доступ ("*" — ко всем)
+    handles = ArrayField(models.CharField(max_length=64, validators=[handle_or_wildcard]), default=list, blank=True)
+    is_active = models.BooleanField(default=True)
+
+    # token bucket: пополнение rate_per_minute запросов в минуту, не больше burst подряд
+    rate_per_minute = models.PositiveIntegerField(default=60)
+    burst = models.PositiveIntegerField(default=20)
+    # сколько строк можно выгрузить за сутки (0 — без ограничения)
+    daily_row_quota = models.PositiveIntegerField(default=0)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.prefix}…)"
@@ -1,12 +1,30 @@
 # analytics/permissions.py
 from rest_framework.permissions import BasePermission
+from rest_framework.throttling import BaseThrottle
 from django.conf import settings
 
+from .api_keys import (
+    lookup_key,
+    key_allows_handle,
+    take_token,
+    rows_quota_left,
+    seconds_until_tomorrow,
+)
+
+
+def _view_handle(view):
+    get_handle = getattr(view, "get_handle", None)
+    return get_handle() if get_handle else None
+
+
 class IsAuthenticatedOrApiKey(BasePermission):
     """
     Доступ:
     - либо залогиненный пользователь
-    - либо валидный X-API-KEY
+    - либо валидный X-API-KEY:
+        * ключ из analytics.ApiKey, у которого есть доступ к handle вьюхи
+          (найденный ключ кладётся в request.api_key — для лимитов, см. ApiKeyRateThrottle);
+        * либо старый общий EXTERNAL_EKSPORT_API_KEY — только для EXTERNAL_EKSPORT_API_KEY_HANDLES
     """
 
     def has_permission(self, request, view):
@@ -14,10 +32,44 @@ def has_permission(self, request, view):
         if request.user and request.user.is_authenticated:
             return True
 
-        # API key
+        provided = request.headers.get("X-API-KEY")
+        if not provided:
+            return False
+        handle = _view_handle(view)
+
+        # старый общий ключ
         expected = getattr(settings, "EXTERNAL_EKSPORT_API_KEY", "")
-        if not expected:
+        if expected and provided == expected:
+            legacy_handles = getattr(settings, "EXTERNAL_EKSPORT_API_KEY_HANDLES", ["1-eksport", "eksport-svod"])
+            return handle is None or handle in legacy_handles
+
+        info = lookup_key(provided)
+        if not info or (handle is not None and not key_allows_handle(info, handle)):
             return False
+        request.api_key = info
+        return True
 
-        provided = request.headers.get("X-API-KEY")
-        return provided == expected
+
+class ApiKeyRateThrottle(BaseThrottle):
+    """
+    Лимиты для запросов по ключу analytics.ApiKey (пользователей и старый общий ключ не трогает):
+    token bucket по запросам и суточная квота строк (сами строки списываются во вьюхе).
+    """
+
+    def allow_request(self, request, view):
+        self._wait = None
+        info = getattr(request, "api_key", None)
+        if not info:
+            return True
+
+        self._wait = take_token(info)
+        if self._wait is not None:
+            return False
+
+        if rows_quota_left(info) == 0:
+            self._wait = seconds_until_tomorrow()
+            return False
+        return True
+
+    def wait(self):
+        return self._wait
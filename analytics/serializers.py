@@ -1,3 +1,5 @@
+from datetime import date
+
 from allauth.account.models import EmailAddress
 from dj_rest_auth.serializers import UserDetailsSerializer
 from django.contrib.auth import get_user_model
@@ -190,6 +192,12 @@ class Meta:
         fields = ["id", "data", "imported_at"]
 
 
+def handle_periods_status(request) -> str:
+    """Фильтр статуса периодов из ?status=approved|draft|all (по умолчанию approved)."""
+    status_filter = (request.query_params.get("status") or "approved").lower() if request else "approved"
+    return status_filter if status_filter in ("approved", "draft", "all") else "approved"
+
+
 class HandleRegistrySerializer(serializers.ModelSerializer):
     periods = serializers.SerializerMethodField()
     periods_detailed = serializers.SerializerMethodField()
@@ -220,13 +228,24 @@ class Meta:
             "periods_detailed",
         ]
 
+    # Вычисляемые поля берут аннотации из HandleRegistryViewSet.get_queryset (_fullname, _periods,
+    # _periods_detailed, _editable, prefetch allowed_users) — без запросов на каждый handle.
+    # Для объекта без аннотаций (например, ответ register) — прежний расчёт запросами.
+
+    def _include(self):
+        req = self.context.get("request")
+        return [s.strip() for s in (req.query_params.get("include") or "").split(",")] if req else []
+
     def get_fullname(self, obj: HandleRegistry):
         # Последнее "человеческое" имя файла из Workbook, иначе title/handle
-        qs = (Workbook.objects
-              .filter(handle=obj.handle)
-              .values_list("filename", flat=True)
-              .order_by("-period_date", "-id"))
-        last = next((f for f in qs if f), None)
+        if hasattr(obj, "_fullname"):
+            last = obj._fullname
+        else:
+            qs = (Workbook.objects
+                  .filter(handle=obj.handle)
+                  .values_list("filename", flat=True)
+                  .order_by("-period_date", "-id"))
+            last = next((f for f in qs if f), None)
         return last or (obj.title or obj.handle)
 
     def get_periods(self, obj: HandleRegistry):
@@ -234,10 +253,10 @@ def get_periods(self, obj: HandleRegistry):
         Возвращает список дат-периодов с учётом фильтра статуса (?status=approved|draft|all).
         По умолчанию — только approved (как и в periods_detailed).
         """
-        req = self.context.get("request")
-        status_filter = (req.query_params.get("status") or "approved").lower() if req else "approved"
-        if status_filter not in ("approved", "draft", "all"):
-            status_filter = "approved"
+        if hasattr(obj, "_periods"):
+            return [format_client_date(d) for d in obj._periods or []]
+
+        status_filter = handle_periods_status(self.context.get("request"))
 
         # Базовый список всех воркбуков по handle в порядке убывания даты
         wbs = (Workbook.objects
@@ -251,14 +270,14 @@ def get_periods(self, obj: HandleRegistry):
         # Иначе — включаем дату только если для этого воркбука есть датасет с нужным статусом
         periods = []
         for wb in wbs:
-            ds_exists = Dataset.objects.filter(sheet__workbook=wb, status=(
-                Dataset.STATUS_APPROVED if status_filter == "approved" else Dataset.STATUS_DRAFT
-            )).exists()
+            ds_exists = Dataset.objects.filter(sheet__workbook=wb, status=status_filter).exists()
             if ds_exists and wb.period_date:
                 periods.append(format_client_date(wb.period_date))
         return periods
 
     def get_editable(self, obj: HandleRegistry):
+        if hasattr(obj, "_editable"):
+            return bool(obj._editable)
         req = self.context.get("request")
         return user_can_edit_handle(req.user, obj.handle) if req else False
 
@@ -267,20 +286,29 @@ def get_can_upload(self, obj: HandleRegistry):
         return self.get_editable(obj)
 
     def get_periods_detailed(self, obj: HandleRegistry):
-        req = self.context.get("request")
-        include = (req.query_params.get("include") or "").split(",") if req else []
-        if "periods_detailed" not in [s.strip() for s in include]:
+        if "periods_detailed" not in self._include():
             return None
 
+        if hasattr(obj, "_periods_detailed"):
+            return [
+                {
+                    # period_date внутри JSON-агрегата — ISO-строка
+                    "period_date": format_client_date(date.fromisoformat(it["period_date"]) if it["period_date"] else None),
+                    "dataset_id": it["dataset_id"],
+                    "status": it["status"],
+                    "version": it["version"],
+                }
+                for it in obj._periods_detailed or []
+            ]
+
         # NEW: фильтр статуса из query (?status=approved|draft|all), по умолчанию approved
-        status_filter = (req.query_params.get("status") or "approved").lower() if req else "approved"
-        if status_filter not in ("approved", "draft", "all"):
-            status_filter = "approved"
+        status_filter = handle_periods_status(self.context.get("request"))
 
         items = []
         wbs = Workbook.objects.filter(handle=obj.handle).order_by("-period_date", "-id")
         for wb in wbs:
-            ds_qs = Dataset.objects.filter(sheet__workbook=wb).order_by("-created_at", "-id")
+            ds_qs = (Dataset.objects.filter(sheet__workbook=wb)
+                     .exclude(status=Dataset.STATUS_SUPERSEDED).order_by("-created_at", "-id"))
             if status_filter == "approved":
                 ds = ds_qs.filter(status=Dataset.STATUS_APPROVED).first()
             elif status_filter == "draft":
@@ -305,11 +333,10 @@ def get_allowed_user_ids(self, obj: HandleRegistry):
         Только если ?include=users — иначе возвращаем None (и DRF не положит поле).
         Это удобно, чтобы не тянуть M2M всегда.
         """
-        req = self.context.get("request")
-        include = (req.query_params.get("include") or "").split(",") if req else []
-        if "users" not in [s.strip() for s in include]:
+        if "users" not in self._include():
             return None
-        return list(obj.allowed_users.values_list("username", flat=True))
+        # allowed_users.all() — из prefetch во вьюсете
+        return [u.username for u in obj.allowed_users.all()]
 
 
 class CurrentUserSerializer(UserDetailsSerializer):
@@ -336,34 +363,25 @@ class Meta(UserDetailsSerializer.Meta):
             "profile", "allowed_handles",
         )
 
+    # groups/user_permissions/allowed_handles читаются через .all() — CurrentUserMeView
+    # отдаёт их из prefetch, так что число запросов не зависит от числа групп/handle.
+
     def get_groups(self, obj):
-        return list(obj.groups.values_list("name", flat=True))
+        return [g.name for g in obj.groups.all()]
 
     def get_permissions(self, obj):
         # при желании можно убрать, если не нужно
-        return list(obj.user_permissions.values_list("codename", flat=True))
+        return [p.codename for p in obj.user_permissions.all()]
 
     def get_allowed_handles(self, obj):
-        # obj — текущий User
-        qs = HandleRegistry.objects.filter(allowed_users=obj).order_by("handle")
-
-        # Если контекст у сериализатора есть — используем его,
-        # иначе подстрахуемся и считаем права напрямую от obj.
-        req = self.context.get("request") if hasattr(self, "context") else None
-        is_super = bool(getattr(obj, "is_superuser", False))
-
+        # obj — текущий User; allowed_handles — это и есть handle с obj в allowed_users,
+        # так что редактировать их он может (суперпользователь — тем более)
         items = []
-        for h in qs:
-            if is_super:
-                can_edit = True
-            else:
-                # без request: проверяем M2M напрямую
-                can_edit = h.allowed_users.filter(id=obj.id).exists()
-
+        for h in sorted(obj.allowed_handles.all(), key=lambda h: h.handle):
             items.append({
                 "handle": h.handle,
                 "title": h.title,
-                "editable": can_edit,
-                "can_upload": can_edit,  # сейчас одинаково; позже разведём логику
+                "editable": True,
+                "can_upload": True,  # сейчас одинаково; позже разведём логику
             })
         return items
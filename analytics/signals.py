@@ -0,0 +1,113 @@
+# analytics/signals.py
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from egovuz_provider.models import UserProfile
+from ingest.models import HandleRegistry
+from . import access
+from .aggregation import invalidate_chart_results
+from .api_keys import forget_key
+from .caching import bump_handle_generation, bump_user_generation, bump_all_users_generation
+from .models import ApiKey, ChartConfig
+from .tasks import enqueue, refresh_chart_results
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=HandleRegistry)
+@receiver(post_delete, sender=HandleRegistry)
+def handle_registry_changed(sender, instance, **kwargs):
+    """Заголовок/иконка/группа и т.п. входят в кэшированные карточки — сбрасываем."""
+    bump_handle_generation(instance.handle)
+    # переименование/удаление handle меняет наборы прав (удаление — без m2m-сигналов)
+    access.forget_all()
+    # и allowed_handles в /api/auth/me у всех, кому он назначен
+    bump_all_users_generation()
+
+
+@receiver(m2m_changed, sender=HandleRegistry.allowed_users.through)
+def handle_allowed_users_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """allowed_user_ids карточки зависит от allowed_users."""
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        bump_handle_generation(instance.handle)
+    elif pk_set:
+        # user.allowed_handles.add(...) — instance это пользователь
+        bump_handle_generation(*HandleRegistry.objects.filter(pk__in=pk_set).values_list("handle", flat=True))
+    else:
+        # post_clear со стороны пользователя: pk_set неизвестен — сбрасываем все handle
+        bump_handle_generation(*HandleRegistry.objects.values_list("handle", flat=True))
+
+
+@receiver(m2m_changed, sender=HandleRegistry.allowed_users.through)
+def handle_allowed_users_access(sender, instance, action, reverse, pk_set, **kwargs):
+    """Кэш прав редактирования (analytics.access) и /api/auth/me — у затронутых пользователей."""
+    user_ids = _m2m_user_ids(instance, action, reverse, pk_set, "allowed_users")
+    access.forget_users(*user_ids)
+    bump_user_generation(*user_ids)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def user_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Группы/права пользователя — в /api/auth/me и в кэше групп (analytics.access)."""
+    user_ids = _m2m_user_ids(instance, action, reverse, pk_set, "user_set")
+    if sender is User.groups.through:
+        access.forget_groups(*user_ids)
+    bump_user_generation(*user_ids)
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def group_changed(sender, instance, **kwargs):
+    """Имя группы входит в закэшированные наборы; удаление чистит m2m без сигналов."""
+    access.forget_all_groups()
+    bump_all_users_generation()
+
+
+def _m2m_user_ids(instance, action, reverse, pk_set, users_attr: str) -> list:
+    """
+    Чьи данные затронуло изменение m2m «пользователь — X».
+    reverse=False — instance это X (handle/группа/право), пользователи в pk_set;
+    reverse=True — instance это пользователь. После clear() pk_set не передаётся,
+    поэтому участников запоминаем на pre_clear.
+    """
+    user_side = reverse if users_attr == "allowed_users" else not reverse
+    if user_side:
+        return [instance.pk] if action in ("post_add", "post_remove", "post_clear") else []
+    if action == "pre_clear":
+        instance._cleared_user_ids = list(getattr(instance, users_attr).values_list("pk", flat=True))
+        return []
+    if action in ("post_add", "post_remove"):
+        return list(pk_set or ())
+    if action == "post_clear":
+        return getattr(instance, "_cleared_user_ids", [])
+    return []
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def user_or_profile_changed(sender, instance, **kwargs):
+    bump_user_generation(instance.pk if sender is User else instance.user_id)
+
+
+@receiver(post_save, sender=ApiKey)
+@receiver(post_delete, sender=ApiKey)
+def api_key_changed(sender, instance, **kwargs):
+    """Ключ отключили/поменяли handle или лимиты — не ждём истечения кэша."""
+    forget_key(instance.key_hash)
+
+
+@receiver(post_save, sender=ChartConfig)
+def chart_config_changed(sender, instance, **kwargs):
+    """Опубликованный график — пересчитать сохранённые данные в фоне; снятый с публикации — удалить."""
+    chart_id = instance.pk
+    if instance.published:
+        transaction.on_commit(lambda: enqueue(refresh_chart_results, chart_ids=[chart_id]))
+    else:
+        invalidate_chart_results(chart_ids=[chart_id])
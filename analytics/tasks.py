@@ -1,7 +1,25 @@
 # analytics/tasks.py
+import logging
+
 from celery import shared_task
 from django.core.management import call_command
 
+logger = logging.getLogger(__name__)
+
+
+def enqueue(task, *args, **kwargs):
+    """
+    Поставить задачу в очередь из transaction.on_commit: ответ уже не откатить, поэтому ошибка
+    постановки (брокер недоступен) или — при CELERY_TASK_ALWAYS_EAGER — самой задачи пишется
+    в лог, а не превращается в 500 после коммита. Фоновыми пересчёты становятся только
+    с брокером и воркером (CELERY_TASK_ALWAYS_EAGER=0, CELERY_BROKER_URL).
+    """
+    try:
+        return task.apply_async(args=args, kwargs=kwargs)
+    except Exception:
+        logger.exception("analytics: задача %s не поставлена", task.name)
+        return None
+
 @shared_task(bind=True)
 def import_excel_task(
     self,
@@ -31,3 +49,59 @@ def import_excel_task(
     # Важно: path не передаём — команда сама возьмёт wb.file.path по workbook_id
     call_command("import_excel", **opts)
     return {"ok": True, "workbook_id": workbook_id}
+
+
+@shared_task(bind=True)
+def warm_dashboard_cache(self, handles=None, periods=None):
+    """
+    Прогрев кэша карточек дашборда (после approve/загрузки/импорта и по расписанию).
+    handles=None — все видимые handle; periods — сколько последних периодов греть.
+    """
+    from .views_dashboard_cards_rows import warm_dashboard_cards
+
+    warmed = warm_dashboard_cards(handles=handles, periods=periods)
+    return {"ok": True, "handles": handles, "cards": warmed}
+
+
+@shared_task(bind=True)
+def refresh_chart_results(self, handles=None, chart_ids=None):
+    """Пересчёт сохранённых данных опубликованных графиков (ChartResult)."""
+    from .aggregation import refresh_chart_results as _refresh
+
+    refreshed = _refresh(handles=handles, chart_ids=chart_ids)
+    return {"ok": True, "handles": handles, "charts": refreshed}
+
+
+@shared_task(bind=True)
+def refresh_dataset_keys(self, dataset_id: int):
+    """
+    Пересчёт статистики ключей датасета (Dataset.inferred_schema["keys"]) и по ней —
+    типизированной проекции числовых ключей и дат (DatasetTypedRow).
+    """
+    from .dataset_keys import refresh_key_stats
+    from .typed_values import build_typed_values
+
+    stats = refresh_key_stats(dataset_id)
+    layout = build_typed_values(dataset_id, stats)
+    return {"ok": True, "dataset_id": dataset_id, "keys": len(stats["keys"]), "typed": layout}
+
+
+@shared_task(bind=True)
+def gc_dataset_versions(self, grace_seconds=None):
+    """Удаление superseded-версий датасетов (ingest.versioning) — по расписанию."""
+    from ingest.versioning import gc_superseded_versions
+
+    deleted = gc_superseded_versions(grace_seconds=grace_seconds)
+    return {"ok": True, "deleted": deleted}
+
+
+@shared_task(bind=True)
+def archive_old_datasets(self, keep_periods=None, limit=None):
+    """Старые периоды -> холодный архив (ingest.archive) — по расписанию; заодно снять устаревшие развёртки архивов."""
+    from ingest.archive import archive_candidates, archive_dataset, unstage_archives
+
+    archived = []
+    for ds_id in archive_candidates(keep=keep_periods, limit=limit):
+        if archive_dataset(ds_id) is not None:
+            archived.append(ds_id)
+    return {"ok": True, "archived": archived, "unstaged": unstage_archives()}
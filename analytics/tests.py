@@ -1,3 +1,267 @@
-from django.test import TestCase
+import csv
+import gzip
+import hashlib
+import io
+import json
+from types import SimpleNamespace
+from datetime import datetime, timezone as dt_timezone
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.test import SimpleTestCase, override_settings
+
+from . import api_keys
+from .checks import shared_cache_check
+from .downsampling import OTHER_KEY, bound_payload, downsample, lttb_indices, minmax_indices, top_n, x_positions
+from .exporting import CSV_META_FIELDS, iter_export_chunks
+from .models import ApiKey
+from .tasks import enqueue
+from .views_common import user_editable_handles
+from .views_changes import decode_cursor, encode_cursor
+from .views_dashboard_cards_rows import _dashboard_params
+from .views_external_eksport import _clamp_to_quota
+
+
+class DashboardParamsTests(SimpleTestCase):
+    def test_defaults(self):
+        params = _dashboard_params({})
+        self.assertEqual(params["rows_limit"], 5000)
+        self.assertEqual(params["grid_offset"], 0)
+        self.assertEqual(params["handles"], [])
+        self.assertTrue(params["compact"])
+
+    def test_clamps(self):
+        params = _dashboard_params({"rows_limit": "999999", "grid_offset": "-5", "handles": " a, ,b "})
+        self.assertEqual(params["rows_limit"], 50000)
+        self.assertEqual(params["grid_offset"], 0)
+        self.assertEqual(params["handles"], ["a", "b"])
+
+    def test_not_integers(self):
+        for bad in ({"grid_offset": "abc"}, {"rows_limit": "1.5"}):
+            with self.assertRaises(ValueError):
+                _dashboard_params(bad)
+
+
+class EditableHandlesTests(SimpleTestCase):
+    def test_superuser_short_circuit(self):
+        # без запросов в БД: суперпользователь редактирует всё
+        user = SimpleNamespace(is_authenticated=True, is_superuser=True)
+        self.assertEqual(user_editable_handles(user, ["a", "b", ""]), {"a", "b"})
+
+    def test_anonymous(self):
+        user = SimpleNamespace(is_authenticated=False, is_superuser=False)
+        self.assertEqual(user_editable_handles(user, ["a"]), set())
+
+
+class EnqueueTests(SimpleTestCase):
+    def test_task_error_is_logged_not_raised(self):
+        class Failing:
+            name = "failing"
+
+            def apply_async(self, args=None, kwargs=None):
+                raise RuntimeError("boom")
+
+        with self.assertLogs("analytics.tasks", level="ERROR"):
+            self.assertIsNone(enqueue(Failing(), 1, x=2))
+
+    def test_passes_arguments(self):
+        class Recording:
+            name = "recording"
+
+            def apply_async(self, args=None, kwargs=None):
+                return args, kwargs
+
+        self.assertEqual(enqueue(Recording(), 1, x=2), ((1,), {"x": 2}))
+
+
+LOCMEM = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+REDIS = {"default": {"BACKEND": "django_redis.cache.RedisCache", "LOCATION": "redis://127.0.0.1:6379/2"}}
+
+
+class SharedCacheCheckTests(SimpleTestCase):
+    @override_settings(CACHES=LOCMEM, SHARED_CACHE_REQUIRED=True)
+    def test_locmem_in_production_is_error(self):
+        self.assertEqual([m.id for m in shared_cache_check(None)], ["analytics.E001"])
+
+    @override_settings(CACHES=LOCMEM, SHARED_CACHE_REQUIRED=False)
+    def test_locmem_in_debug_is_warning(self):
+        self.assertEqual([m.id for m in shared_cache_check(None)], ["analytics.W001"])
+
+    @override_settings(CACHES=REDIS, SHARED_CACHE_REQUIRED=True)
+    def test_redis_ok(self):
+        self.assertEqual(shared_cache_check(None), [])
+
+
+class ApiKeyHashTests(SimpleTestCase):
+    def test_hash_is_sha256(self):
+        self.assertEqual(api_keys.hash_key("ak_x"), hashlib.sha256(b"ak_x").hexdigest())
+
+    def test_generate_key(self):
+        raw, prefix, key_hash = api_keys.generate_key()
+        self.assertTrue(raw.startswith(f"ak_{prefix}_"))
+        self.assertEqual(key_hash, api_keys.hash_key(raw))
+        self.assertNotEqual(api_keys.generate_key()[0], raw)
+
+
+class ApiKeyHandlesTests(SimpleTestCase):
+    def test_wildcard_and_slugs(self):
+        field = ApiKey._meta.get_field("handles").formfield()
+        self.assertEqual(field.clean("*,sales,fin_2"), ["*", "sales", "fin_2"])
+
+    def test_model_validation(self):
+        # ModelForm проверяет элементы через full_clean модели
+        field = ApiKey._meta.get_field("handles")
+        self.assertEqual(field.clean(["*", "sales"], None), ["*", "sales"])
+        for bad in (["sales", "a b"], ["**"], ["sales/*"]):
+            with self.assertRaises(ValidationError):
+                field.clean(bad, None)
+
+
+class TokenBucketTests(SimpleTestCase):
+    info = {"id": -1, "rate_per_minute": 60, "burst": 3}
+
+    def setUp(self):
+        cache.delete(api_keys.BUCKET_CACHE.format(id=self.info["id"]))
+
+    def test_burst_then_wait_then_refill(self):
+        with mock.patch.object(api_keys.time, "time", return_value=1000.0):
+            self.assertEqual([api_keys.take_token(self.info) for _ in range(3)], [None, None, None])
+            self.assertAlmostEqual(api_keys.take_token(self.info), 1.0)
+        with mock.patch.object(api_keys.time, "time", return_value=1001.0):
+            self.assertIsNone(api_keys.take_token(self.info))
+            self.assertIsNotNone(api_keys.take_token(self.info))
+
+    def test_zero_rate_is_unlimited(self):
+        info = {**self.info, "rate_per_minute": 0}
+        self.assertEqual([api_keys.take_token(info) for _ in range(10)], [None] * 10)
+
+
+class QuotaClampTests(SimpleTestCase):
+    def _rows(self, n):
+        return {"rows": [{"id": i} for i in range(n)]}
+
+    def test_one_budget_for_all_datasets(self):
+        results, used, truncated = _clamp_to_quota([self._rows(3), self._rows(3), self._rows(3)], 5)
+        self.assertEqual([len(m["rows"]) for m in results], [3, 2])
+        self.assertEqual((used, truncated), (5, True))
+
+    def test_snapshot_without_rows_costs_one(self):
+        results, used, truncated = _clamp_to_quota([{"data": {}}, {"data": {}}, {"data": {}}], 2)
+        self.assertEqual((len(results), used, truncated), (2, 2, True))
+
+    def test_no_quota(self):
+        results, used, truncated = _clamp_to_quota([self._rows(3), {"data": {}}], None)
+        self.assertEqual((len(results), used, truncated), (2, 4, False))
+
+    def test_fits(self):
+        _, used, truncated = _clamp_to_quota([self._rows(2), self._rows(3)], 5)
+        self.assertEqual((used, truncated), (5, False))
+
+
+def _export_records(n):
+    for i in range(n):
+        yield {"period": "01.01.2025", "dataset_id": 1, "version": 1, "row_id": i,
+               "imported_at": "2025-01-01T00:00:00", "data": {"a": i, "t": "тест", "n": {"x": [i]}}}
+
+
+class ExportChunksTests(SimpleTestCase):
+    def test_ndjson(self):
+        out = b"".join(iter_export_chunks(_export_records(3), fmt="ndjson", gzip=False))
+        lines = out.decode("utf-8").splitlines()
+        self.assertEqual([json.loads(line)["row_id"] for line in lines], [0, 1, 2])
+        self.assertEqual(json.loads(lines[0])["data"]["t"], "тест")
+
+    def test_gzip_is_one_stream(self):
+        plain = b"".join(iter_export_chunks(_export_records(500), gzip=False))
+        chunks = list(iter_export_chunks(_export_records(500), gzip=True, chunk_bytes=1024))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(gzip.decompress(b"".join(chunks)), plain)
+
+    def test_chunk_size(self):
+        chunks = list(iter_export_chunks(_export_records(500), gzip=False, chunk_bytes=4096))
+        self.assertTrue(all(len(c) >= 4096 for c in chunks[:-1]))
+
+    def test_csv(self):
+        columns = CSV_META_FIELDS + ["a", "missing", "n"]
+        out = b"".join(iter_export_chunks(_export_records(2), fmt="csv", gzip=False, columns=columns))
+        rows = list(csv.reader(io.StringIO(out.decode("utf-8"))))
+        self.assertEqual(rows[0], columns)
+        self.assertEqual(rows[2][len(CSV_META_FIELDS):], ["1", "", '{"x": [1]}'])
+
+    def test_empty(self):
+        self.assertEqual(b"".join(iter_export_chunks(iter(()), gzip=False)), b"")
+        self.assertEqual(gzip.decompress(b"".join(iter_export_chunks(iter(()), gzip=True))), b"")
+
+
+class ChangesCursorTests(SimpleTestCase):
+    def test_round_trip(self):
+        ts = datetime(2025, 3, 1, 12, 30, 15, 123456, tzinfo=dt_timezone.utc)
+        cursor = encode_cursor(ts, 42)
+        self.assertNotIn("=", cursor)
+        self.assertEqual(decode_cursor(cursor), (ts, 42))
+
+    def test_bad_cursor(self):
+        for bad in ("", "!!!", encode_cursor(datetime(2025, 1, 1), 1)[:-3], "WyJ4IiwgMV0"):
+            with self.assertRaises(ValueError):
+                decode_cursor(bad)
+
+
+class DownsamplingTests(SimpleTestCase):
+    def _payload(self, n):
+        x = list(range(n))
+        return {"x": x, "series": [{"name": "a", "data": [float(np.sin(i / 5)) for i in x]},
+                                   {"name": "b", "data": list(x)}]}
+
+    def test_x_positions(self):
+        self.assertEqual(x_positions(["3", 1, None]).tolist(), [3.0, 1.0, 4.0])
+        self.assertEqual(np.diff(x_positions(["2025-01-01", "2025-01-03T10:00"])).tolist(), [2.0])
+        self.assertEqual(x_positions(["b", "a"]).tolist(), [0.0, 1.0])
+
+    def test_lttb_keeps_ends_and_size(self):
+        y = np.sin(np.arange(1000) / 20)
+        idx = lttb_indices(np.arange(1000, dtype=float), y, 50)
+        self.assertEqual(len(idx), 50)
+        self.assertEqual((idx[0], idx[-1]), (0, 999))
+        self.assertTrue((np.diff(idx) > 0).all())
+
+    def test_lttb_keeps_spike(self):
+        y = np.zeros(1000)
+        y[500] = 100
+        self.assertIn(500, lttb_indices(np.arange(1000, dtype=float), y, 20).tolist())
+
+    def test_minmax(self):
+        y = np.zeros(1000)
+        y[123], y[877] = -5, 7
+        idx = minmax_indices(y, 20).tolist()
+        self.assertLessEqual(len(idx), 20)
+        self.assertIn(123, idx)
+        self.assertIn(877, idx)
+
+    def test_downsample_keeps_series_aligned(self):
+        out = downsample(self._payload(300), 30)
+        self.assertEqual(len(out["x"]), 30)
+        # вторая серия берётся в тех же точках оси
+        self.assertEqual(out["series"][1]["data"], out["x"])
+        self.assertEqual(downsample(self._payload(10), 30)["x"], list(range(10)))
+
+    def test_top_n(self):
+        payload = {"x": ["a", "b", "c", "d", OTHER_KEY],
+                   "series": [{"name": "s", "data": [1, 5, 3, None, 2]}, {"name": "m", "data": [9, 1, 4, 2, 8]}]}
+        out = top_n(payload, 2, metrics=["sum", "max"])
+        self.assertEqual(out["x"], ["b", "c", OTHER_KEY])
+        self.assertEqual(out["series"][0]["data"], [5, 3, 3])
+        self.assertEqual(out["series"][1]["data"], [1, 4, 9])
+
+    def test_top_n_avg_other_unknown(self):
+        payload = {"x": ["a", "b", "c"], "series": [{"name": "s", "data": [1, 2, 3]}]}
+        self.assertEqual(top_n(payload, 1, metrics=["avg"])["series"][0]["data"], [3, None])
+
+    def test_bound_payload(self):
+        self.assertEqual(len(bound_payload(self._payload(100), 10, ordered=True)["x"]), 10)
+        out = bound_payload(self._payload(100), 10, ordered=False)
+        self.assertEqual(len(out["x"]), 10)
+        self.assertEqual(out["x"][-1], OTHER_KEY)
+        small = self._payload(5)
+        self.assertIs(bound_payload(small, 10, ordered=True), small)
@@ -0,0 +1,125 @@
+# analytics/typed_values.py
+"""
+Типизированная проекция датасета (ingest.DatasetTypedRow): на каждую строку — numeric[] по числовым
+ключам и date[] по ключам дат, разобранные один раз при записи, а не в каждом агрегате
+(regexp + ::numeric по тексту JSONB на каждую строку на каждый запрос).
+
+Какие ключи — по статистике ключей (analytics.dataset_keys): тип number / date. Раскладка
+(порядок ключей в массивах) хранится в Dataset.inferred_schema["typed"]; агрегаты
+(analytics.aggregation.RowSource) используют проекцию, только пока "typed" есть.
+
+  - при записи строк (dataset_rows_changed) "typed" снимается сразу, в той же транзакции —
+    проекция устарела и не используется;
+  - после пересчёта статистики ключей в фоне (tasks.refresh_dataset_keys) проекция
+    строится заново целиком и "typed" ставится обратно;
+  - маленькие датасеты (меньше TYPED_VALUES_MIN_ROWS строк) не проецируются — им хватает JSON.
+
+Для существующих датасетов — команда build_typed_values.
+"""
+import json
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from ingest.models import Dataset, DatasetRow, DatasetTypedRow
+from .aggregation import ROW_DATA_SQL, date_sql, numeric_sql
+
+# numeric(38, 10): значения по модулю больше не помещаются — такой ключ не проецируем
+MAX_ABS_NUMBER = 10 ** 27
+
+
+def min_rows() -> int:
+    return int(getattr(settings, "TYPED_VALUES_MIN_ROWS", 5000))
+
+
+def typed_layout_for(stats: dict) -> dict:
+    """Раскладка проекции по статистике ключей: {"num": [...], "date": [...]} (по алфавиту)."""
+    num, dates = [], []
+    for item in (stats or {}).get("keys") or []:
+        if item.get("type") == "number":
+            bounds = [abs(v) for v in (item.get("min"), item.get("max")) if v is not None]
+            if all(v < MAX_ABS_NUMBER for v in bounds):
+                num.append(item["key"])
+        elif item.get("type") == "date":
+            dates.append(item["key"])
+    return {"num": sorted(num), "date": sorted(dates)}
+
+
+def _set_layout(dataset_id: int, layout: dict | None):
+    with connection.cursor() as cur:
+        if layout is None:
+            cur.execute(
+                f"UPDATE {Dataset._meta.db_table} SET inferred_schema = inferred_schema - 'typed' "
+                "WHERE id = %s AND inferred_schema ? 'typed'",
+                [int(dataset_id)],
+            )
+        else:
+            cur.execute(
+                f"UPDATE {Dataset._meta.db_table} "
+                "SET inferred_schema = coalesce(inferred_schema, '{}'::jsonb) || jsonb_build_object('typed', %s::jsonb) "
+                "WHERE id = %s",
+                [json.dumps(layout, ensure_ascii=False), int(dataset_id)],
+            )
+
+
+def invalidate_typed_values(dataset_id: int):
+    """Строки датасета меняются — проекция больше не совпадает с ними (вызывать в транзакции записи)."""
+    if dataset_id:
+        _set_layout(dataset_id, None)
+
+
+def build_typed_values(dataset_id: int, stats: dict | None = None, force: bool = False) -> dict | None:
+    """
+    Построить проекцию датасета заново (один INSERT ... SELECT) и сохранить раскладку.
+    stats — статистика ключей (иначе — из inferred_schema["keys"]). Возвращает раскладку
+    или None, если проекция датасету не нужна (мало строк, нет числовых/дат ключей).
+    """
+    with transaction.atomic():
+        # блокировка датасета: запись строк (invalidate_typed_values) ждёт построения или наоборот
+        ds = (Dataset.objects.select_for_update()
+              .filter(pk=dataset_id, archived=False)  # строк архивного датасета в таблице нет
+              .only("id", "inferred_schema").first())
+        if ds is None:
+            return None
+        schema = ds.inferred_schema if isinstance(ds.inferred_schema, dict) else {}
+        stats = stats or schema.get("keys") or {}
+        layout = typed_layout_for(stats)
+
+        DatasetTypedRow.objects.filter(dataset_id=ds.id).delete()
+        if (not force and (stats.get("rows") or 0) < min_rows()) or not (layout["num"] or layout["date"]):
+            _set_layout(ds.id, None)
+            return None
+
+        num_sql, num_params = [], []
+        for key in layout["num"]:
+            sql, params = numeric_sql(key)
+            num_sql.append(sql)
+            num_params += params
+        date_exprs, date_params = [], []
+        for key in layout["date"]:
+            sql, params = date_sql(key)
+            date_exprs.append(sql)
+            date_params += params
+
+        with connection.cursor() as cur:
+            cur.execute(
+                f"""
+                INSERT INTO {DatasetTypedRow._meta.db_table} (row_id, dataset_id, nums, dates)
+                SELECT d.id, d.dataset_id, ARRAY[{", ".join(num_sql)}]::numeric[],
+                       ARRAY[{", ".join(date_exprs)}]::date[]
+                FROM (
+                    SELECT r.id, r.dataset_id, r.data AS raw, {ROW_DATA_SQL} AS data
+                    FROM {DatasetRow._meta.db_table} r
+                    WHERE r.dataset_id = %s
+                ) d
+                """,
+                num_params + date_params + [ds.id],
+            )
+        _set_layout(ds.id, layout)
+    return layout
+
+
+def drop_typed_values(dataset_id: int):
+    with transaction.atomic():
+        _set_layout(dataset_id, None)
+        DatasetTypedRow.objects.filter(dataset_id=dataset_id).delete()
@@ -1,4 +1,4 @@
-from django.urls import path
+from django.urls import path, re_path
 from rest_framework.routers import DefaultRouter
 from .views import HandleRegistryViewSet, UploadHistoryView
 from .views_egov_identity import EgovPinppLookupView
@@ -7,7 +7,13 @@
 from .views_ingest_upload import UploadXLSXView
 from .views_resolve import DatasetStatusUpdateView
 from .views_users import UserViewSet, CurrentUserMeView
+from .views_changes import ChangesFeedView
+from .views_series import HandleSeriesView
+from .views_aggregate import AggregateView, ChartDataView, DashboardChartsDataView, DatasetKeysView
+from .views_async import dashboard_cards_rows_async, resolve_rows_async
 from .views_external_eksport import (
+    ExternalHandleRowsView,
+    ExternalHandleExportView,
     ExternalEksportRowsView,
     ExternalEksportSvodRowsView,
 )
@@ -19,8 +25,21 @@
 urlpatterns = [
     path("dashboard/cards/rows/", DashboardCardsRowsView.as_view(), name="dashboard-cards-rows"),
     path("datasets/resolve/rows/", ResolveRowsView.as_view(), name="dataset-resolve-rows"),
+    # async-варианты (имеют смысл под ASGI/uvicorn)
+    path("async/dashboard/cards/rows/", dashboard_cards_rows_async, name="dashboard-cards-rows-async"),
+    path("async/datasets/resolve/rows/", resolve_rows_async, name="dataset-resolve-rows-async"),
     path("external/1-eksport/rows/", ExternalEksportRowsView.as_view(), name="external-1-eksport-rows"),
     path("external/eksport-svod/rows/", ExternalEksportSvodRowsView.as_view(), name="external-eksport-svod-rows"),
+    path("external/<slug:handle>/rows/", ExternalHandleRowsView.as_view(), name="external-handle-rows"),
+    path("external/<slug:handle>/export/", ExternalHandleExportView.as_view(), name="external-handle-export"),
+    path("changes/", ChangesFeedView.as_view(), name="changes-feed"),
+    # до router.urls: handles/<pk>/ — маршруты HandleRegistryViewSet
+    path("handles/<slug:handle>/series/", HandleSeriesView.as_view(), name="handle-series"),
+    # фронт зовёт /api/aggregate?... без слэша
+    re_path(r"^aggregate/?$", AggregateView.as_view(), name="aggregate"),
+    path("charts/<int:pk>/data/", ChartDataView.as_view(), name="chart-data"),
+    path("dashboards/<int:pk>/charts/data/", DashboardChartsDataView.as_view(), name="dashboard-charts-data"),
+    re_path(r"^datasets/(?P<pk>\d+)/keys/?$", DatasetKeysView.as_view(), name="dataset-keys"),
     path("datasets/status/", DatasetStatusUpdateView.as_view(), name="dataset-status-update"),
     path("upload-history/", UploadHistoryView.as_view(), name="upload-history"),
     path("ingest/upload-xlsx/", UploadXLSXView.as_view(), name="ingest-upload-xlsx"),
@@ -1,5 +1,7 @@
-from django.db.models import CharField, F, Window, Q
-from django.db.models.functions import Cast, RowNumber
+from django.contrib.auth import get_user_model
+from django.contrib.postgres.expressions import ArraySubquery
+from django.db.models import CharField, F, Window, Q, Exists, OuterRef, Prefetch, Subquery, Value
+from django.db.models.functions import Cast, JSONObject, RowNumber
 from django.db.models import Count
 from rest_framework import viewsets, filters, permissions, status
 from django_filters.rest_framework import DjangoFilterBackend
@@ -9,11 +11,67 @@
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from ingest.models import Dataset, DatasetRow, HandleRegistry, UploadHistory
-from .serializers import DatasetSerializer, DatasetRowSerializer, HandleRegistrySerializer
+from ingest.models import Dataset, DatasetRow, HandleRegistry, UploadHistory, Workbook
+from .serializers import DatasetSerializer, DatasetRowSerializer, HandleRegistrySerializer, handle_periods_status
 from .views_resolve import format_client_date, parse_client_date
 
 
+def _handle_datasets(status_filter: str):
+    """Датасеты воркбука OuterRef("pk") с нужным статусом (all — любые), свежие первыми."""
+    qs = Dataset.objects.filter(sheet__workbook=OuterRef("pk")).exclude(status=Dataset.STATUS_SUPERSEDED)
+    if status_filter != "all":
+        qs = qs.filter(status=status_filter)
+    return qs.order_by("-created_at", "-id")
+
+
+def _annotate_handles_for_serializer(qs, request):
+    """
+    Всё, что нужно HandleRegistrySerializer, — подзапросами в том же SELECT
+    (без запросов на каждый handle):
+      _fullname          — последнее непустое имя файла;
+      _periods           — даты периодов с датасетом нужного статуса (?status=);
+      _periods_detailed  — по запросу include=periods_detailed;
+      _editable          — может ли текущий пользователь редактировать handle;
+    allowed_users — prefetch по запросу include=users.
+    """
+    include = [s.strip() for s in (request.query_params.get("include") or "").split(",")]
+    status_filter = handle_periods_status(request)
+
+    wbs = Workbook.objects.filter(handle=OuterRef("handle")).order_by("-period_date", "-id")
+    with_status = wbs if status_filter == "all" else wbs.filter(Exists(_handle_datasets(status_filter)))
+
+    qs = qs.annotate(
+        _fullname=Subquery(wbs.exclude(filename__isnull=True).exclude(filename="").values("filename")[:1]),
+        _periods=ArraySubquery(with_status.filter(period_date__isnull=False).values("period_date")),
+    )
+
+    user = request.user
+    if user.is_superuser:
+        qs = qs.annotate(_editable=Value(True))
+    else:
+        qs = qs.annotate(_editable=Exists(
+            HandleRegistry.allowed_users.through.objects.filter(handleregistry_id=OuterRef("pk"), user_id=user.id)
+        ))
+
+    if "periods_detailed" in include:
+        ds = _handle_datasets(status_filter)
+        detailed = wbs.annotate(_ds_id=Subquery(ds.values("id")[:1]))
+        if status_filter != "all":
+            detailed = detailed.filter(_ds_id__isnull=False)
+        qs = qs.annotate(_periods_detailed=ArraySubquery(detailed.values(item=JSONObject(
+            period_date="period_date",
+            dataset_id="_ds_id",
+            status=Subquery(ds.values("status")[:1]),
+            version=Subquery(ds.values("version")[:1]),
+        ))))
+
+    if "users" in include:
+        qs = qs.prefetch_related(
+            Prefetch("allowed_users", queryset=get_user_model().objects.only("id", "username"))
+        )
+    return qs
+
+
 class HandleRegistryViewSet(viewsets.ModelViewSet):
     """
     /api/handles/ — список хэндлов для сайдбара/меню.
@@ -101,7 +159,7 @@ def get_queryset(self):
         mine = (self.request.query_params.get("mine") or "").lower() in ("1", "true", "yes")
         if mine and not self.request.user.is_superuser:
             qs = qs.filter(allowed_users=self.request.user)
-        return qs
+        return _annotate_handles_for_serializer(qs, self.request)
 
 
 class UploadHistoryView(APIView):
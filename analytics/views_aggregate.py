@@ -0,0 +1,107 @@
+# analytics/views_aggregate.py
+from django.shortcuts import get_object_or_404
+from rest_framework.views import APIView
+from rest_framework.response import Response
+from rest_framework.permissions import IsAuthenticated
+
+from ingest.models import Dataset
+from .models import ChartConfig, Dashboard
+from .dataset_keys import dataset_keys
+from .aggregation import (
+    AggregationError, aggregate, aggregate_params, chart_data, stored_chart_data, stored_charts_data,
+    shape_chart_payload, shape_params,
+)
+
+
+def _charts_qs():
+    return ChartConfig.objects.select_related("dataset").only(
+        "id", "title", "dataset_id", "group_by", "metric", "series", "filters",
+        "date_field", "date_from", "date_to", "date_bucket", "published", "dataset__version",
+    )
+
+
+class AggregateView(APIView):
+    """
+    GET /api/aggregate?dataset_id=..&metric=sum:amount|count&group_by=..
+        &date_field=..&date_from=..&date_to=..&bucket=day|week|month|quarter|year
+        &filters[key]=v&exclude[key]=v&limit=..
+        &top=N | &downsample=N&downsample_method=lttb|minmax
+
+    -> {"data": [{"key", "value"}, ...]}
+    Считается одним GROUP BY в PostgreSQL (см. analytics/aggregation.py).
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        try:
+            params = aggregate_params(request.query_params)
+            rows = aggregate(**params)
+        except AggregationError as e:
+            return Response({"detail": str(e)}, status=400)
+        return Response({"data": rows})
+
+
+class ChartDataView(APIView):
+    """
+    GET /api/charts/<id>/data/[?top=N][&downsample=N&downsample_method=lttb|minmax]
+    -> {"x": [...], "series": [{"name", "data"}, ...]}
+    Опубликованные графики отдаются из ChartResult (пересчёт — в фоне), остальные считаются на лету.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk: int):
+        chart = get_object_or_404(_charts_qs(), pk=pk)
+        try:
+            shape = shape_params(request.query_params)
+            payload = stored_chart_data(chart) if chart.published else chart_data(chart)
+        except AggregationError as e:
+            return Response({"detail": str(e)}, status=400)
+        return Response(shape_chart_payload(chart, payload, **shape))
+
+
+class DashboardChartsDataView(APIView):
+    """
+    GET /api/dashboards/<id>/charts/data/[?published=1][&top=N][&downsample=N&downsample_method=..]
+    -> {"charts": {"<chart_id>": {"x", "series"} | {"detail": "<ошибка настройки>"}}}
+
+    Все графики дашборда одним ответом: графики по одному датасету считаются одним проходом,
+    опубликованные берутся из ChartResult.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk: int):
+        dashboard = get_object_or_404(Dashboard.objects.only("id"), pk=pk)
+        qs = _charts_qs().filter(dashboard=dashboard).order_by("order", "id")
+        if str(request.query_params.get("published") or "").lower() in ("1", "true", "yes"):
+            qs = qs.filter(published=True)
+        charts = list(qs)
+        try:
+            shape = shape_params(request.query_params)
+        except AggregationError as e:
+            return Response({"detail": str(e)}, status=400)
+
+        errors = {}
+        payloads = stored_charts_data(charts, errors=errors)
+        out = {}
+        for chart in charts:
+            if chart.id in errors:
+                out[str(chart.id)] = {"detail": errors[chart.id]}
+            else:
+                out[str(chart.id)] = shape_chart_payload(
+                    chart, payloads.get(chart.id, {"x": [], "series": []}), **shape
+                )
+        return Response({"charts": out})
+
+
+class DatasetKeysView(APIView):
+    """
+    GET /api/datasets/<id>/keys
+    -> {"keys_all", "keys_text", "keys_number", "keys_date",
+        "keys": [{"key", "type", "fill_rate", "distinct", "min", "max", "top"}], "rows", "sampled", ...}
+    Статистика берётся из Dataset.inferred_schema (см. analytics/dataset_keys.py).
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk: int):
+        ds = get_object_or_404(Dataset.objects.only("id", "inferred_schema"), pk=pk)
+        return Response(dataset_keys(ds))
@@ -0,0 +1,137 @@
+# analytics/views_async.py
+"""
+Async-варианты тяжёлых GET-эндпоинтов (для запуска под ASGI, например uvicorn).
+
+Синхронный ORM вызывается через sync_to_async(thread_sensitive=False) в пуле потоков,
+а параллелизм ограничен семафором (DASHBOARD_ASYNC_CONCURRENCY), чтобы не занять
+все соединения к БД одним запросом.
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import JsonResponse
+from django.views.decorators.http import require_GET
+
+from ingest.models import Workbook
+from .views_dashboard_cards_rows import (
+    _dashboard_params,
+    _visible_handles,
+    _cards_from_cache,
+    _store_cards,
+    _finalize_cards,
+    _card_payload,
+    _use_compact_grid,
+)
+from .views_resolve import (
+    _resolve_rows_payload,
+    _rows_for_datasets,
+    _latest_rows_for_datasets,
+)
+
+
+def _concurrency() -> int:
+    return max(1, int(getattr(settings, "DASHBOARD_ASYNC_CONCURRENCY", 8)))
+
+
+async def _run_bounded(sem: asyncio.Semaphore, func, *args, **kwargs):
+    """Выполнить синхронную функцию в пуле потоков, не более N одновременно."""
+
+    def _call():
+        # поток из пула живёт дольше запроса — закрываем протухшие соединения сами
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    async with sem:
+        return await sync_to_async(_call, thread_sensitive=False)()
+
+
+async def _authenticated_user(request):
+    user = await request.auser()
+    if not user or not user.is_authenticated:
+        return None
+    return user
+
+
+@require_GET
+async def dashboard_cards_rows_async(request):
+    """
+    GET /api/async/dashboard/cards/rows/ — те же параметры и формат ответа,
+    что у DashboardCardsRowsView, но строки карточек читаются параллельно.
+    """
+    user = await _authenticated_user(request)
+    if user is None:
+        return JsonResponse({"detail": "Authentication credentials were not provided."}, status=403)
+
+    try:
+        params = _dashboard_params(request.GET)
+    except ValueError as e:
+        return JsonResponse({"detail": str(e)}, status=400)
+    hrs = await sync_to_async(_visible_handles)(params)
+    payloads, todo, card_keys = await sync_to_async(_cards_from_cache)(hrs, params)
+
+    sem = asyncio.Semaphore(_concurrency())
+
+    async def _rows_for(hr, ds_id):
+        latest_row, rows = None, None
+        if params["latest"]:
+            latest_row = (await _run_bounded(sem, _latest_rows_for_datasets, [ds_id])).get(ds_id)
+        if params["rows_mode"] == "all":
+            rows = (await _run_bounded(
+                sem, _rows_for_datasets, [ds_id], params["rows_limit"], _use_compact_grid(hr, params),
+            )).get(ds_id)
+        return latest_row, rows
+
+    # строки недостающих в кэше карточек читаются параллельно
+    fetched = await asyncio.gather(*(_rows_for(hr, ds.id) for hr, _, ds in todo))
+    rendered = {
+        hr.handle: _card_payload(hr, wb, ds, params, latest_row=latest_row, rows=rows)
+        for (hr, wb, ds), (latest_row, rows) in zip(todo, fetched)
+    }
+    if rendered:
+        await sync_to_async(_store_cards)(rendered, card_keys)
+        payloads.update(rendered)
+
+    results = await sync_to_async(_finalize_cards)(hrs, payloads, user)
+    return JsonResponse({"results": results})
+
+
+@require_GET
+async def resolve_rows_async(request):
+    """
+    GET /api/async/datasets/resolve/rows/?handle=<slug>  — как ResolveRowsView.
+    GET /api/async/datasets/resolve/rows/?handles=h1,h2,... — несколько handle параллельно,
+        ответ: {"results": [<payload handle 1>, ...]} (ошибки — с полем "status_code").
+    """
+    user = await _authenticated_user(request)
+    if user is None:
+        return JsonResponse({"detail": "Authentication credentials were not provided."}, status=403)
+
+    handle = (request.GET.get("handle") or "").strip()
+    handles = [h.strip() for h in (request.GET.get("handles") or "").split(",") if h.strip()]
+    if not handle and not handles:
+        return JsonResponse({"detail": "param 'handle' (or 'handles') is required"}, status=400)
+
+    sem = asyncio.Semaphore(_concurrency())
+
+    def _one(h):
+        try:
+            return _resolve_rows_payload(h, request.GET)
+        except Workbook.DoesNotExist:
+            return {"detail": f"workbook not found for handle={h}"}, 404
+
+    if handle and not handles:
+        payload, status = await _run_bounded(sem, _one, handle)
+        return JsonResponse(payload, status=status)
+
+    answers = await asyncio.gather(*(_run_bounded(sem, _one, h) for h in handles))
+    results = []
+    for h, (payload, status) in zip(handles, answers):
+        if status != 200:
+            payload = {"handle": h, "status_code": status, **payload}
+        results.append(payload)
+    return JsonResponse({"results": results})
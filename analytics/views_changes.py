@@ -0,0 +1,113 @@
+# analytics/views_changes.py
+import base64
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.views import APIView
+from rest_framework.response import Response
+
+from analytics.permissions import IsAuthenticatedOrApiKey, ApiKeyRateThrottle
+from ingest.models import UploadHistory
+from .views_resolve import format_client_date
+
+
+def encode_cursor(created_at, pk: int) -> str:
+    raw = json.dumps([created_at.isoformat(), pk]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    """(created_at, id) из курсора или ValueError."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        ts, pk = json.loads(raw)
+        created_at = parse_datetime(ts)
+        if created_at is None:
+            raise ValueError
+        return created_at, int(pk)
+    except Exception:
+        raise ValueError("bad cursor")
+
+
+def _scope_handles(request):
+    """Какие handle видит клиент ленты (None — все)."""
+    if request.user and request.user.is_authenticated:
+        return None
+    api_key = getattr(request, "api_key", None)
+    if api_key:
+        handles = api_key.get("handles") or []
+        return None if "*" in handles else handles
+    # старый общий ключ
+    return getattr(settings, "EXTERNAL_EKSPORT_API_KEY_HANDLES", ["1-eksport", "eksport-svod"])
+
+
+class ChangesFeedView(APIView):
+    """
+    GET /api/changes/?since=<cursor>&limit=500[&handle=...]
+
+    Лента изменений данных (из UploadHistory) в порядке (created_at, id):
+      {"results": [{"handle", "period", "dataset_id", "version", "status", "change_type", "created_at"}, ...],
+       "next_cursor": "...", "has_more": true|false}
+
+    Курсор непрозрачный: передавайте next_cursor следующим запросом (без since — с начала).
+    События моложе CHANGES_SETTLE_SECONDS не отдаются: их транзакции могли ещё не закоммититься,
+    и событие с меньшим created_at появилось бы «позади» уже выданного курсора.
+    """
+    permission_classes = [IsAuthenticatedOrApiKey]
+    throttle_classes = [ApiKeyRateThrottle]
+
+    def get(self, request):
+        since = (request.query_params.get("since") or "").strip()
+        handle = (request.query_params.get("handle") or "").strip()
+        try:
+            limit = max(1, min(5000, int(request.query_params.get("limit") or 500)))
+        except ValueError:
+            limit = 500
+
+        settle = int(getattr(settings, "CHANGES_SETTLE_SECONDS", 30))
+        qs = UploadHistory.objects.filter(created_at__lte=timezone.now() - timedelta(seconds=settle))
+
+        if since:
+            try:
+                ts, pk = decode_cursor(since)
+            except ValueError:
+                return Response({"detail": "bad cursor"}, status=400)
+            # created_at >= ts — диапазон по индексу (created_at, id), OR добивает keyset
+            qs = qs.filter(created_at__gte=ts).filter(Q(created_at__gt=ts) | Q(id__gt=pk))
+
+        handles = _scope_handles(request)
+        if handles is not None:
+            qs = qs.filter(handle__in=handles)
+        if handle:
+            qs = qs.filter(handle=handle)
+
+        events = list(
+            qs.select_related("dataset")
+            .only(
+                "id", "created_at", "handle", "period_date", "action", "status_after",
+                "dataset__id", "dataset__version", "dataset__status",
+            )
+            .order_by("created_at", "id")[: limit + 1]
+        )
+        has_more = len(events) > limit
+        events = events[:limit]
+
+        results = []
+        for ev in events:
+            ds = ev.dataset
+            results.append({
+                "handle": ev.handle,
+                "period": format_client_date(ev.period_date),
+                "dataset_id": ev.dataset_id,
+                "version": ds.version if ds else None,
+                "status": ev.status_after or (ds.status if ds else None),
+                "change_type": ev.action,
+                "created_at": ev.created_at.isoformat(),
+            })
+
+        next_cursor = encode_cursor(events[-1].created_at, events[-1].id) if events else (since or None)
+        return Response({"results": results, "next_cursor": next_cursor, "has_more": has_more})
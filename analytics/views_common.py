@@ -1,12 +1,15 @@
 # analytics/views_common.py
-from ingest.models import HandleRegistry
+from . import access
+
 
 def user_can_edit_handle(user, handle: str) -> bool:
-    if not user or not user.is_authenticated:
-        return False
-    if getattr(user, "is_superuser", False):
-        return True
-    hr = HandleRegistry.objects.filter(handle=handle).first()
-    if not hr:
-        return False
-    return hr.allowed_users.filter(id=user.id).exists()
+    """Может ли пользователь редактировать handle (см. analytics.access — без запроса на каждый вызов)."""
+    return access.can_edit_handle(user, handle)
+
+
+def user_editable_handles(user, handles) -> set[str]:
+    """
+    Пакетная версия user_can_edit_handle: из списка handles вернуть те,
+    которые пользователь может редактировать.
+    """
+    return access.filter_editable(user, handles)
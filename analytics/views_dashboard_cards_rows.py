@@ -2,103 +2,23 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from django.db.models import QuerySet
-
-from ingest.models import HandleRegistry, DatasetRow, Dataset, Workbook
-from .views_common import user_can_edit_handle
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models import Prefetch, prefetch_related_objects
+
+from ingest.models import HandleRegistry, Dataset, Workbook
+from ingest.utils.luckysheet import is_luckysheet, window_luckysheet, sheet_rows_total
+from .caching import cache_timeout, handle_generations
+from .views_common import user_editable_handles
 from .views_resolve import (
     parse_client_date,
     format_client_date,
+    _rows_for_datasets,
+    _latest_rows_for_datasets,
 )
 
 
-def _is_empty_cell(c):
-    """Пуста ли ячейка Luckysheet: None, '' или {} без содержимого."""
-    if c is None:
-        return True
-    if c == "":
-        return True
-    if isinstance(c, dict):
-        # у Luckysheet полезные поля обычно 'v' или 'm'
-        return not any(k in c and c[k] not in (None, "") for k in ("v", "m"))
-    return False
-
-
-def _trim_row_right(row):
-    """Обрезать справа полностью пустые ячейки (чтобы не таскать кучу {})."""
-    if not isinstance(row, list):
-        return row
-    i = len(row) - 1
-    while i >= 0 and _is_empty_cell(row[i]):
-        i -= 1
-    return row[: i + 1]
-
-
-def _row_is_all_empty(row):
-    """Вся ли строка пуста (после обрезки справа)."""
-    row = _trim_row_right(row)
-    if not row:
-        return True
-    return all(_is_empty_cell(c) for c in row)
-
-
-def _compact_grid(grid, max_rows=None, trim=True):
-    """
-    Урезать 2D-сетку Luckysheet: взять первые max_rows строк
-    и/или почистить пустые хвосты строк и пустые нижние строки.
-    """
-    if not isinstance(grid, list):
-        return grid
-
-    # 1) срез по строкам
-    if isinstance(max_rows, int) and max_rows >= 0:
-        grid = grid[:max_rows]
-
-    if not trim:
-        return grid
-
-    # 2) обрезаем пустые ячейки справа в каждой строке
-    grid = [_trim_row_right(r if isinstance(r, list) else [r]) for r in grid]
-
-    # 3) убираем полностью пустые строки снизу
-    j = len(grid) - 1
-    while j >= 0 and _row_is_all_empty(grid[j]):
-        j -= 1
-    grid = grid[: j + 1]
-    return grid
-
-
-def _shrink_luckysheet(luckysheet_obj, max_rows=None, trim=True):
-    """
-    Вернуть копию luckysheet с урезанным количеством строк.
-    Поддерживаем 2 формы:
-      A) {"data": [[...], [...], ...]}  # single-sheet object
-      B) [{"data": [[...], ...], "name": "Sheet1"}, ...]  # массив листов (берём первый)
-    """
-    # B) массив листов
-    if isinstance(luckysheet_obj, list):
-        if not luckysheet_obj:
-            return luckysheet_obj
-        first = dict(luckysheet_obj[0]) if isinstance(luckysheet_obj[0], dict) else {}
-        grid = first.get("data")
-        if isinstance(grid, list) and (not grid or isinstance(grid[0], list)):
-            first["data"] = _compact_grid(grid, max_rows=max_rows, trim=trim)
-        # собираем назад
-        new_ls = [first]
-        return new_ls
-
-    # A) объект одного листа
-    if isinstance(luckysheet_obj, dict):
-        new_ls = dict(luckysheet_obj)
-        grid = new_ls.get("data")
-        if isinstance(grid, list) and (not grid or isinstance(grid[0], list)):
-            new_ls["data"] = _compact_grid(grid, max_rows=max_rows, trim=trim)
-        return new_ls
-
-    # прочие случаи — возвращаем как есть
-    return luckysheet_obj
-
-
 def _extract_data(row):
     """
     Приводим row.data к «чистому» формату без обёрток:
@@ -108,7 +28,11 @@ def _extract_data(row):
     - list/tuple            -> как есть
     - иные типы             -> как есть
     """
-    data = row.data
+    return _unwrap_data(row.data)
+
+
+def _unwrap_data(data):
+    """См. _extract_data — то же, но для уже извлечённого значения data."""
     if data is None:
         return {}
     if isinstance(data, (list, tuple)):
@@ -124,98 +48,311 @@ def _extract_data(row):
     return data
 
 
-def _get_approved_dataset_for_workbook(wb: Workbook):
+def _pick_first_approved_per_handle(handles, target_date=None, newest_first=True):
     """
-    Возвращает (ds or None) где ds.status == 'approved'
-    для указанного workbook.
+    Один запрос на все handles: для каждого handle — первый approved датасет
+    при обходе workbook'ов в порядке period_date DESC (или ASC).
+
+    DISTINCT ON (handle) + сортировка: handle, period_date, workbook.id, created_at DESC, id DESC.
+    Возвращает {handle: ds} (ds.sheet.workbook уже подтянут select_related).
     """
-    return (
+    if not handles:
+        return {}
+    qs = (
         Dataset.objects
-        .filter(sheet__workbook=wb, status=Dataset.STATUS_APPROVED)
-        .order_by("-created_at", "-id")
-        .first()
+        .filter(status=Dataset.STATUS_APPROVED, sheet__workbook__handle__in=list(handles))
+        .select_related("sheet__workbook")
     )
+    if target_date:
+        qs = qs.filter(sheet__workbook__period_date__lte=target_date)
 
+    if newest_first:
+        wb_order = ("-sheet__workbook__period_date", "-sheet__workbook__id")
+    else:
+        wb_order = ("sheet__workbook__period_date", "sheet__workbook__id")
 
-def _scan_for_first_approved(wb_qs):
-    """
-    По списку workbook'ов (итерация в порядке, в котором qs предоставляет),
-    вернуть (wb, ds_approved) для первого workbook, у которого есть approved датасет.
-    Если не нашли — (None, None).
-    """
-    for wb in wb_qs:
-        ds = _get_approved_dataset_for_workbook(wb)
-        if ds:
-            return wb, ds
-    return None, None
+    qs = (
+        qs.order_by("sheet__workbook__handle", *wb_order, "-created_at", "-id")
+        .distinct("sheet__workbook__handle")
+    )
+    return {ds.sheet.workbook.handle: ds for ds in qs}
 
 
-def _resolve_best_approved_for_handle_date(handle: str, date_str: str | None):
+def _resolve_best_approved_for_handles(handles, date_str: str | None):
     """
-    Логика выбора карточки для дашборда:
-
-    1. Если пришла дата (target_date):
-        a) ищем workbook с period_date <= target_date, сортировка по period_date DESC.
-           Берём первый у кого есть approved датасет.
-        b) если не нашли (значит дата раньше самого первого периода),
-           берём САМЫЙ РАННИЙ workbook (ASC) с approved.
+    Выбор карточек дашборда — максимум 2 запроса на любое число handles:
 
-    2. Если дата не пришла:
-        a) берём все workbook по убыванию даты (DESC), пропуская те,
-           где есть только draft.
-        b) если не нашли (теоретически все только draft),
-           берём по возрастанию даты (ASC) первый, у кого есть approved.
+    1. основной: самый свежий workbook с approved датасетом (period_date DESC),
+       если указана дата — только с period_date <= даты;
+    2. fallback для handles, где не нашли (дата раньше первого периода или свежие
+       периоды только draft): самый ранний workbook с approved (ASC).
 
-    Возвращает (wb, ds_approved) или (None, None) если нет ни одного approved вообще.
+    Возвращает {handle: (wb, ds_approved)}; handles без approved в результат не попадают.
     """
+    handles = [h for h in handles if h]
     target_date = parse_client_date(date_str) if date_str else None
 
-    # кейс: дата указана
-    if target_date:
-        # шаг a: ищем самый свежий <= этой даты
-        qs_desc = (
-            Workbook.objects
-            .filter(handle=handle, period_date__lte=target_date)
-            .order_by("-period_date", "-id")
+    # шаг a: самый свежий approved (<= даты, если она указана)
+    found = _pick_first_approved_per_handle(handles, target_date=target_date, newest_first=True)
+
+    # шаг b: fallback — самый ранний approved для оставшихся
+    missing = [h for h in handles if h not in found]
+    if missing:
+        found.update(_pick_first_approved_per_handle(missing, newest_first=False))
+
+    return {h: (ds.sheet.workbook, ds) for h, ds in found.items()}
+
+
+def _dashboard_params(query_params):
+    """Разбор query-параметров дашборда (общий для sync/async вариантов). Не числа — ValueError (-> 400)."""
+    try:
+        rows_limit = int(query_params.get("rows_limit") or 5000)
+        grid_offset = int(query_params.get("grid_offset") or 0)
+    except (TypeError, ValueError):
+        raise ValueError("rows_limit/grid_offset must be integers")
+    handles_param = (query_params.get("handles") or "").strip()
+    return {
+        "date": query_params.get("date"),
+        "group": (query_params.get("group") or "").strip(),
+        "handles": [h.strip() for h in handles_param.split(",") if h.strip()],
+        # latest оставляем для обратной совместимости: влияет только на payload["data"] (одна последняя строка)
+        "latest": query_params.get("latest") in ("1", "true", "yes"),
+        "rows_mode": (query_params.get("rows") or "none").lower(),  # none|all
+        "rows_limit": max(1, min(50000, rows_limit)),
+        # v2 (Luckysheet): компактная сетка окнами по rows_limit строк, начиная с grid_offset
+        "compact": (query_params.get("compact") or "1").lower() not in ("0", "false", "no"),
+        "grid_offset": max(0, grid_offset),
+        "celldata": query_params.get("celldata") in ("1", "true", "yes"),
+    }
+
+
+def _use_compact_grid(hr, params) -> bool:
+    return params["compact"] and getattr(hr, "table_kind", "") == HandleRegistry.TABLE_KIND_V2
+
+
+def _grid_row_payload(r, params):
+    """Строка v2-карточки: окно компактной сетки (rows_limit строк с grid_offset) + сведения об окне."""
+    if not is_luckysheet(r.data):
+        return {"id": r.id, "data": _extract_data(r), "imported_at": r.imported_at}
+    window = window_luckysheet(
+        r.data, offset=params["grid_offset"], limit=params["rows_limit"], to_celldata=params["celldata"],
+    )
+    return {
+        "id": r.id,
+        "data": _unwrap_data(window),
+        "imported_at": r.imported_at,
+        "window": {
+            "offset": params["grid_offset"],
+            "limit": params["rows_limit"],
+            "total_rows": sheet_rows_total(r.data),
+        },
+    }
+
+
+def _visible_handles(params):
+    """Видимые хэндлы дашборда с учётом group/handles, в порядке карточек."""
+    qs = HandleRegistry.objects.filter(visible=True)
+    if params["group"]:
+        qs = qs.filter(group=params["group"])
+    if params["handles"]:
+        qs = qs.filter(handle__in=params["handles"])
+    return list(qs.order_by("order_index", "handle"))
+
+
+def _card_variant(params) -> str:
+    """Часть ключа кэша карточки, зависящая от параметров отрисовки."""
+    return ":".join(str(x) for x in (
+        params["rows_mode"], params["rows_limit"], int(params["latest"]),
+        int(params["compact"]), params["grid_offset"], int(params["celldata"]),
+    ))
+
+
+def _cards_from_cache(hrs, params):
+    """
+    Шаг 1 сборки карточек: выбор датасетов и готовые payload'ы — из кэша, где есть.
+
+    Кэшируются (с учётом поколения handle, см. analytics.caching):
+      - выбор датасета: (handle, дата) -> ds_id (0 — approved нет);
+      - payload карточки без пользовательских полей: (ds_id, параметры отрисовки).
+
+    Возвращает (payloads {handle: payload}, todo [(hr, wb, ds)] — что надо отрисовать, ключи карточек).
+    """
+    handles = [hr.handle for hr in hrs]
+    gens = handle_generations(handles)
+    target_date = parse_client_date(params["date"]) if params["date"] else None
+    date_key = target_date.isoformat() if target_date else "latest"
+
+    res_keys = {h: f"dash:res:{gens[h]}:{h}:{date_key}" for h in handles}
+    got = cache.get_many(list(res_keys.values()))
+    ds_by_handle = {h: got[k] for h, k in res_keys.items() if k in got}
+
+    fresh = {}  # handle -> (wb, ds), уже загруженные в этом запросе
+    unresolved = [h for h in handles if h not in ds_by_handle]
+    if unresolved:
+        fresh = _resolve_best_approved_for_handles(unresolved, params["date"])
+        for h in unresolved:
+            ds_by_handle[h] = fresh[h][1].id if h in fresh else 0
+        cache.set_many({res_keys[h]: ds_by_handle[h] for h in unresolved}, timeout=cache_timeout())
+
+    variant = _card_variant(params)
+    card_keys = {
+        h: f"dash:card:{gens[h]}:{ds_id}:{variant}"
+        for h, ds_id in ds_by_handle.items() if ds_id
+    }
+    got = cache.get_many(list(card_keys.values()))
+    payloads = {h: got[k] for h, k in card_keys.items() if k in got}
+
+    missing = [h for h in card_keys if h not in payloads]
+    to_load = {ds_by_handle[h]: h for h in missing if h not in fresh}
+    if to_load:
+        for ds in Dataset.objects.filter(id__in=list(to_load)).select_related("sheet__workbook"):
+            fresh[to_load[ds.id]] = (ds.sheet.workbook, ds)
+
+    todo = [(hr, *fresh[hr.handle]) for hr in hrs if hr.handle in missing and hr.handle in fresh]
+    if todo:
+        User = get_user_model()
+        prefetch_related_objects(
+            [hr for hr, _, _ in todo],
+            Prefetch("allowed_users", queryset=User.objects.only("id", "email")),
         )
-        wb, ds = _scan_for_first_approved(qs_desc)
-        if wb and ds:
-            return wb, ds
-
-        # шаг b: дата раньше всех периодов -> берём самый первый (минимальный период)
-        qs_asc = (
-            Workbook.objects
-            .filter(handle=handle)
-            .order_by("period_date", "id")
+    return payloads, todo, card_keys
+
+
+def _store_cards(rendered, card_keys):
+    cache.set_many({card_keys[h]: p for h, p in rendered.items()}, timeout=cache_timeout())
+
+
+def _render_cards(todo, params):
+    """Отрисовать карточки (строки всех датасетов — одним-двумя запросами)."""
+    ds_ids = [ds.id for _, _, ds in todo]
+    latest_rows = _latest_rows_for_datasets(ds_ids) if params["latest"] else {}
+    rows_by_ds = {}
+    if params["rows_mode"] == "all":
+        grid_ids = [ds.id for hr, _, ds in todo if _use_compact_grid(hr, params)]
+        plain_ids = [i for i in ds_ids if i not in set(grid_ids)]
+        rows_by_ds.update(_rows_for_datasets(plain_ids, limit=params["rows_limit"]))
+        rows_by_ds.update(_rows_for_datasets(grid_ids, limit=params["rows_limit"], compact=True))
+
+    return {
+        hr.handle: _card_payload(
+            hr, wb, ds, params,
+            latest_row=latest_rows.get(ds.id),
+            rows=rows_by_ds.get(ds.id),
         )
-        wb, ds = _scan_for_first_approved(qs_asc)
-        return wb, ds
+        for hr, wb, ds in todo
+    }
+
+
+def build_dashboard_cards(hrs, params):
+    """{handle: payload} для карточек с approved-данными (кэш + отрисовка недостающих)."""
+    payloads, todo, card_keys = _cards_from_cache(hrs, params)
+    if todo:
+        rendered = _render_cards(todo, params)
+        _store_cards(rendered, card_keys)
+        payloads.update(rendered)
+    return payloads
+
+
+def _finalize_cards(hrs, payloads, user):
+    """Карточки в порядке hrs + пользовательские поля (editable/can_upload)."""
+    editable_set = user_editable_handles(user, list(payloads))
+    results = []
+    for hr in hrs:
+        payload = payloads.get(hr.handle)
+        # если вообще нет approved по этому handle -> не добавляем карточку
+        if payload is None:
+            continue
+        payload = dict(payload)
+        payload["editable"] = hr.handle in editable_set
+        payload["can_upload"] = payload["editable"]
+        results.append(payload)
+    return results
+
+
+def _card_payload(hr, wb, ds, params, latest_row=None, rows=None):
+    """
+    Собрать payload одной карточки из уже загруженных объектов (без запросов к БД).
+    editable/can_upload зависят от пользователя и проставляются в _finalize_cards.
+    """
+    payload = {
+        "handle": hr.handle,
+        "title": hr.title or hr.handle,
+        "order_index": hr.order_index,
+        "group": hr.group,
+        "table_kind": getattr(hr, "table_kind", "legacy"),
+        "period": format_client_date(getattr(wb, "period_date", None)),
+        "status": ds.status,     # всегда 'approved' здесь
+        "version": ds.version,
+        "icon": hr.icon,
+        "color": hr.color,
+    }
+
+    # доступы
+    payload["editable"] = False
+    payload["can_upload"] = False
+    payload["allowed_user_ids"] = [u.email for u in hr.allowed_users.all()]
+
+    if params["latest"]:
+        payload["id"] = latest_row.id if latest_row else None
+        payload["data"] = _extract_data(latest_row) if latest_row else {}
+        payload["imported_at"] = latest_row.imported_at if latest_row else None
+
+    if params["rows_mode"] == "all":
+        if _use_compact_grid(hr, params):
+            payload["rows"] = [_grid_row_payload(r, params) for r in (rows or [])]
+        else:
+            payload["rows"] = [
+                {"id": r.id, "data": _extract_data(r), "imported_at": r.imported_at}
+                for r in (rows or [])
+            ]
+
+    return payload
+
+
+def warm_dashboard_cards(handles=None, periods: int | None = None) -> int:
+    """
+    Прогрев кэша карточек: для видимых handle (всех или перечисленных) — последний период
+    и N последних дат периодов с approved-данными, для вариантов DASHBOARD_WARM_VARIANTS.
+    Возвращает число подготовленных карточек.
+    """
+    if periods is None:
+        periods = int(getattr(settings, "DASHBOARD_WARM_PERIODS", 3))
+    variants = getattr(settings, "DASHBOARD_WARM_VARIANTS", None) or [{"rows": "all"}]
 
-    # кейс: дата не указана
-    # шаг a: самое свежее approved
-    qs_desc_all = (
-        Workbook.objects
-        .filter(handle=handle)
-        .order_by("-period_date", "-id")
-    )
-    wb, ds = _scan_for_first_approved(qs_desc_all)
-    if wb and ds:
-        return wb, ds
+    base = {"handles": ",".join(handles)} if handles else {}
+    hrs = _visible_handles(_dashboard_params(base))
+    if not hrs:
+        return 0
 
-    # шаг b: fallback — самый ранний approved (теоретически если все свежие черновики)
-    qs_asc_all = (
+    period_dates = (
         Workbook.objects
-        .filter(handle=handle)
-        .order_by("period_date", "id")
+        .filter(
+            handle__in=[hr.handle for hr in hrs],
+            period_date__isnull=False,
+            sheet__datasets__status=Dataset.STATUS_APPROVED,
+        )
+        .order_by("-period_date")
+        .values_list("period_date", flat=True)
+        .distinct()[:max(0, periods)]
     )
-    wb, ds = _scan_for_first_approved(qs_asc_all)
-    return wb, ds
+    dates = [None] + [format_client_date(d) for d in period_dates]
+
+    warmed = 0
+    for variant in variants:
+        for date_str in dates:
+            params = _dashboard_params({**base, **variant, "date": date_str})
+            warmed += len(build_dashboard_cards(hrs, params))
+    return warmed
 
 
 class DashboardCardsRowsView(APIView):
     """
     GET /api/dashboard/cards/rows/?rows=all&rows_limit=5000&date=DD.MM.YYYY&group=...&handles=h1,h2
 
+    v2-карточки (Luckysheet) по умолчанию отдаются в компактной форме (DatasetRow.data_compact)
+    окном по строкам сетки: [grid_offset, grid_offset + rows_limit); celldata=1 — разреженный вид,
+    compact=0 — сырая сетка как раньше.
+
     Что делает:
     - отдаём карточки дашборда по хэндлам;
     - показываем ТОЛЬКО approved данные (draft никогда не уходит в дашборд);
@@ -224,75 +361,19 @@ class DashboardCardsRowsView(APIView):
         * если дата не указана → самая свежая approved; если нет свежей approved
           (т.е. последний период только draft), берём предыдущий approved.
     - если для handle нет approved вообще → карточка не попадёт в results.
+
+    Число запросов к БД не зависит от количества карточек:
+    хэндлы (+allowed_users), выбор датасетов, права, строки — каждое одним запросом.
+    Выбор датасета и готовые карточки кэшируются (см. analytics.caching и задачу
+    warm_dashboard_cache), так что на прогретом кэше остаются только хэндлы и права.
     """
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        date_str = request.query_params.get("date")
-        group = (request.query_params.get("group") or "").strip()
-        handles_param = (request.query_params.get("handles") or "").strip()
-        include = set((request.query_params.get("include") or "").split(",")) if request.query_params.get("include") else set()
-        # latest оставляем для обратной совместимости: влияет только на payload["data"] (одна последняя строка)
-        latest = request.query_params.get("latest") in ("1", "true", "yes")
-        rows_mode = (request.query_params.get("rows") or "none").lower()  # none|all
-        rows_limit = int(request.query_params.get("rows_limit") or 5000)
-        rows_limit = max(1, min(50000, rows_limit))
-
-        # основной queryset хэндлов, только видимые
-        qs = HandleRegistry.objects.filter(visible=True)
-        if group:
-            qs = qs.filter(group=group)
-        if handles_param:
-            hs = [h.strip() for h in handles_param.split(",") if h.strip()]
-            if hs:
-                qs = qs.filter(handle__in=hs)
-
-        results = []
-
-        for hr in qs.order_by("order_index", "handle"):
-            # ищем лучшую approved-версию для этого handle и даты
-            wb, ds = _resolve_best_approved_for_handle_date(hr.handle, date_str)
-
-            # если вообще нет approved по этому handle -> не добавляем карточку
-            if not wb or not ds:
-                continue
-
-            period = getattr(wb, "period_date", None)
-
-            payload = {
-                "handle": hr.handle,
-                "title": hr.title or hr.handle,
-                "order_index": hr.order_index,
-                "group": hr.group,
-                "table_kind": getattr(hr, "table_kind", "legacy"),
-                "period": format_client_date(period),
-                "status": ds.status,     # всегда 'approved' здесь
-                "version": ds.version,
-                "icon": hr.icon,
-                "color": hr.color,
-            }
-
-            # доступы
-            payload["editable"] = user_can_edit_handle(request.user, hr.handle)
-            payload["can_upload"] = payload["editable"]
-            payload["allowed_user_ids"] = list(hr.allowed_users.values_list("email", flat=True))
-
-            # данные строк
-            rows_qs: QuerySet = DatasetRow.objects.filter(dataset_id=ds.id).order_by("id")
-
-            if latest:
-                row = rows_qs.last()
-                payload["id"] = row.id if row else None
-                payload["data"] = _extract_data(row) if row else {}
-                payload["imported_at"] = row.imported_at if row else None
-
-            if rows_mode == "all":
-                rows = [
-                    {"id": r.id, "data": _extract_data(r), "imported_at": r.imported_at}
-                    for r in rows_qs[:rows_limit]
-                ]
-                payload["rows"] = rows
-
-            results.append(payload)
-
-        return Response({"results": results})
+        try:
+            params = _dashboard_params(request.query_params)
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=400)
+        hrs = _visible_handles(params)
+        payloads = build_dashboard_cards(hrs, params)
+        return Response({"results": _finalize_cards(hrs, payloads, request.user)})
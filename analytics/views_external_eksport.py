@@ -1,17 +1,91 @@
 # analytics/views_external_eksport.py
+from django.core.cache import cache
+from django.http import StreamingHttpResponse
 from rest_framework.views import APIView
 from rest_framework.response import Response
 
-from analytics.permissions import IsAuthenticatedOrApiKey
-from ingest.models import Workbook, Dataset, DatasetRow, HandleRegistry
+from analytics.caching import cache_timeout, handle_generations
+from analytics.exporting import (
+    EXPORT_FORMATS,
+    export_datasets,
+    iter_export_records,
+    iter_export_chunks,
+    csv_columns,
+)
+from analytics.api_keys import consume_rows, rows_quota_left, seconds_until_tomorrow
+from analytics.permissions import IsAuthenticatedOrApiKey, ApiKeyRateThrottle
+from ingest.models import Workbook, HandleRegistry
 from analytics.views_resolve import (
     parse_client_date,
     format_client_date,
     _merge_rows_data,
-    _pick_dataset_by_status,
+    _pick_datasets_for_workbooks,
+    _rows_for_datasets,
 )
 
 
+def _row_payload(r):
+    return {
+        "id": r.id,
+        "data": (r.data or {}),
+        "imported_at": r.imported_at,
+    }
+
+
+def _aggregated_snapshots(handle: str, datasets, with_rows: bool = False):
+    """
+    Слитые снимки (aggregate=1) для списка датасетов: {dataset_id: {...}}.
+
+    Снимок без строк кэшируется по (поколение handle, dataset id, version) — см. analytics.caching;
+    строки всех недостающих датасетов читаются одним запросом. with_rows (rows=all)
+    требует строки всех датасетов, так что читаем их все, а снимки заодно обновляем в кэше.
+    """
+    gen = handle_generations([handle])[handle]
+    keys = {ds.id: f"ext:snap:{gen}:{ds.id}:{ds.version}" for ds in datasets}
+    snapshots = {} if with_rows else cache.get_many(list(keys.values()))
+
+    out = {ds_id: dict(snapshots[k]) for ds_id, k in keys.items() if k in snapshots}
+    missing = [ds_id for ds_id in keys if ds_id not in out]
+    fresh = {}
+    for ds_id, rows in _rows_for_datasets(missing).items():
+        latest_row = rows[-1] if rows else None
+        fresh[keys[ds_id]] = {
+            "id": latest_row.id if latest_row else None,
+            "data": _merge_rows_data(rows),
+            "imported_at": latest_row.imported_at if latest_row else None,
+            "rows_count": len(rows),
+        }
+        out[ds_id] = dict(fresh[keys[ds_id]])
+        if with_rows:
+            out[ds_id]["rows"] = [_row_payload(r) for r in rows]
+    if fresh:
+        cache.set_many(fresh, timeout=cache_timeout())
+    return out
+
+
+def _clamp_to_quota(results, budget: int | None):
+    """
+    Одна суточная квота строк на весь ответ, по порядку results: списки rows обрезаются,
+    слитый снимок без rows стоит одну строку, что не влезло — не отдаётся.
+    Возвращает (results, списано строк, обрезан ли ответ). budget=None — без ограничения.
+    """
+    out, used, truncated = [], 0, False
+    for meta in results:
+        left = None if budget is None else budget - used
+        if left is not None and left <= 0:
+            truncated = True
+            break
+        if "rows" in meta:
+            if left is not None and len(meta["rows"]) > left:
+                meta = {**meta, "rows": meta["rows"][:left]}
+                truncated = True
+            used += len(meta["rows"])
+        else:
+            used += 1
+        out.append(meta)
+    return out, used, truncated
+
+
 class BaseExternalHandleRowsView(APIView):
     """
     Универсальный внешний API для таблиц.
@@ -24,8 +98,15 @@ class BaseExternalHandleRowsView(APIView):
       [&page_size=100] [&offset=0]
 
     HANDLE ОБЯЗАТЕЛЬНО.
+
+    Число запросов к БД не зависит от page_size: датасеты страницы и их строки
+    читаются пакетно, слитые снимки (aggregate=1&rows=none) берутся из кэша.
+
+    Суточная квота ключа — одна на весь ответ (все датасеты страницы, в т.ч. rows=all):
+    не влезшее отбрасывается, ответ помечается truncated; исчерпанная квота — 429 до запросов.
     """
     permission_classes = [IsAuthenticatedOrApiKey]
+    throttle_classes = [ApiKeyRateThrottle]
     HANDLE = None
 
     def get_handle(self) -> str:
@@ -33,8 +114,12 @@ def get_handle(self) -> str:
             raise ValueError("HANDLE must be defined in subclass")
         return self.HANDLE
 
-    def get(self, request):
+    def get(self, request, **kwargs):
         handle = self.get_handle()
+        api_key = getattr(request, "api_key", None)
+        budget = rows_quota_left(api_key) if api_key else None
+        if budget == 0:
+            self.throttled(request, seconds_until_tomorrow())
 
         date_from = parse_client_date(request.query_params.get("date_from"))
         date_to = parse_client_date(request.query_params.get("date_to"))
@@ -64,23 +149,43 @@ def get(self, request):
         hr = HandleRegistry.objects.filter(handle=handle).only(
             "title", "order_index", "group", "icon", "color"
         ).first()
+        if hr is None and not self.HANDLE:
+            # общий маршрут отдаёт только зарегистрированные handle
+            return Response({"detail": f"unknown handle={handle}"}, status=404)
+
+        # датасеты всей страницы — одним запросом
+        wbs = list(wb_qs)
+        if status_param in ("approved", "draft"):
+            ds_by_wb = _pick_datasets_for_workbooks([wb.id for wb in wbs], status_param, strict=True)
+        else:
+            # all и latest — самый свежий датасет воркбука
+            ds_by_wb = _pick_datasets_for_workbooks([wb.id for wb in wbs], "latest")
+        page = [(wb, ds_by_wb[wb.id]) for wb in wbs if wb.id in ds_by_wb]
+
+        if aggregate:
+            objs = _aggregated_snapshots(handle, [ds for _, ds in page], with_rows=(rows_mode == "all"))
+        else:
+            try:
+                limit = int(request.query_params.get("limit", 5000))
+            except ValueError:
+                limit = 5000
+            limit = max(1, min(50000, limit))
+            if budget is not None:
+                # больше квоты ни один датасет не отдаст; общий предел — _clamp_to_quota
+                limit = min(limit, budget)
 
-        results = []
-        for wb in wb_qs:
-            ds_qs = Dataset.objects.filter(sheet__workbook=wb).order_by("-created_at", "-id")
-
-            if status_param == "approved":
-                ds = ds_qs.filter(status=Dataset.STATUS_APPROVED).first()
-            elif status_param == "draft":
-                ds = ds_qs.filter(status=Dataset.STATUS_DRAFT).first()
-            elif status_param == "all":
-                ds = ds_qs.first()
-            else:
-                ds = _pick_dataset_by_status(wb, "latest")
+            try:
+                start_row = int(request.query_params.get("start_row", 0))
+            except ValueError:
+                start_row = 0
 
-            if not ds:
-                continue
+            rows_by_ds = _rows_for_datasets([ds.id for _, ds in page], limit=limit, min_id=max(0, start_row))
+            objs = {}
+            for ds_id, ds_rows in rows_by_ds.items():
+                objs[ds_id] = {"rows": [_row_payload(r) for r in ds_rows]}
 
+        results = []
+        for wb, ds in page:
             meta = {
                 "handle": handle,
                 "title": (hr.title if hr and hr.title else handle),
@@ -92,72 +197,96 @@ def get(self, request):
                 "icon": (hr.icon if hr else ""),
                 "color": (hr.color if hr else ""),
             }
-
-            if aggregate:
-                rows_qs = DatasetRow.objects.filter(dataset_id=ds.id).order_by("id")
-                rows = list(rows_qs)
-                merged = _merge_rows_data(rows)
-                latest_row = rows[-1] if rows else None
-
-                obj = {
-                    "id": latest_row.id if latest_row else None,
-                    "data": merged,
-                    "imported_at": latest_row.imported_at if latest_row else None,
-                    "rows_count": len(rows),
-                }
-
-                if rows_mode == "all":
-                    obj["rows"] = [
-                        {
-                            "id": r.id,
-                            "data": (r.data or {}),
-                            "imported_at": r.imported_at,
-                        }
-                        for r in rows
-                    ]
-
-                meta.update(obj)
-                results.append(meta)
-                continue
-
-            try:
-                limit = int(request.query_params.get("limit", 5000))
-            except ValueError:
-                limit = 5000
-            limit = max(1, min(50000, limit))
-
-            try:
-                start_row = int(request.query_params.get("start_row", 0))
-            except ValueError:
-                start_row = 0
-
-            qs = DatasetRow.objects.filter(dataset_id=ds.id).order_by("id")
-            if start_row > 0:
-                qs = qs.filter(id__gte=start_row)
-            qs = qs[:limit]
-
-            rows = [
-                {
-                    "id": r.id,
-                    "data": (r.data or {}),
-                    "imported_at": r.imported_at,
-                }
-                for r in qs
-            ]
-
-            meta["rows"] = rows
-            meta["rows_count"] = len(rows)
+            meta.update(objs[ds.id])
             results.append(meta)
 
+        results, used, truncated = _clamp_to_quota(results, budget)
+        if not aggregate:
+            for meta in results:
+                meta["rows_count"] = len(meta["rows"])
+        if api_key:
+            consume_rows(api_key, used)
+
         return Response({
             "handle": handle,
             "count": total,
             "offset": offset,
             "page_size": page_size,
+            "truncated": truncated,
             "results": results,
         })
 
 
+class ExternalHandleRowsView(BaseExternalHandleRowsView):
+    """
+    GET /api/external/<handle>/rows/ — то же для любого зарегистрированного handle.
+    Доступ по ключу analytics.ApiKey — только к handle из его списка.
+    """
+
+    def get_handle(self) -> str:
+        return self.kwargs["handle"]
+
+
+class ExternalHandleExportView(APIView):
+    """
+    GET /api/external/<handle>/export/?date_from=DD.MM.YYYY&date_to=DD.MM.YYYY
+      [&fmt=ndjson|csv]     default: ndjson  (не format= — его занимает DRF)
+      [&gzip=1|0]           default: 1
+
+    Вся история handle за диапазон (approved-датасеты всех периодов) одним потоком:
+    строка ответа = строка датасета (period, dataset_id, version, row_id, imported_at, data).
+    Память сервера не зависит от объёма выгрузки (см. analytics.exporting).
+    """
+    permission_classes = [IsAuthenticatedOrApiKey]
+    throttle_classes = [ApiKeyRateThrottle]
+
+    def get_handle(self) -> str:
+        return self.kwargs["handle"]
+
+    def get(self, request, **kwargs):
+        handle = self.get_handle()
+        if not HandleRegistry.objects.filter(handle=handle).exists():
+            return Response({"detail": f"unknown handle={handle}"}, status=404)
+
+        fmt = (request.query_params.get("fmt") or "ndjson").lower()
+        if fmt not in EXPORT_FORMATS:
+            return Response({"detail": f"fmt must be one of: {', '.join(EXPORT_FORMATS)}"}, status=400)
+        gzip = str(request.query_params.get("gzip") or "1").lower() in ("1", "true", "yes")
+        date_from = parse_client_date(request.query_params.get("date_from"))
+        date_to = parse_client_date(request.query_params.get("date_to"))
+
+        datasets = export_datasets(handle, date_from, date_to)
+        columns = csv_columns(datasets) if fmt == "csv" else None
+
+        api_key = getattr(request, "api_key", None)
+        records = iter_export_records(datasets, max_rows=rows_quota_left(api_key) if api_key else None)
+        if api_key:
+            records = _counting(records, lambda n: consume_rows(api_key, n))
+
+        content_type = "application/x-ndjson" if fmt == "ndjson" else "text/csv"
+        filename = f"{handle}_{format_client_date(date_from) or 'start'}_{format_client_date(date_to) or 'end'}.{fmt}"
+        if gzip:
+            content_type, filename = "application/gzip", filename + ".gz"
+
+        resp = StreamingHttpResponse(
+            iter_export_chunks(records, fmt=fmt, gzip=gzip, columns=columns),
+            content_type=content_type,
+        )
+        resp["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return resp
+
+
+def _counting(records, on_done):
+    """Пропустить записи насквозь и по окончании (в т.ч. обрыве) сообщить их число."""
+    n = 0
+    try:
+        for rec in records:
+            n += 1
+            yield rec
+    finally:
+        on_done(n)
+
+
 class ExternalEksportRowsView(BaseExternalHandleRowsView):
     HANDLE = "1-eksport"
 
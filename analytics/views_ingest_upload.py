@@ -10,9 +10,12 @@
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser
 
-from ingest.models import Workbook, Sheet, Dataset, DatasetRow, DatasetRowRevision, HandleRegistry
+from ingest.models import Workbook, Sheet, Dataset, DatasetRow, HandleRegistry
+from ingest.versioning import create_version
 from .views_resolve import parse_client_date, format_client_date
 from .views_common import user_can_edit_handle
+from .caching import handle_data_changed
+from .dataset_keys import dataset_rows_changed
 from ingest.models import UploadHistory
 
 try:
@@ -45,7 +48,8 @@ def _get_or_create_workbook(handle: str, period_date, uploaded_by, filename: str
     sh = Sheet.objects.filter(workbook=wb).order_by("index", "id").first()
     if not sh:
         sh = Sheet.objects.create(workbook=wb, name=sheet_name or "Sheet1", index=0)
-    ds = Dataset.objects.filter(sheet__workbook=wb).order_by("-created_at", "-id").first()
+    ds = (Dataset.objects.filter(sheet__workbook=wb)
+          .exclude(status=Dataset.STATUS_SUPERSEDED).order_by("-created_at", "-id").first())
     created_ds = False
     if not ds:
         created_ds = True
@@ -121,15 +125,17 @@ class UploadXLSXView(APIView):
         start_row: 2           (опц., по умолчанию 2)
         max_rows: 5000         (опц., чтобы не тащить мегатаблицы)
         filename: "..."        (опц., если хотите своё имя Workbook)
-        truncate: 0|1          (опц., если 1 — очистить старые строки прежде чем писать новую)
+        truncate: 0|1          (опц., если 1 — новая версия без строк прежней)
 
     Поведение:
       - Право на редактирование проверяется по HandleRegistry.allowed_users.
-      - Создаём (или находим) Workbook(handle, period_date) и «последний» Dataset.
+      - Создаём (или находим) Workbook(handle, period_date) и «последний» Dataset;
+        пишем в новую черновую версию (ingest.versioning.create_version: version + 1, строки
+        прежней копируются), опубликованная версия не меняется до approve.
       - Парсим лист Excel в список записей (list[dict]) без шаблонов/валидации.
       - Сохраняем одной строкой: DatasetRow.data = { "parsed": <list[dict]>, "meta": {...} }
         (Если нужно сохранять в несколько строк — легко поменяем.)
-      - Если truncate=1 — предварительно удаляем старые строки датасета.
+      - Если truncate=1 — строки прежней версии в новую не копируются.
 
     Ответ: { dataset_id, saved_id, count, period_date, filename }
     """
@@ -196,19 +202,15 @@ def post(self, request):
             sheet_name=sheet_name
         )
 
-        if truncate:
-            DatasetRow.objects.filter(dataset_id=ds.id).delete()
+        # copy-on-write: существующая версия не меняется — пишем в новый черновик
+        # (строки прежней версии копируются, при truncate — нет)
+        if not created_ds:
+            ds = create_version(wb.id, base=ds, copy_rows=not truncate)
 
         saved_ids = []
         for rec in _normalize_for_json(records):
+            # версия 1 строки — сама строка: ревизии пишутся с первого изменения (ingest.revisions)
             r = DatasetRow.objects.create(dataset_id=ds.id, data=rec)
-            DatasetRowRevision.objects.create(
-                row=r,
-                version=1,
-                data_before={},
-                data_after=r.data,
-                changed_by=request.user
-            )
             saved_ids.append(r.id)
 
         # --- лог в историю ---
@@ -230,23 +232,9 @@ def post(self, request):
         )
 
         changed = truncate or bool(saved_ids)
-        if changed and ds.status == Dataset.STATUS_APPROVED:
-            before = ds.status
-            ds.status = Dataset.STATUS_DRAFT
-            ds.save(update_fields=["status"])
-            UploadHistory.objects.create(
-                user=request.user,
-                handle=handle,
-                period_date=period_date,
-                workbook=wb,
-                dataset=ds,
-                filename=wb.filename,
-                rows_count=ds.rows.count(),
-                action=UploadHistory.ACTION_STATUS_CHANGE,
-                status_before=before,
-                status_after=ds.status,
-                extra={"reason": "auto-draft on data change via upload-xlsx"}
-            )
+        if changed:
+            handle_data_changed(handle)
+            dataset_rows_changed(ds.id)
 
         return Response({
             "dataset_id": ds.id,
@@ -3,9 +3,14 @@
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from datetime import datetime
+from django.db.models import Case, F, IntegerField, JSONField, Value, When, Window
+from django.db.models.functions import Coalesce, RowNumber
 
 from analytics.views_common import user_can_edit_handle
+from analytics.caching import handle_data_changed
+from ingest.archive import archived_rows
 from ingest.models import Workbook, Dataset, DatasetRow, HandleRegistry, UploadHistory
+from ingest.versioning import dataset_row_count, set_dataset_status
 
 
 # ---------------------------
@@ -96,10 +101,17 @@ def _get_workbook_for(handle: str, date_str: str | None):
 def _pick_dataset_by_status(wb: Workbook, status_param: str | None):
     """
     status_param: 'approved' | 'draft' | 'latest'/None
+    superseded-версии (ждут удаления, ingest.versioning) не выбираются.
     """
-    ds_qs = Dataset.objects.filter(sheet__workbook=wb).order_by("-created_at", "-id")
+    ds_qs = (Dataset.objects.filter(sheet__workbook=wb)
+             .exclude(status=Dataset.STATUS_SUPERSEDED).order_by("-created_at", "-id"))
     status_param = (status_param or "latest").lower()
     if status_param == "approved":
+        # опубликованная версия — по указателю воркбука (ingest.versioning)
+        if wb.approved_dataset_id:
+            ds = Dataset.objects.filter(pk=wb.approved_dataset_id).first()
+            if ds:
+                return ds
         return ds_qs.filter(status=Dataset.STATUS_APPROVED).first() or ds_qs.first()
     if status_param == "draft":
         return ds_qs.filter(status=Dataset.STATUS_DRAFT).first() or ds_qs.first()
@@ -109,10 +121,11 @@ def _pick_dataset_by_status(wb: Workbook, status_param: str | None):
 def _get_dataset_for_workbook_latest(wb: Workbook):
     """
     Всегда самый последний датасет для воркбука (created_at DESC, id DESC),
-    без приоритета approved — «актуальная» рабочая версия.
+    без приоритета approved — «актуальная» рабочая версия (superseded не в счёт).
     """
     ds = (Dataset.objects
           .filter(sheet__workbook=wb)
+          .exclude(status=Dataset.STATUS_SUPERSEDED)
           .order_by("-created_at", "-id")
           .first())
     if not ds:
@@ -120,6 +133,97 @@ def _get_dataset_for_workbook_latest(wb: Workbook):
     return ds
 
 
+def _pick_datasets_for_workbooks(workbook_ids, status_param: str | None, strict: bool = False):
+    """
+    Пакетный _pick_dataset_by_status: {workbook_id: Dataset} одним запросом (DISTINCT ON workbook).
+    Для 'approved'/'draft' датасет с этим статусом идёт первым, иначе — самый свежий
+    (strict=True — без подстановки: воркбуки без датасета с нужным статусом пропускаются).
+    """
+    workbook_ids = list({i for i in workbook_ids if i})
+    if not workbook_ids:
+        return {}
+    status_param = (status_param or "latest").lower()
+
+    qs = Dataset.objects.filter(sheet__workbook_id__in=workbook_ids).exclude(status=Dataset.STATUS_SUPERSEDED)
+    order = ["sheet__workbook_id"]
+    if status_param in (Dataset.STATUS_APPROVED, Dataset.STATUS_DRAFT):
+        if strict:
+            qs = qs.filter(status=status_param)
+        else:
+            qs = qs.annotate(_status_rank=Case(
+                When(status=status_param, then=Value(0)), default=Value(1), output_field=IntegerField(),
+            ))
+            order.append("_status_rank")
+    order += ["-created_at", "-id"]
+
+    qs = qs.select_related("sheet").order_by(*order).distinct("sheet__workbook_id")
+    return {ds.sheet.workbook_id: ds for ds in qs}
+
+
+def _rows_for_datasets(dataset_ids, limit: int | None = None, compact: bool = False, min_id: int | None = None):
+    """
+    Строки сразу для нескольких датасетов одним запросом.
+    Возвращает {dataset_id: [DatasetRow, ...]} (внутри — по id ASC).
+    limit — максимум строк на КАЖДЫЙ датасет (через ROW_NUMBER() OVER (PARTITION BY dataset_id)).
+    compact — в r.data подставить компактную сетку Luckysheet (data_compact), если она есть;
+              сырой data при этом из БД не читается.
+    min_id — только строки с id >= min_id.
+    Датасеты без строк в таблице проверяются по архиву (ingest.archive) — строки распаковываются оттуда.
+    """
+    dataset_ids = list({i for i in dataset_ids if i})
+    out = {i: [] for i in dataset_ids}
+    if not dataset_ids:
+        return out
+
+    qs = DatasetRow.objects.filter(dataset_id__in=dataset_ids)
+    if min_id:
+        qs = qs.filter(id__gte=min_id)
+    if compact:
+        qs = qs.defer("data", "data_compact").annotate(
+            _data=Coalesce("data_compact", "data", output_field=JSONField())
+        )
+    if limit:
+        qs = qs.annotate(
+            _rn=Window(RowNumber(), partition_by=[F("dataset_id")], order_by=F("id").asc())
+        ).filter(_rn__lte=limit)
+
+    for r in qs.order_by("dataset_id", "id"):
+        if compact:
+            r.data = r._data
+        out[r.dataset_id].append(r)
+    # у архивного датасета строк в таблице нет — лишний запрос только для пустых
+    empty = [i for i, rows in out.items() if not rows]
+    if empty:
+        out.update(archived_rows(empty, limit=limit, compact=compact, min_id=min_id))
+    return out
+
+
+def _latest_rows_for_datasets(dataset_ids):
+    """
+    Последняя строка (max id) каждого датасета одним запросом (DISTINCT ON dataset_id).
+    Возвращает {dataset_id: DatasetRow}.
+    """
+    dataset_ids = list({i for i in dataset_ids if i})
+    if not dataset_ids:
+        return {}
+    qs = (DatasetRow.objects
+          .filter(dataset_id__in=dataset_ids)
+          .order_by("dataset_id", "-id")
+          .distinct("dataset_id"))
+    out = {r.dataset_id: r for r in qs}
+    missing = [i for i in dataset_ids if i not in out]
+    if missing:
+        out.update({i: rows[-1] for i, rows in archived_rows(missing, latest=True).items() if rows})
+    return out
+
+
+def _dataset_rows(ds) -> list:
+    """Все строки датасета по id ASC (архивный — из архива)."""
+    if getattr(ds, "archived", False):
+        return archived_rows([ds.id]).get(ds.id, [])
+    return list(DatasetRow.objects.filter(dataset_id=ds.id).order_by("id"))
+
+
 # ---------------------------
 # Public API
 # ---------------------------
@@ -133,123 +237,110 @@ def resolve_dataset_id(handle: str, date_str: str | None = None) -> int:
     return ds.id
 
 
-class ResolveRowsView(APIView):
+def _resolve_rows_payload(handle: str, query_params):
     """
-    GET /api/datasets/resolve/rows/?handle=<slug>&latest=1
-    GET /api/datasets/resolve/rows/?handle=<slug>&date=DD.MM.YYYY
-      Параметры (опц.):
-        - aggregate: 0|1  (по умолчанию 1) — слить все строки в один словарь
-        - limit: int      — если aggregate=0, максимум строк (по умолчанию 5000, макс. 50_000)
-        - start_row: int  — id, с которого читать (только при aggregate=0)
-        - single: 1       — вернуть единый объект (мета + данные)
-
-    По умолчанию aggregate=1 → всегда "один словарь" по датасету.
+    Тело ResolveRowsView.get без привязки к request (переиспользуется async-вариантом).
+    Возвращает (payload, http_status).
     """
-    permission_classes = [IsAuthenticated]
-
-    def get(self, request):
-        handle = (request.query_params.get("handle") or "").strip()
-        if not handle:
-            return Response({"detail": "param 'handle' is required"}, status=400)
-
-        date_str = request.query_params.get("date")
-        status_param = request.query_params.get("status")  # 'approved' | 'draft' | 'latest'
-        aggregate = str(request.query_params.get("aggregate") or "1").lower() in ("1", "true", "yes")
-        rows_mode = (request.query_params.get("rows") or "none").lower()  # 'none' | 'all'
-        single_mode = request.query_params.get("single") in ("1", "true", "yes")
-
-        wb = _get_workbook_for(handle, date_str)
-        status_param_norm = (status_param or "latest").lower()
-        if status_param_norm in ("approved", "draft"):
-            ds = (Dataset.objects
-                  .filter(sheet__workbook=wb,
-                          status=(Dataset.STATUS_APPROVED if status_param_norm == "approved"
-                                  else Dataset.STATUS_DRAFT))
-                  .order_by("-created_at", "-id")
-                  .first())
-            if not ds:
-                # НЕТ датасета с указанным статусом для этого периода → 404
-                # Сообщение по сути: "эта таблица либо была подтверждена, либо не существует (в запрошенном статусе)"
-                return Response(
-                    {
-                        "detail": (
-                            f"Для handle='{handle}' и даты '{format_client_date(getattr(wb, 'period_date', None))}' "
-                            f"нет версии со статусом '{status_param_norm}'."
-                        )
-                    },
-                    status=404,
-                )
-        else:
-            # старое поведение для status=latest/None
-            ds = _pick_dataset_by_status(wb, status_param)
-        # ─────────────────────────────────────────────────────────────────────────────
+    date_str = query_params.get("date")
+    status_param = query_params.get("status")  # 'approved' | 'draft' | 'latest'
+    aggregate = str(query_params.get("aggregate") or "1").lower() in ("1", "true", "yes")
+    rows_mode = (query_params.get("rows") or "none").lower()  # 'none' | 'all'
+    single_mode = query_params.get("single") in ("1", "true", "yes")
 
+    wb = _get_workbook_for(handle, date_str)
+    status_param_norm = (status_param or "latest").lower()
+    if status_param_norm in ("approved", "draft"):
+        ds = (Dataset.objects
+              .filter(sheet__workbook=wb,
+                      status=(Dataset.STATUS_APPROVED if status_param_norm == "approved"
+                              else Dataset.STATUS_DRAFT))
+              .order_by("-created_at", "-id")
+              .first())
         if not ds:
-            return Response({"detail": "dataset not found for workbook"}, status=404)
-
-        dataset_id = ds.id
+            # НЕТ датасета с указанным статусом для этого периода → 404
+            # Сообщение по сути: "эта таблица либо была подтверждена, либо не существует (в запрошенном статусе)"
+            return {
+                "detail": (
+                    f"Для handle='{handle}' и даты '{format_client_date(getattr(wb, 'period_date', None))}' "
+                    f"нет версии со статусом '{status_param_norm}'."
+                )
+            }, 404
+    else:
+        # старое поведение для status=latest/None
+        ds = _pick_dataset_by_status(wb, status_param)
+    # ─────────────────────────────────────────────────────────────────────────────
 
-        # общая мета карточки (как в dashboard)
-        hr = HandleRegistry.objects.filter(handle=handle).only(
-            "title", "order_index", "group", "icon", "color"
-        ).first()
-        meta = {
-            "handle": handle,
-            "title": (hr.title if hr and hr.title else handle),
-            "order_index": (hr.order_index if hr else None),
-            "group": (hr.group if hr else ""),
-            "period": format_client_date(getattr(wb, "period_date", None)),
-            "status": ds.status,
-            "version": ds.version,
-            "icon": (hr.icon if hr else ""),
-            "color": (hr.color if hr else ""),
+    if not ds:
+        return {"detail": "dataset not found for workbook"}, 404
+
+    dataset_id = ds.id
+
+    # общая мета карточки (как в dashboard)
+    hr = HandleRegistry.objects.filter(handle=handle).only(
+        "title", "order_index", "group", "icon", "color"
+    ).first()
+    meta = {
+        "handle": handle,
+        "title": (hr.title if hr and hr.title else handle),
+        "order_index": (hr.order_index if hr else None),
+        "group": (hr.group if hr else ""),
+        "period": format_client_date(getattr(wb, "period_date", None)),
+        "status": ds.status,
+        "version": ds.version,
+        "icon": (hr.icon if hr else ""),
+        "color": (hr.color if hr else ""),
+    }
+
+    if aggregate:
+        rows = _dataset_rows(ds)
+        merged = _merge_rows_data(rows)
+        latest_row = rows[-1] if rows else None
+
+        obj = {
+            "id": latest_row.id if latest_row else None,
+            "data": merged,
+            "imported_at": latest_row.imported_at if latest_row else None,
+            "rows_count": len(rows),
         }
+        # rows=all → приложим и массив строк
+        if rows_mode == "all":
+            obj["rows"] = [{"id": r.id, "data": (r.data or {}), "imported_at": r.imported_at} for r in rows]
 
-        if aggregate:
-            rows_qs = DatasetRow.objects.filter(dataset_id=dataset_id).order_by("id")
-            rows = list(rows_qs)
-            merged = _merge_rows_data(rows)
-            latest_row = rows[-1] if rows else None
-
-            obj = {
-                "id": latest_row.id if latest_row else None,
-                "data": merged,
-                "imported_at": latest_row.imported_at if latest_row else None,
-                "rows_count": len(rows),
-            }
-            # rows=all → приложим и массив строк
-            if rows_mode == "all":
-                obj["rows"] = [{"id": r.id, "data": (r.data or {}), "imported_at": r.imported_at} for r in rows]
-
-            meta.update(obj)
-            return Response(meta)
+        meta.update(obj)
+        return meta, 200
 
-        # aggregate=0 → как раньше: массив строк (или single объект)
-        # NEW: пагинация по страницам
-        try:
-            page = int(request.query_params.get("page", 1))
-        except ValueError:
-            page = 1
-        page = max(1, page)
-
-        try:
-            page_size = int(request.query_params.get("page_size", request.query_params.get("limit", 5000)))
-        except ValueError:
-            page_size = 5000
-        page_size = max(1, min(1000, page_size))  # защита
+    # aggregate=0 → как раньше: массив строк (или single объект)
+    # NEW: пагинация по страницам
+    try:
+        page = int(query_params.get("page", 1))
+    except ValueError:
+        page = 1
+    page = max(1, page)
 
-        try:
-            header_rows = int(request.query_params.get("header_rows", 0))
-        except ValueError:
-            header_rows = 0
-        header_rows = max(0, min(50, header_rows))  # обычно 5-10, пусть будет до 50
+    try:
+        page_size = int(query_params.get("page_size", query_params.get("limit", 5000)))
+    except ValueError:
+        page_size = 5000
+    page_size = max(1, min(1000, page_size))  # защита
 
-        # старый start_row оставляем (если нужно)
-        try:
-            start_row = int(request.query_params.get("start_row", 0))
-        except ValueError:
-            start_row = 0
+    try:
+        header_rows = int(query_params.get("header_rows", 0))
+    except ValueError:
+        header_rows = 0
+    header_rows = max(0, min(50, header_rows))  # обычно 5-10, пусть будет до 50
 
+    # старый start_row оставляем (если нужно)
+    try:
+        start_row = int(query_params.get("start_row", 0))
+    except ValueError:
+        start_row = 0
+
+    if ds.archived:
+        # архивный датасет: строки из архива списком, срезы ниже — те же
+        base_qs = [r for r in _dataset_rows(ds) if r.id >= start_row]
+        total_rows = len(base_qs)
+    else:
         base_qs = DatasetRow.objects.filter(dataset_id=dataset_id).order_by("id")
 
         if start_row > 0:
@@ -257,55 +348,32 @@ def get(self, request):
 
         total_rows = base_qs.count()
 
-        # header = первые N строк (от начала base_qs)
-        header = []
-        if header_rows > 0:
-            header = [
-                {"id": r.id, "data": (r.data or {}), "imported_at": r.imported_at}
-                for r in base_qs[:header_rows]
-            ]
-
-        # body = всё после header_rows
-        body_qs = base_qs[header_rows:]
-        body_total = max(0, total_rows - header_rows)
-
-        total_pages = max(1, (body_total + page_size - 1) // page_size)
-        if page > total_pages:
-            page = total_pages
-
-        offset = (page - 1) * page_size
-        rows_page = body_qs[offset: offset + page_size]
-
-        rows = [
+    # header = первые N строк (от начала base_qs)
+    header = []
+    if header_rows > 0:
+        header = [
             {"id": r.id, "data": (r.data or {}), "imported_at": r.imported_at}
-            for r in rows_page
+            for r in base_qs[:header_rows]
         ]
 
-        # single=1: вернём как раньше (но можно оставить meta+header+rows, это удобнее фронту)
-        if single_mode:
-            meta.update({
-                "header": header,
-                "rows": rows,
-                "pagination": {
-                    "page": page,
-                    "page_size": page_size,
-                    "header_rows": header_rows,
-
-                    "total_rows": total_rows,   # header+body
-                    "body_rows": body_total,    # только body (после header_rows)
+    # body = всё после header_rows
+    body_qs = base_qs[header_rows:]
+    body_total = max(0, total_rows - header_rows)
 
-                    "total_pages": total_pages,
+    total_pages = max(1, (body_total + page_size - 1) // page_size)
+    if page > total_pages:
+        page = total_pages
 
-                    "has_next": page < total_pages,
-                    "has_prev": page > 1,
+    offset = (page - 1) * page_size
+    rows_page = body_qs[offset: offset + page_size]
 
-                    "next_page": (page + 1) if page < total_pages else None,
-                    "prev_page": (page - 1) if page > 1 else None,
-                }
-            })
-            return Response(meta)
+    rows = [
+        {"id": r.id, "data": (r.data or {}), "imported_at": r.imported_at}
+        for r in rows_page
+    ]
 
-        # по умолчанию вернём объект с meta, header, rows (а не голый список)
+    # single=1: вернём как раньше (но можно оставить meta+header+rows, это удобнее фронту)
+    if single_mode:
         meta.update({
             "header": header,
             "rows": rows,
@@ -313,14 +381,60 @@ def get(self, request):
                 "page": page,
                 "page_size": page_size,
                 "header_rows": header_rows,
-                "total_rows": total_rows,
-                "body_rows": body_total,
+
+                "total_rows": total_rows,   # header+body
+                "body_rows": body_total,    # только body (после header_rows)
+
                 "total_pages": total_pages,
+
                 "has_next": page < total_pages,
                 "has_prev": page > 1,
+
+                "next_page": (page + 1) if page < total_pages else None,
+                "prev_page": (page - 1) if page > 1 else None,
             }
         })
-        return Response(meta)
+        return meta, 200
+
+    # по умолчанию вернём объект с meta, header, rows (а не голый список)
+    meta.update({
+        "header": header,
+        "rows": rows,
+        "pagination": {
+            "page": page,
+            "page_size": page_size,
+            "header_rows": header_rows,
+            "total_rows": total_rows,
+            "body_rows": body_total,
+            "total_pages": total_pages,
+            "has_next": page < total_pages,
+            "has_prev": page > 1,
+        }
+    })
+    return meta, 200
+
+
+class ResolveRowsView(APIView):
+    """
+    GET /api/datasets/resolve/rows/?handle=<slug>&latest=1
+    GET /api/datasets/resolve/rows/?handle=<slug>&date=DD.MM.YYYY
+      Параметры (опц.):
+        - aggregate: 0|1  (по умолчанию 1) — слить все строки в один словарь
+        - limit: int      — если aggregate=0, максимум строк (по умолчанию 5000, макс. 50_000)
+        - start_row: int  — id, с которого читать (только при aggregate=0)
+        - single: 1       — вернуть единый объект (мета + данные)
+
+    По умолчанию aggregate=1 → всегда "один словарь" по датасету.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        handle = (request.query_params.get("handle") or "").strip()
+        if not handle:
+            return Response({"detail": "param 'handle' is required"}, status=400)
+
+        payload, status = _resolve_rows_payload(handle, request.query_params)
+        return Response(payload, status=status)
 
 
 class DatasetStatusUpdateView(APIView):
@@ -369,8 +483,11 @@ def post(self, request):
         if before == new_status:
             return Response({"detail": "no-op (status unchanged)"}, status=200)
 
-        ds.status = new_status
-        ds.save(update_fields=["status"])
+        # approve — смена указателя воркбука и статусов версий, строки не трогаются
+        try:
+            set_dataset_status(ds, new_status)
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=409)
 
         UploadHistory.objects.create(
             user=request.user,
@@ -379,11 +496,12 @@ def post(self, request):
             workbook=wb,
             dataset=ds,
             filename=wb.filename,
-            rows_count=ds.rows.count(),
+            rows_count=dataset_row_count(ds),
             action=UploadHistory.ACTION_STATUS_CHANGE,
             status_before=before,
             status_after=new_status,
         )
+        handle_data_changed(handle)
 
         return Response({
             "dataset_id": ds.id,
@@ -0,0 +1,99 @@
+# analytics/views_series.py
+import hashlib
+import json
+
+from django.core.cache import cache
+from rest_framework.views import APIView
+from rest_framework.response import Response
+from rest_framework.permissions import IsAuthenticated
+
+from ingest.models import Workbook, Dataset
+from .aggregation import AggregationError, aggregate_datasets, aggregate_params_filters
+from .caching import cache_timeout, handle_generations
+from .views_resolve import parse_client_date, format_client_date, _pick_datasets_for_workbooks
+
+SERIES_CACHE = "series:{gen}:{digest}"
+
+
+def _period_workbooks(handle: str, date_from=None, date_to=None):
+    """Самый свежий workbook на каждый period_date handle (как _get_workbook_for), по возрастанию дат."""
+    qs = Workbook.objects.filter(handle=handle, period_date__isnull=False)
+    if date_from:
+        qs = qs.filter(period_date__gte=date_from)
+    if date_to:
+        qs = qs.filter(period_date__lte=date_to)
+    return list(
+        qs.order_by("period_date", "-id").distinct("period_date").only("id", "period_date")
+    )
+
+
+def handle_series(handle: str, metric: str, status: str = "approved", date_from=None, date_to=None,
+                  filters=None, exclude=None) -> dict:
+    """
+    Одна метрика по всем периодам handle: на каждый period_date — датасет нужного статуса
+    (approved/draft — строго, latest — самый свежий), агрегат по всем — одним запросом.
+    Результат кэшируется по набору (dataset_id, version) и поколению handle.
+    """
+    wbs = _period_workbooks(handle, date_from, date_to)
+    strict = status in (Dataset.STATUS_APPROVED, Dataset.STATUS_DRAFT)
+    ds_by_wb = _pick_datasets_for_workbooks([wb.id for wb in wbs], status, strict=strict)
+    picked = [(wb, ds_by_wb[wb.id]) for wb in wbs if wb.id in ds_by_wb]
+
+    digest = hashlib.sha1(json.dumps(
+        [metric, filters or {}, exclude or {}, [(ds.id, ds.version) for _, ds in picked]],
+        sort_keys=True, ensure_ascii=False,
+    ).encode("utf-8")).hexdigest()
+    key = SERIES_CACHE.format(gen=handle_generations([handle])[handle], digest=digest)
+    values = cache.get(key)
+    if values is None:
+        values = aggregate_datasets([ds.id for _, ds in picked], metric, filters=filters, exclude=exclude)
+        cache.set(key, values, timeout=cache_timeout())
+
+    return {
+        "handle": handle,
+        "metric": metric,
+        "status": status,
+        "points": [
+            {
+                "period": format_client_date(wb.period_date),
+                "dataset_id": ds.id,
+                "version": ds.version,
+                "value": values.get(ds.id),
+            }
+            for wb, ds in picked
+        ],
+    }
+
+
+class HandleSeriesView(APIView):
+    """
+    GET /api/handles/<handle>/series/?key=<ключ>&agg=sum|avg|min|max|count|last
+        &status=approved|draft|latest&date_from=..&date_to=..&filters[k]=v&exclude[k]=v
+
+    -> {"handle", "metric", "status", "points": [{"period", "dataset_id", "version", "value"}, ...]}
+    Периоды — по Workbook.period_date (от старых к новым); для каждого — один датасет.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, handle: str):
+        qp = request.query_params
+        key = (qp.get("key") or "").strip()
+        agg = (qp.get("agg") or "sum").strip().lower()
+        status = (qp.get("status") or Dataset.STATUS_APPROVED).strip().lower()
+        if status not in (Dataset.STATUS_APPROVED, Dataset.STATUS_DRAFT, "latest"):
+            return Response({"detail": "status must be approved, draft or latest"}, status=400)
+        if agg != "count" and not key:
+            return Response({"detail": "param 'key' is required"}, status=400)
+        try:
+            date_from = parse_client_date(qp.get("date_from"))
+            date_to = parse_client_date(qp.get("date_to"))
+        except ValueError:
+            return Response({"detail": "date_from/date_to: DD.MM.YYYY or YYYY-MM-DD"}, status=400)
+
+        filters, exclude = aggregate_params_filters(qp)
+        metric = agg if agg == "count" else f"{agg}:{key}"
+        try:
+            payload = handle_series(handle, metric, status, date_from, date_to, filters, exclude)
+        except AggregationError as e:
+            return Response({"detail": str(e)}, status=400)
+        return Response(payload)
@@ -1,5 +1,9 @@
 # analytics/views_users.py
-from django.db.models import Q
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.db.models import Prefetch, Q
 from django.contrib.auth import get_user_model
 from django.db import transaction
 from rest_framework import viewsets, permissions, status
@@ -8,6 +12,8 @@
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
 from ingest.models import HandleRegistry
+from . import access
+from .caching import cache_timeout, user_generation
 from .serializers import UserSerializer, CurrentUserSerializer
 
 User = get_user_model()
@@ -18,7 +24,7 @@ class IsSuperAdminOrGroup(permissions.BasePermission):
     """
     def has_permission(self, request, view):
         u = request.user
-        return bool(u and u.is_authenticated and (u.is_superuser or u.groups.filter(name="superadmins").exists()))
+        return bool(u and u.is_authenticated and (u.is_superuser or access.in_group(u, "superadmins")))
 
 class UserViewSet(viewsets.ModelViewSet):
     """
@@ -117,7 +123,41 @@ def deactivate(self, request, pk=None):
         return Response({"detail": "deactivated"})
 
 
+def _current_user_payload(request) -> dict:
+    """Данные /api/auth/me/ фиксированным числом запросов: пользователь+профиль и три prefetch."""
+    user = (User.objects
+            .select_related("profile")
+            .prefetch_related(
+                "groups",
+                "user_permissions",
+                Prefetch("allowed_handles", queryset=HandleRegistry.objects.only("id", "handle", "title")),
+            )
+            .get(pk=request.user.pk))
+    return CurrentUserSerializer(user, context={"request": request}).data
+
+
 class CurrentUserMeView(APIView):
+    """
+    GET /api/auth/me/ — кэшируется по пользователю (см. analytics.caching.user_generation:
+    сбрасывается при смене групп, прав, назначенных handle, профиля и самого пользователя)
+    и отдаётся с ETag: на If-None-Match с тем же ETag — 304 без тела.
+    """
     permission_classes = [IsAuthenticated]
+
     def get(self, request):
-        return Response(CurrentUserSerializer(request.user, context={"request": request}).data)
+        key = f"auth:me:{user_generation(request.user.pk)}:{request.user.pk}"
+        cached = cache.get(key)
+        if cached is None:
+            data = _current_user_payload(request)
+            raw = json.dumps(data, sort_keys=True, default=str).encode("utf-8")
+            cached = (data, f'"{hashlib.sha1(raw).hexdigest()}"')
+            cache.set(key, cached, timeout=cache_timeout())
+        data, etag = cached
+
+        if etag in [t.strip() for t in request.headers.get("If-None-Match", "").split(",")]:
+            resp = Response(status=304)
+        else:
+            resp = Response(data)
+        resp["ETag"] = etag
+        resp["Cache-Control"] = "private, no-cache"
+        return resp
@@ -5,6 +5,9 @@
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+Run under uvicorn:
+    uvicorn analytics_portal.asgi:application --host 0.0.0.0 --port 8000 --workers 4
 """
 
 import os
@@ -1,10 +1,19 @@
 # analytics_portal/middleware.py
+import time
 from datetime import timedelta
 
+from django.conf import settings
+
+from analytics import access
+
+
 class PerUserSessionExpiryMiddleware:
     """
     Для всех: 30 минут (берётся из SESSION_COOKIE_AGE)
     Для группы long_session: более длинная сессия.
+
+    Группы берутся из кэша (analytics.access.group_names), а срок ставится только если
+    он ещё не такой — иначе set_expiry помечает сессию изменённой и её пришлось бы сохранять.
     """
     LONG_SESSION_SECONDS = 14 * 24 * 60 * 60
 
@@ -14,10 +23,40 @@ def __init__(self, get_response):
     def __call__(self, request):
         user = getattr(request, "user", None)
         if user and user.is_authenticated:
-            if user.groups.filter(name="long_session").exists():
+            if access.in_group(user, "long_session"):
                 try:
-                    request.session.set_expiry(self.LONG_SESSION_SECONDS)
+                    if request.session.get("_session_expiry") != self.LONG_SESSION_SECONDS:
+                        request.session.set_expiry(self.LONG_SESSION_SECONDS)
                 except Exception:
                     pass
 
         return self.get_response(request)
+
+
+class ThrottledSessionRefreshMiddleware:
+    """
+    Скользящий срок сессии без записи на каждый запрос (вместо SESSION_SAVE_EVERY_REQUEST):
+    сессия помечается изменённой — и значит сохраняется, а кука получает новый срок —
+    не чаще раза в SESSION_REFRESH_INTERVAL секунд. Срок продлевается с точностью до этого интервала.
+    Ставить после SessionMiddleware.
+    """
+    REFRESHED_AT = "_refreshed_at"
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.interval = int(getattr(settings, "SESSION_REFRESH_INTERVAL", 60))
+
+    def __call__(self, request):
+        session = getattr(request, "session", None)
+        # пустую/новую сессию не заводим ради отметки
+        if session is not None and session.session_key:
+            now = int(time.time())
+            try:
+                refreshed_at = int(session.get(self.REFRESHED_AT, 0))
+                # session_key сбрасывается при загрузке, если сессия уже истекла
+                if session.session_key and now - refreshed_at >= self.interval:
+                    session[self.REFRESHED_AT] = now
+            except Exception:
+                pass
+
+        return self.get_response(request)
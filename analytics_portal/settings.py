@@ -71,6 +71,7 @@
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    "analytics_portal.middleware.ThrottledSessionRefreshMiddleware",
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -172,6 +173,20 @@
 # }
 
 WSGI_APPLICATION = 'analytics_portal.wsgi.application'
+ASGI_APPLICATION = 'analytics_portal.asgi.application'
+
+# сколько карточек дашборда читать из БД одновременно в async-вьюхах (см. analytics/views_async.py)
+DASHBOARD_ASYNC_CONCURRENCY = int(os.environ.get("DASHBOARD_ASYNC_CONCURRENCY", "8"))
+
+# v2-таблицы (Luckysheet): хранить компактную копию сетки в разреженном виде celldata
+LUCKYSHEET_COMPACT_CELLDATA = os.environ.get("LUCKYSHEET_COMPACT_CELLDATA", "0").lower() in ("1", "true", "yes")
+
+# кэш карточек дашборда (analytics/caching.py): TTL и прогрев (задача warm_dashboard_cache)
+DASHBOARD_CACHE_TIMEOUT = int(os.environ.get("DASHBOARD_CACHE_TIMEOUT", 6 * 60 * 60))
+DASHBOARD_WARM_PERIODS = int(os.environ.get("DASHBOARD_WARM_PERIODS", "3"))  # сколько последних периодов греть
+DASHBOARD_WARM_VARIANTS = [  # query-параметры, с которыми фронт запрашивает карточки
+    {"rows": "all", "rows_limit": "5000"},
+]
 
 
 # Database
@@ -212,7 +227,12 @@
 
 # --- Sessions ---
 SESSION_COOKIE_AGE = 30 * 60    # 30 минут
-SESSION_SAVE_EVERY_REQUEST = True
+# срок скользящий, но сессия пишется не на каждый запрос, а раз в SESSION_REFRESH_INTERVAL секунд
+# (ThrottledSessionRefreshMiddleware); SESSION_SAVE_EVERY_REQUEST=1 — старое поведение
+SESSION_SAVE_EVERY_REQUEST = os.environ.get("SESSION_SAVE_EVERY_REQUEST", "0").lower() in ("1", "true", "yes")
+SESSION_REFRESH_INTERVAL = int(os.environ.get("SESSION_REFRESH_INTERVAL", "60"))
+# сессии читаются из кэша (при промахе — из БД); с Redis (REDIS_CACHE_URL) общие для всех процессов
+SESSION_ENGINE = os.environ.get("SESSION_ENGINE", "django.contrib.sessions.backends.cached_db")
 SESSION_EXPIRE_AT_BROWSER_CLOSE = False
 
 
@@ -248,6 +268,30 @@
 EGOV_API_TIMEOUT = int(os.environ.get("EGOV_API_TIMEOUT", "20"))
 
 EXTERNAL_EKSPORT_API_KEY = os.environ.get("EXTERNAL_EKSPORT_API_KEY", "")
+# старый общий ключ действует только для этих handle; остальным — ключи analytics.ApiKey
+EXTERNAL_EKSPORT_API_KEY_HANDLES = ["1-eksport", "eksport-svod"]
+# лента /api/changes/ не отдаёт события моложе N секунд (ждём коммита параллельных транзакций)
+CHANGES_SETTLE_SECONDS = int(os.environ.get("CHANGES_SETTLE_SECONDS", "30"))
+# /api/aggregate: не больше стольких групп в ответе
+AGGREGATE_MAX_GROUPS = int(os.environ.get("AGGREGATE_MAX_GROUPS", "1000"))
+# downsample: не больше стольких групп читается до прореживания (иначе — 400)
+AGGREGATE_DOWNSAMPLE_MAX_INPUT = int(os.environ.get("AGGREGATE_DOWNSAMPLE_MAX_INPUT", str(AGGREGATE_MAX_GROUPS * 50)))
+# /api/datasets/<id>/keys для датасета без сохранённой статистики: по стольким строкам (точная — в фоне)
+KEYS_SAMPLE_ROWS = int(os.environ.get("KEYS_SAMPLE_ROWS", "10000"))
+# типизированная проекция (numeric[]/date[]) для агрегатов — датасетам от стольких строк
+TYPED_VALUES_MIN_ROWS = int(os.environ.get("TYPED_VALUES_MIN_ROWS", "5000"))
+# число HASH-секций ingest_datasetrow при переводе командой partition_dataset_rows (ingest.partitioning)
+DATASET_ROW_PARTITIONS = int(os.environ.get("DATASET_ROW_PARTITIONS", "16"))
+# через сколько секунд после замены новой версией удалять superseded-версию датасета
+DATASET_VERSIONS_GC_GRACE_SECONDS = int(os.environ.get("DATASET_VERSIONS_GC_GRACE_SECONDS", "3600"))
+# сколько последних периодов handle держать в горячей таблице; старше — в архив (ingest.archive)
+ARCHIVE_KEEP_PERIODS = int(os.environ.get("ARCHIVE_KEEP_PERIODS", "12"))
+# сколько держать развёрнутые для агрегатов строки архива (DatasetArchiveRow), сек
+ARCHIVE_STAGE_TTL_SECONDS = int(os.environ.get("ARCHIVE_STAGE_TTL_SECONDS", str(24 * 60 * 60)))
+# ревизии строк (ingest.revisions): каждая N-я версия — полный снимок, остальные — дельты
+REVISIONS_KEYFRAME_EVERY = int(os.environ.get("REVISIONS_KEYFRAME_EVERY", "20"))
+# сколько секунд держать найденный ключ analytics.ApiKey в кэше
+API_KEY_CACHE_TIMEOUT = int(os.environ.get("API_KEY_CACHE_TIMEOUT", "300"))
 
 FRONTEND_AFTER_LOGIN_URL = os.environ.get(
     "BASE_URL"
@@ -270,17 +314,31 @@
 
 USE_TZ = True
 
-# CACHES = {
-#   "default": {
-#     "BACKEND": "django_redis.cache.RedisCache",
-#     "LOCATION": "redis://localhost:6379/1",
-#     "OPTIONS": {"CLIENT_CLASS": "django_redis.client.DefaultClient"},
-#   }
-# }
+# Общий кэш для всех процессов (веб + celery) — Redis; без REDIS_CACHE_URL — локальный в памяти процесса
+# (только для разработки: при SHARED_CACHE_REQUIRED manage.py check падает, см. analytics/checks.py)
+REDIS_CACHE_URL = os.environ.get("REDIS_CACHE_URL", "")
+SHARED_CACHE_REQUIRED = os.environ.get("SHARED_CACHE_REQUIRED", str(not DEBUG)).lower() in ("1", "true", "yes")
+if REDIS_CACHE_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django_redis.cache.RedisCache",
+            "LOCATION": REDIS_CACHE_URL,
+            "OPTIONS": {"CLIENT_CLASS": "django_redis.client.DefaultClient"},
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "analytics-portal",
+        }
+    }
 
 # --- Celery ---
-CELERY_TASK_ALWAYS_EAGER = True
-CELERY_TASK_EAGER_PROPAGATES = True
+# Eager — задачи выполняются прямо в запросе (разработка). В проде: CELERY_TASK_ALWAYS_EAGER=0,
+# брокер CELERY_BROKER_URL и воркер, иначе пересчёты после коммита идут синхронно.
+CELERY_TASK_ALWAYS_EAGER = os.environ.get("CELERY_TASK_ALWAYS_EAGER", "1").lower() in ("1", "true", "yes")
+CELERY_TASK_EAGER_PROPAGATES = os.environ.get("CELERY_TASK_EAGER_PROPAGATES", "1").lower() in ("1", "true", "yes")
 
 CELERY_BROKER_URL = os.environ.get("CELERY_BROKER_URL", "redis://127.0.0.1:6379/0")
 CELERY_RESULT_BACKEND = os.environ.get("CELERY_RESULT_BACKEND", "redis://127.0.0.1:6379/1")
@@ -300,13 +358,26 @@
 
 # Celery Beat расписание
 if os.environ.get("ENABLE_BEAT") == "1":
+    from celery.schedules import crontab
 
     CELERY_BEAT_SCHEDULE = {
         "refresh-mv": {
             "task": "analytics.tasks.refresh_materialized_views",
             "schedule": 3600,  # раз в час
             "args": (True,),   # пытаемся CONCURRENTLY
-        }
+        },
+        "warm-dashboard-cache": {
+            "task": "analytics.tasks.warm_dashboard_cache",
+            "schedule": crontab(hour=3, minute=0),  # раз в сутки, ночью
+        },
+        "gc-dataset-versions": {
+            "task": "analytics.tasks.gc_dataset_versions",
+            "schedule": 1800,  # superseded-версии датасетов
+        },
+        "archive-old-datasets": {
+            "task": "analytics.tasks.archive_old_datasets",
+            "schedule": crontab(hour=4, minute=0),  # старые периоды -> архив, после refresh ночью
+        },
     }
 else:
     CELERY_BEAT_SCHEDULE = {}
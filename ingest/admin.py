@@ -11,6 +11,10 @@
 from .models import Workbook, Dataset, DatasetRow, DataTemplate, ColumnMapping, DatasetRowRevision, HandleRegistry, \
     UploadHistory
 from analytics.tasks import import_excel_task
+from analytics.caching import handle_data_changed
+from analytics.dataset_keys import dataset_rows_changed
+from .revisions import record_revision
+from .versioning import approve_dataset, dataset_row_count
 
 
 # === DataTemplate & ColumnMapping ===
@@ -50,6 +54,19 @@ class HandleRegistryAdmin(admin.ModelAdmin):
     )
 
 
+def _rows_changed(dataset_ids):
+    """
+    Строки изменены из админки: статистика ключей и проекция — по каждому датасету,
+    кэши и сохранённые графики (версия датасета не меняется) — по каждому handle один раз.
+    """
+    dataset_ids = sorted(set(dataset_ids))
+    for dataset_id in dataset_ids:
+        dataset_rows_changed(dataset_id)
+    handles = Dataset.objects.filter(id__in=dataset_ids).values_list("sheet__workbook__handle", flat=True)
+    for handle in sorted(set(handles)):
+        handle_data_changed(handle)
+
+
 # ---------- EXPORT ----------
 class DatasetRowResource(resources.ModelResource):
     """
@@ -60,6 +77,20 @@ class Meta:
         fields = ("id", "dataset__id", "data",)
         export_order = ("id", "dataset__id", "data",)
 
+    def before_import(self, dataset, **kwargs):
+        super().before_import(dataset, **kwargs)
+        self._changed_datasets = set()
+
+    def after_save_instance(self, instance, row, **kwargs):
+        super().after_save_instance(instance, row, **kwargs)
+        self._changed_datasets.add(instance.dataset_id)
+
+    def after_import(self, dataset, result, **kwargs):
+        """Строки записаны — пересчёт по каждому затронутому датасету один раз на импорт."""
+        super().after_import(dataset, result, **kwargs)
+        if not kwargs.get("dry_run"):
+            _rows_changed(self._changed_datasets)
+
 
 @admin.register(DatasetRow)
 class DatasetRowAdmin(ImportExportModelAdmin):
@@ -68,6 +99,23 @@ class DatasetRowAdmin(ImportExportModelAdmin):
     list_filter = ("dataset",)
     date_hierarchy = "imported_at"
 
+    def save_model(self, request, obj, form, change):
+        if change and "data" in form.changed_data:
+            # правка строки — новой ревизией (ingest.revisions); сброс кэшей — внутри
+            record_revision(obj.pk, obj.data, user=request.user)
+            return
+        super().save_model(request, obj, form, change)
+        _rows_changed([obj.dataset_id])
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        _rows_changed([obj.dataset_id])
+
+    def delete_queryset(self, request, queryset):
+        dataset_ids = set(queryset.values_list("dataset_id", flat=True))
+        super().delete_queryset(request, queryset)
+        _rows_changed(dataset_ids)
+
     @admin.display(description="data (short)")
     def short_data(self, obj):
         s = str(obj.data)[:120].replace("{", "").replace("}", "")
@@ -88,33 +136,53 @@ def publish_datasets(modeladmin, request, queryset):
     updated = 0
     for ds in queryset:
         if ds.status != Dataset.STATUS_APPROVED:
-            ds.status = Dataset.STATUS_APPROVED
-            # версию можно увеличивать по вашей бизнес-логике
-            ds.version = ds.version or 1
-            ds.save(update_fields=["status", "version"])
+            # указатель воркбука на эту версию, прежняя approved -> superseded
+            try:
+                before = approve_dataset(ds)
+            except ValueError as e:
+                messages.error(request, str(e))
+                continue
+            wb = ds.sheet.workbook
+            UploadHistory.objects.create(
+                user=request.user,
+                handle=wb.handle or "",
+                period_date=wb.period_date,
+                workbook=wb,
+                dataset=ds,
+                filename=wb.filename,
+                rows_count=dataset_row_count(ds),
+                action=UploadHistory.ACTION_STATUS_CHANGE,
+                status_before=before,
+                status_after=ds.status,
+                extra={"reason": "admin publish_datasets"},
+            )
+            handle_data_changed(wb.handle)
             updated += 1
     messages.success(request, f"Опубликовано: {updated} датасетов")
 
 
 @admin.register(Dataset)
 class DatasetAdmin(admin.ModelAdmin):
-    list_display = ("name", "id", "sheet", "status", "version", "created_at", "rows_count")
-    list_filter  = ("status", "sheet__workbook__handle")
+    list_display = ("name", "id", "sheet", "status", "version", "archived", "created_at", "rows_count")
+    list_filter  = ("status", "archived", "sheet__workbook__handle")
     search_fields = ("name",)
     fields = ("name", "sheet", "period_date", "status", "inferred_schema", "primary_key", "meta")
+    # статус меняется только через ingest.versioning (действие publish_datasets, API статуса):
+    # прямая запись минует указатель воркбука, superseded прежней версии и перенос графиков
+    readonly_fields = ("status",)
 
     actions = [publish_datasets]
 
     def rows_count(self, obj):
 
-        return obj.rows.count()
+        return dataset_row_count(obj) if obj.archived else obj.rows.count()
 
 
 @admin.register(DatasetRowRevision)
 class DatasetRowRevisionAdmin(admin.ModelAdmin):
-    list_display = ("id", "row_id", "version", "changed_by", "changed_at")
+    list_display = ("id", "row_id", "version", "keyframe", "changed_by", "changed_at")
     list_filter  = ("changed_by",)
-    readonly_fields = ("row", "version", "data_before", "data_after", "changed_by", "changed_at")
+    readonly_fields = ("row", "version", "keyframe", "patch", "data_before", "data_after", "changed_by", "changed_at")
 
 
 @admin.register(UploadHistory)
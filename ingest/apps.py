@@ -4,3 +4,6 @@
 class IngestConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'ingest'
+
+    def ready(self):
+        import ingest.signals
@@ -0,0 +1,295 @@
+# ingest/archive.py
+"""
+Холодное хранение старых периодов: строки опубликованного датасета упаковываются в один
+сжатый blob (DatasetArchive — gzip NDJSON, по строке на DatasetRow с исходными id и imported_at),
+а из ingest_datasetrow удаляются. Горячая таблица и её индексы
+держат только свежие периоды; история остаётся читаемой.
+
+Чтение прозрачное: resolve / dashboard / external / экспорт берут строки архивных датасетов
+из archived_rows / iter_archive_records (blob читается из БД кусками и распаковывается потоком).
+Колонки и последняя строка сняты при архивации (DatasetArchive.columns / last_record).
+Агрегатам нужен SQL по строкам: stage_archives разворачивает архив в DatasetArchiveRow
+один раз (до ARCHIVE_STAGE_TTL_SECONDS), дальше запросы читают её как таблицу.
+Ревизии строк не удаляются — id строк в архиве те же.
+
+Что архивировать — archive_candidates: approved-версии, у которых период handle старше
+ARCHIVE_KEEP_PERIODS последних; датасеты графиков (ChartConfig) не архивируются.
+Запускается задачей archive_old_datasets (по расписанию) и командой archive_datasets.
+"""
+import gzip
+import json
+import tempfile
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Workbook, Dataset, DatasetRow, DatasetArchive, DatasetArchiveRow
+from .partitioning import TABLE, delete_dataset_rows
+
+RESTORE_BATCH = 2000
+# сжатый blob читается из БД кусками (substring по bytea), а не целиком
+PAYLOAD_CHUNK = 1024 * 1024
+# сжатие при архивации — во временный файл, в памяти держится не больше этого;
+# в БД blob дописывается кусками того же размера (payload || кусок)
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+
+def keep_periods() -> int:
+    return int(getattr(settings, "ARCHIVE_KEEP_PERIODS", 12))
+
+
+def stage_ttl_seconds() -> int:
+    return int(getattr(settings, "ARCHIVE_STAGE_TTL_SECONDS", 24 * 60 * 60))
+
+
+def archive_candidates(keep: int | None = None, limit: int | None = None) -> list[int]:
+    """id approved-датасетов вне keep последних периодов своего handle (старые — первыми)."""
+    keep = keep_periods() if keep is None else int(keep)
+    ranked = (
+        Workbook.objects
+        .filter(period_date__isnull=False)
+        .annotate(_rank=Window(RowNumber(), partition_by=[F("handle")], order_by=[F("period_date").desc(), F("id").desc()]))
+        .values_list("id", "_rank")
+    )
+    old = [wb_id for wb_id, rank in ranked if rank > keep]
+    qs = (
+        Dataset.objects
+        .filter(sheet__workbook_id__in=old, status=Dataset.STATUS_APPROVED, archived=False)
+        .exclude(chartconfig__isnull=False)
+        .order_by("sheet__workbook__period_date", "id")
+        .values_list("id", flat=True)
+    )
+    return list(qs[:limit] if limit else qs)
+
+
+def archive_dataset(dataset_id: int) -> DatasetArchive | None:
+    """
+    Упаковать строки датасета в DatasetArchive и удалить их из горячей таблицы.
+    None — датасета нет или он уже в архиве.
+    """
+    with transaction.atomic():
+        ds = Dataset.objects.select_for_update().filter(pk=dataset_id, archived=False).only("id", "inferred_schema").first()
+        if ds is None:
+            return None
+        stats = (ds.inferred_schema or {}).get("keys") if isinstance(ds.inferred_schema, dict) else None
+        if not isinstance(stats, dict) or stats.get("sampled") or "keys" not in stats:
+            # статистика ключей архивного датасета не пересчитывается — снимаем её, пока строки в таблице
+            from analytics.dataset_keys import refresh_key_stats
+            refresh_key_stats(ds.id)
+        rows_count = raw_size = 0
+        columns, last = set(), None
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as tmp:
+            with gzip.GzipFile(fileobj=tmp, mode="wb", mtime=0) as gz:
+                rows = (DatasetRow.objects
+                        .filter(dataset_id=ds.id)
+                        .order_by("id")
+                        .values_list("id", "imported_at", "data", "data_compact")
+                        .iterator(chunk_size=RESTORE_BATCH))
+                for row_id, imported_at, data, compact in rows:
+                    last = {"id": row_id, "imported_at": imported_at.isoformat() if imported_at else None,
+                            "data": data, "data_compact": compact}
+                    line = json.dumps(last, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+                    gz.write(line)
+                    rows_count += 1
+                    raw_size += len(line)
+                    if isinstance(data, dict):
+                        columns.update(data)
+            archive = DatasetArchive.objects.create(
+                dataset=ds, codec=DatasetArchive.CODEC_GZIP, payload=b"",
+                rows_count=rows_count, raw_size=raw_size, columns=sorted(columns), last_record=last,
+            )
+            tmp.seek(0)
+            _append_payload(ds.id, tmp)
+        # payload в объекте — пустой; отложенное поле при обращении прочитается из БД
+        del archive.payload
+        delete_dataset_rows([ds.id], keep_revisions=True)
+        Dataset.objects.filter(pk=ds.id).update(archived=True)
+        # типизированная проекция удалена вместе со строками — снимаем и её раскладку
+        from analytics.typed_values import invalidate_typed_values
+        invalidate_typed_values(ds.id)
+    return archive
+
+
+def _append_payload(dataset_id: int, fileobj):
+    """Дописать содержимое файла в DatasetArchive.payload кусками по SPOOL_MAX_SIZE."""
+    table = DatasetArchive._meta.db_table
+    with connection.cursor() as cur:
+        while chunk := fileobj.read(SPOOL_MAX_SIZE):
+            cur.execute(f"UPDATE {table} SET payload = payload || %s WHERE dataset_id = %s", [chunk, int(dataset_id)])
+
+
+def restore_dataset(dataset_id: int) -> int | None:
+    """Вернуть строки архивного датасета в горячую таблицу (с прежними id). Возвращает число строк."""
+    with transaction.atomic():
+        ds = Dataset.objects.select_for_update().filter(pk=dataset_id, archived=True).only("id").first()
+        if ds is None:
+            return None
+        restored = insert_archive_rows(ds.id)
+        DatasetArchiveRow.objects.filter(dataset_id=ds.id).delete()
+        DatasetArchive.objects.filter(dataset_id=ds.id).delete()
+        Dataset.objects.filter(pk=ds.id).update(archived=False)
+    return restored
+
+
+def insert_archive_rows(dataset_id: int, target_id: int | None = None) -> int:
+    """
+    Строки архива -> ingest_datasetrow пачками (INSERT ... SELECT FROM jsonb_to_recordset).
+    target_id=None — обратно в тот же датасет с прежними id (restore), иначе — копия в target_id
+    с новыми id (новая версия на основе архивной, ingest.versioning).
+    """
+    keep_ids = target_id is None
+    target = int(dataset_id if keep_ids else target_id)
+    columns = "dataset_id, data, data_compact, imported_at"
+    select = "%s, x.data, x.data_compact, x.imported_at"
+    if keep_ids:
+        columns, select = f"id, {columns}", f"x.id, {select}"
+    return _insert_records(TABLE, columns, select, target, iter_archive_records(dataset_id))
+
+
+def _insert_records(table: str, columns: str, select: str, target: int, records) -> int:
+    """Записи архива -> table пачками по RESTORE_BATCH (INSERT ... SELECT FROM jsonb_to_recordset)."""
+    inserted = 0
+    batch = []
+    with connection.cursor() as cur:
+        def _flush():
+            cur.execute(
+                f"INSERT INTO {table} ({columns}) SELECT {select} "
+                "FROM jsonb_to_recordset(%s::jsonb) "
+                "AS x(id bigint, data jsonb, data_compact jsonb, imported_at timestamptz) ORDER BY x.id",
+                [target, json.dumps(batch, ensure_ascii=False)],
+            )
+            batch.clear()
+
+        for rec in records:
+            batch.append(rec)
+            inserted += 1
+            if len(batch) >= RESTORE_BATCH:
+                _flush()
+        if batch:
+            _flush()
+    return inserted
+
+
+def stage_archives(dataset_ids) -> set[int]:
+    """
+    Развернуть архивы в DatasetArchiveRow для агрегатов (analytics.aggregation), если ещё
+    не развёрнуты. Возвращает id архивных датасетов из dataset_ids.
+    """
+    archived = archived_dataset_ids(dataset_ids)
+    pending = DatasetArchive.objects.filter(dataset_id__in=archived, staged_at__isnull=True)
+    for ds_id in sorted(pending.values_list("dataset_id", flat=True)):
+        with transaction.atomic():
+            # параллельный запрос мог развернуть его раньше
+            if not DatasetArchive.objects.select_for_update().filter(dataset_id=ds_id, staged_at__isnull=True).exists():
+                continue
+            _insert_records(DatasetArchiveRow._meta.db_table, "dataset_id, row_id, data", "%s, x.id, x.data",
+                            ds_id, iter_archive_records(ds_id))
+            DatasetArchive.objects.filter(dataset_id=ds_id).update(staged_at=timezone.now())
+    return archived
+
+
+def unstage_archives(max_age_seconds: int | None = None) -> int:
+    """Удалить развёрнутые строки архивов старше max_age_seconds (ARCHIVE_STAGE_TTL_SECONDS). Возвращает число архивов."""
+    max_age = stage_ttl_seconds() if max_age_seconds is None else int(max_age_seconds)
+    cutoff = timezone.now() - timedelta(seconds=max_age)
+    with transaction.atomic():
+        ids = list(
+            DatasetArchive.objects.select_for_update()
+            .filter(staged_at__lte=cutoff).values_list("dataset_id", flat=True)
+        )
+        if ids:
+            DatasetArchiveRow.objects.filter(dataset_id__in=ids).delete()
+            DatasetArchive.objects.filter(dataset_id__in=ids).update(staged_at=None)
+    return len(ids)
+
+
+def archived_dataset_ids(dataset_ids) -> set[int]:
+    ids = [int(i) for i in dataset_ids if i]
+    if not ids:
+        return set()
+    return set(DatasetArchive.objects.filter(dataset_id__in=ids).values_list("dataset_id", flat=True))
+
+
+def archived_row_ids(dataset_ids) -> list[int]:
+    """id строк архивных датасетов (для удаления их ревизий)."""
+    return [rec["id"] for ds_id in sorted(archived_dataset_ids(dataset_ids)) for rec in iter_archive_records(ds_id)]
+
+
+def _payload_chunks(dataset_id: int):
+    """
+    Сжатый blob кусками по PAYLOAD_CHUNK. gzip-данные PostgreSQL не пережимает (TOAST хранит их
+    как есть), поэтому substring читает только нужные TOAST-куски, а не весь blob.
+    """
+    table = DatasetArchive._meta.db_table
+    offset = 1
+    with connection.cursor() as cur:
+        while True:
+            cur.execute(
+                f"SELECT substring(payload FROM %s FOR %s) FROM {table} WHERE dataset_id = %s",
+                [offset, PAYLOAD_CHUNK, int(dataset_id)],
+            )
+            row = cur.fetchone()
+            chunk = bytes(row[0]) if row and row[0] is not None else b""
+            if chunk:
+                yield chunk
+            if len(chunk) < PAYLOAD_CHUNK:
+                return
+            offset += len(chunk)
+
+
+def iter_archive_records(dataset_id: int):
+    """Записи архива по порядку id: {"id", "imported_at" (ISO), "data", "data_compact"} — потоково."""
+    inflate = zlib.decompressobj(16 + zlib.MAX_WBITS)  # формат gzip
+    tail = b""
+    for chunk in _payload_chunks(dataset_id):
+        *lines, tail = (tail + inflate.decompress(chunk)).split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+    tail += inflate.flush()
+    for line in tail.split(b"\n"):
+        if line.strip():
+            yield json.loads(line)
+
+
+def _row_from_record(dataset_id: int, rec: dict, compact: bool = False) -> DatasetRow:
+    data = rec.get("data")
+    if compact and rec.get("data_compact") is not None:
+        data = rec["data_compact"]
+    imported_at = rec.get("imported_at")
+    return DatasetRow(
+        id=rec["id"], dataset_id=dataset_id, data=data, data_compact=rec.get("data_compact"),
+        imported_at=parse_datetime(imported_at) if imported_at else None,
+    )
+
+
+def archived_rows(dataset_ids, limit: int | None = None, compact: bool = False, min_id: int | None = None,
+                  latest: bool = False) -> dict[int, list[DatasetRow]]:
+    """
+    {dataset_id: [DatasetRow, ...]} из архива (несохранённые объекты, по id ASC) — с теми же
+    limit / compact / min_id, что и views_resolve._rows_for_datasets. latest — только последняя строка
+    (DatasetArchive.last_record, без распаковки).
+    """
+    out = {}
+    if latest:
+        ids = [int(i) for i in dataset_ids if i]
+        for ds_id, rec in DatasetArchive.objects.filter(dataset_id__in=ids).values_list("dataset_id", "last_record"):
+            keep = rec is not None and not (min_id and rec["id"] < min_id)
+            out[ds_id] = [_row_from_record(ds_id, rec, compact)] if keep else []
+        return out
+    for ds_id in sorted(archived_dataset_ids(dataset_ids)):
+        rows = []
+        for rec in iter_archive_records(ds_id):
+            if min_id and rec["id"] < min_id:
+                continue
+            rows.append(rec)
+            if limit and len(rows) >= limit:
+                break
+        out[ds_id] = [_row_from_record(ds_id, rec, compact) for rec in rows]
+    return out
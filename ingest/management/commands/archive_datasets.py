@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.db.models.functions import Length
+
+from ingest.archive import archive_candidates, archive_dataset, keep_periods, restore_dataset
+from ingest.models import DatasetArchive
+
+
+class Command(BaseCommand):
+    help = (
+        "Переносит строки approved-датасетов старых периодов (старше ARCHIVE_KEEP_PERIODS последних "
+        "у handle) в сжатый архив DatasetArchive; --restore — вернуть датасеты --dataset в таблицу строк."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--keep-periods", type=int, default=None,
+                            help="Сколько последних периодов handle не трогать (по умолчанию из настроек)")
+        parser.add_argument("--dataset", type=int, action="append", default=[], help="ID датасета (можно несколько раз)")
+        parser.add_argument("--restore", action="store_true", help="Распаковать датасеты --dataset обратно")
+        parser.add_argument("--limit", type=int, default=None, help="Не больше стольких датасетов за запуск")
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **opts):
+        if opts["restore"]:
+            for ds_id in opts["dataset"]:
+                restored = restore_dataset(ds_id)
+                self.stdout.write(f"#{ds_id}: " + ("not archived" if restored is None else f"restored {restored} rows"))
+            return
+
+        keep = keep_periods() if opts["keep_periods"] is None else opts["keep_periods"]
+        ids = list(dict.fromkeys(opts["dataset"])) or archive_candidates(keep=keep, limit=opts["limit"])
+        if opts["dry_run"]:
+            self.stdout.write(f"DRY-RUN: would archive {len(ids)} datasets (keep {keep} periods): {ids}")
+            return
+
+        done = 0
+        for ds_id in ids:
+            archive = archive_dataset(ds_id)
+            if archive is None:
+                self.stdout.write(f"#{ds_id}: skip (not found or already archived)")
+                continue
+            done += 1
+            size = DatasetArchive.objects.filter(pk=archive.pk).values_list(Length("payload"), flat=True).get()
+            self.stdout.write(f"#{ds_id}: {archive.rows_count} rows, {archive.raw_size} -> {size} bytes")
+        self.stdout.write(self.style.SUCCESS(f"archived: {done}"))
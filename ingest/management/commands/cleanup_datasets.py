@@ -16,7 +16,8 @@ def handle(self, *args, **opts):
         if opts.get("range"):
             a, b = opts["range"].split(":")
             qs = qs.filter(id__gte=int(a), id__lte=int(b))
-        qs = qs.annotate(n=Count("datasetrow")).filter(n=0)
+        # у архивного датасета (ingest.archive) строк в таблице нет — он не пустой
+        qs = qs.exclude(archived=True).annotate(n=Count("rows")).filter(n=0)
 
         ids = list(qs.values_list("id", flat=True))
         self.stdout.write(f"Found empty datasets: {ids}")
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from ingest.models import DatasetRow, HandleRegistry
+from ingest.utils.luckysheet import compact_luckysheet
+
+
+class Command(BaseCommand):
+    help = "Заполняет DatasetRow.data_compact (компактные сетки Luckysheet) для уже загруженных строк v2-таблиц."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--handle", type=str, help="Только для одного handle")
+        parser.add_argument("--all-handles", action="store_true",
+                            help="Не только v2: проверить строки всех handle")
+        parser.add_argument("--force", action="store_true", help="Пересчитать и там, где data_compact уже есть")
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **opts):
+        qs = DatasetRow.objects.all()
+        if opts.get("handle"):
+            qs = qs.filter(dataset__sheet__workbook__handle=opts["handle"])
+        elif not opts["all_handles"]:
+            v2 = HandleRegistry.objects.filter(table_kind=HandleRegistry.TABLE_KIND_V2).values_list("handle", flat=True)
+            qs = qs.filter(dataset__sheet__workbook__handle__in=list(v2))
+        if not opts["force"]:
+            qs = qs.filter(data_compact__isnull=True)
+
+        batch_size = max(1, opts["batch_size"])
+        batch, seen, compacted = [], 0, 0
+        for row in qs.only("id", "data").order_by("id").iterator(chunk_size=batch_size):
+            seen += 1
+            compact = compact_luckysheet(row.data)
+            if compact is None:
+                continue
+            row.data_compact = compact
+            batch.append(row)
+            compacted += 1
+            if len(batch) >= batch_size and not opts["dry_run"]:
+                DatasetRow.objects.bulk_update(batch, ["data_compact"])
+                batch.clear()
+        if batch and not opts["dry_run"]:
+            DatasetRow.objects.bulk_update(batch, ["data_compact"])
+
+        self.stdout.write(self.style.SUCCESS(f"Проверено строк: {seen}, сжато: {compacted}"))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from ingest.revisions import convert_legacy_revisions, drop_implicit_revisions, squash_revisions
+
+
+class Command(BaseCommand):
+    help = (
+        "Сжимает ревизии строк (DatasetRowRevision): полные копии прежнего формата -> дельты с опорными "
+        "версиями, удаляет копии версии 1 от загрузки (совпадают со строкой); --keep-days N — у строки "
+        "из ревизий старше N дней остаётся одна (полный снимок)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--keep-days", type=int, default=None, help="Срок хранения истории ревизий, дней")
+        parser.add_argument("--batch", type=int, default=500, help="Строк за транзакцию")
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **opts):
+        dry = opts["dry_run"]
+        prefix = "DRY-RUN: would " if dry else ""
+        dropped = drop_implicit_revisions(dry_run=dry)
+        self.stdout.write(f"{prefix}drop upload copies (version 1): {dropped}")
+        converted = convert_legacy_revisions(batch=opts["batch"], dry_run=dry)
+        self.stdout.write(f"{prefix}convert to patches: {converted}")
+        if opts["keep_days"] is not None:
+            squashed = squash_revisions(opts["keep_days"], batch=opts["batch"], dry_run=dry)
+            self.stdout.write(f"{prefix}squash older than {opts['keep_days']} days: {squashed}")
+        self.stdout.write(self.style.SUCCESS("done"))
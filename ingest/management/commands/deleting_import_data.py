@@ -1,6 +1,8 @@
 from django.core.management.base import BaseCommand
 from django.db import connection, transaction
 
+from ingest.partitioning import delete_dataset_rows
+
 class Command(BaseCommand):
     help = "Удаляет импортированные данные (Workbook/Sheet/Cell/ImportBatch/Dataset/DatasetRow). По умолчанию — всё."
 
@@ -27,6 +29,7 @@ def handle(self, *args, **opts):
                     return
                 cur.execute("""
                     TRUNCATE TABLE
+                        ingest_datasetrowrevision,
                         ingest_datasetrow,
                         ingest_dataset,
                         ingest_cell,
@@ -58,6 +61,13 @@ def handle(self, *args, **opts):
                 if dry:
                     self.stdout.write('DRY-RUN: будут удалены связанные Sheets/Cells/ImportBatches и Datasets/DatasetRows')
                     return
+                # строки — вместе с ревизиями/проекцией (внешних ключей в БД на строки нет)
+                cur.execute(
+                    "SELECT d.id FROM ingest_dataset d JOIN ingest_sheet s ON s.id = d.sheet_id "
+                    "WHERE s.workbook_id = ANY(%s)",
+                    (ids,),
+                )
+                delete_dataset_rows([r[0] for r in cur.fetchall()])
                 cur.execute("DELETE FROM ingest_workbook WHERE id = ANY(%s);", (ids,))
                 self.stdout.write(self.style.SUCCESS('Удалено каскадно по workbook фильтрам'))
             else:
@@ -65,6 +75,8 @@ def handle(self, *args, **opts):
                 if dry:
                     self.stdout.write('DRY-RUN: DELETE FROM ingest_datasetrow/dataset/cell/sheet/importbatch/workbook')
                     return
+                cur.execute("SELECT id FROM ingest_dataset")
+                delete_dataset_rows([r[0] for r in cur.fetchall()])
                 cur.execute("DELETE FROM ingest_datasetrow;")
                 cur.execute("DELETE FROM ingest_dataset;")
                 cur.execute("DELETE FROM ingest_cell;")
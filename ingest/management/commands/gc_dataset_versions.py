@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from ingest.versioning import backfill_approved_pointers, gc_superseded_versions
+
+
+class Command(BaseCommand):
+    help = (
+        "Удаляет superseded-версии датасетов (заменённые новой версией и approve) старше "
+        "DATASET_VERSIONS_GC_GRACE_SECONDS; --backfill-pointers — проставить Workbook.approved_dataset "
+        "по самой свежей approved-версии для данных до версионирования."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--grace", type=int, default=None, help="Секунд после замены (по умолчанию из настроек)")
+        parser.add_argument("--backfill-pointers", action="store_true")
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **opts):
+        if opts["backfill_pointers"] and not opts["dry_run"]:
+            self.stdout.write(f"pointers: {backfill_approved_pointers()}")
+        ids = gc_superseded_versions(grace_seconds=opts["grace"], dry_run=opts["dry_run"])
+        prefix = "DRY-RUN: would delete" if opts["dry_run"] else "deleted"
+        self.stdout.write(self.style.SUCCESS(f"{prefix} {len(ids)} versions: {ids}"))
@@ -9,7 +9,6 @@
 from typing import Any, Dict, List, Optional, Tuple
 
 from django.core.management.base import BaseCommand, CommandError
-from django.utils import timezone
 from django.apps import apps
 
 from openpyxl import load_workbook
@@ -17,9 +16,13 @@
 
 from ingest.models import (
     Workbook, Sheet, ImportBatch,
-    Dataset, DatasetRow,
+    Dataset, DatasetRow, UploadHistory,
 )
 from ingest.utils import excel_templates as xt
+from ingest.utils.luckysheet import compact_luckysheet
+from ingest.versioning import create_version
+from analytics.caching import handle_data_changed
+from analytics.dataset_keys import dataset_rows_changed
 
 
 # ---------- утилиты ----------
@@ -227,14 +230,15 @@ def handle(self, *args, **opts):
             # 7) Создать Dataset (name обязателен)
             base_name = wb_obj.filename or os.path.basename(path)
             dataset_name = f"{base_name} :: {ws.title}"
-            dataset = Dataset.objects.create(
+            # новая черновая версия воркбука (version + 1), опубликованная не меняется до approve
+            dataset = create_version(
+                wb_obj.id,
                 sheet=sheet_rec,
                 name=dataset_name,
                 inferred_schema={},   # оставляем пустыми (при желании — заполнять)
                 primary_key={},
                 meta=dataset_meta,
                 period_date=period_dt,
-                created_at=timezone.now(),
             )
 
             # 8) Пройти по строкам и bulk_insert DatasetRow
@@ -268,7 +272,8 @@ def handle(self, *args, **opts):
                 if empty_row:
                     continue
 
-                rows_to_create.append(DatasetRow(dataset=dataset, data=row_data))
+                # bulk_create минует pre_save — компактную форму считаем здесь
+                rows_to_create.append(DatasetRow(dataset=dataset, data=row_data, data_compact=compact_luckysheet(row_data)))
                 if not dry and len(rows_to_create) >= bulk_size:
                     DatasetRow.objects.bulk_create(rows_to_create, batch_size=bulk_size)
                     rows_to_create.clear()
@@ -279,6 +284,20 @@ def handle(self, *args, **opts):
             # 9) Финализация
             batch.status = "finished"; batch.save(update_fields=["status"])
             wb_obj.status = "ready";    wb_obj.save(update_fields=["status"])
+            if not dry:
+                UploadHistory.objects.create(
+                    handle=wb_obj.handle or "",
+                    period_date=wb_obj.period_date,
+                    workbook=wb_obj,
+                    dataset=dataset,
+                    filename=wb_obj.filename or os.path.basename(path),
+                    rows_count=dataset.rows.count(),
+                    action=UploadHistory.ACTION_IMPORT,
+                    status_after=dataset.status,
+                    extra={"sheet": ws.title},
+                )
+                handle_data_changed(wb_obj.handle)
+                dataset_rows_changed(dataset.id)
 
             self.stdout.write(self.style.SUCCESS(
                 f"Imported OK: {os.path.basename(path)} (sheet={ws.title}, rows={max(0, ws.max_row - hdr_row)})"
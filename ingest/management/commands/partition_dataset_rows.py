@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ingest.partitioning import TABLE, existing_partitions, is_partitioned, partition_table
+
+
+class Command(BaseCommand):
+    help = (
+        "Перевести ingest_datasetrow в PARTITION BY HASH (dataset_id) на постоянный набор секций "
+        "(DATASET_ROW_PARTITIONS): запросы и удаление строк датасета затрагивают одну секцию, "
+        "DDL при работе не выполняется. Запускать в окно обслуживания (запись строк блокируется "
+        "на время копирования), после — перезапустить web/celery."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--keep-old", action="store_true",
+                            help="Оставить прежнюю таблицу как ingest_datasetrow_unpartitioned")
+        parser.add_argument("--partitions", type=int, default=None,
+                            help="Число секций (по умолчанию DATASET_ROW_PARTITIONS)")
+        parser.add_argument("--status", action="store_true", help="Только показать состояние")
+
+    def handle(self, *args, **opts):
+        if opts["status"]:
+            if not is_partitioned(refresh=True):
+                self.stdout.write(f"{TABLE}: not partitioned")
+                return
+            self.stdout.write(f"{TABLE}: partitioned, partitions: {len(existing_partitions())}")
+            return
+
+        try:
+            partition_table(keep_old=opts["keep_old"], partitions=opts["partitions"], log=self.stdout.write)
+        except RuntimeError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f"{TABLE}: partitioned"))
@@ -123,6 +123,10 @@ class Workbook(models.Model):
     # NEW: стабильный логический идентификатор (для резолвера с фронта)
     handle = models.SlugField(max_length=64, null=True, blank=True, db_index=True)
     period_date = models.DateField(null=True, blank=True, db_index=True)
+    # опубликованная версия (ingest.versioning.approve_dataset): approve — смена указателя, строки не трогаются
+    approved_dataset = models.ForeignKey(
+        "Dataset", null=True, blank=True, on_delete=models.SET_NULL, related_name="+"
+    )
 
     def __str__(self):
         return f"{getattr(self, 'filename', 'Workbook')} #{self.pk} [{self.handle or '-'}]"
@@ -195,9 +199,14 @@ class Dataset(models.Model):
     # NEW: публикация датасета и его версия (для аналитики/аудита)
     STATUS_DRAFT = "draft"
     STATUS_APPROVED = "approved"
-    STATUS_CHOICES = [(STATUS_DRAFT, "draft"), (STATUS_APPROVED, "approved")]
+    # заменён более новой версией (ingest.versioning), удаляется в фоне
+    STATUS_SUPERSEDED = "superseded"
+    STATUS_CHOICES = [(STATUS_DRAFT, "draft"), (STATUS_APPROVED, "approved"), (STATUS_SUPERSEDED, "superseded")]
     status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_APPROVED, db_index=True)
     version = models.PositiveIntegerField(default=1, db_index=True)
+    superseded_at = models.DateTimeField(null=True, blank=True)
+    # строки перенесены в DatasetArchive (ingest.archive), в ingest_datasetrow их нет
+    archived = models.BooleanField(default=False, db_index=True)
 
     def __str__(self):
         return f"{self.name} (#{self.pk})"
@@ -206,6 +215,9 @@ def __str__(self):
 class DatasetRow(models.Model):
     dataset = models.ForeignKey(Dataset, on_delete=models.CASCADE, related_name="rows")
     data = models.JSONField()
+    # компактная копия сетки Luckysheet (v2): без пустых хвостов, опц. в виде celldata.
+    # Заполняется при сохранении (ingest.signals), для не-сеток — NULL.
+    data_compact = models.JSONField(null=True, blank=True, default=None)
     imported_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -217,12 +229,82 @@ def __str__(self):
         return f"row#{self.pk} / ds#{self.dataset_id}"
 
 
+class DatasetArchive(models.Model):
+    """
+    Холодное хранение строк старого датасета: один сжатый blob (NDJSON, по строке
+    {"id", "imported_at", "data", "data_compact"} на DatasetRow, по возрастанию id).
+    Читается прозрачно (ingest.archive.archived_rows), см. команду archive_datasets.
+    columns и last_record снимаются при архивации — CSV-колонки и «последняя строка» без распаковки;
+    для агрегатов строки разворачиваются в DatasetArchiveRow (staged_at — когда).
+    """
+    CODEC_GZIP = "gzip"
+    CODEC_CHOICES = [(CODEC_GZIP, "gzip")]
+
+    dataset = models.OneToOneField(Dataset, on_delete=models.CASCADE, primary_key=True, related_name="archive")
+    codec = models.CharField(max_length=16, choices=CODEC_CHOICES, default=CODEC_GZIP)
+    payload = models.BinaryField()
+    rows_count = models.PositiveIntegerField(default=0)
+    # размер NDJSON до сжатия — для отчёта команды
+    raw_size = models.PositiveBigIntegerField(default=0)
+    archived_at = models.DateTimeField(auto_now_add=True)
+    # верхнеуровневые ключи data всех строк (по алфавиту) и запись последней строки
+    columns = models.JSONField(default=list, blank=True)
+    last_record = models.JSONField(null=True, blank=True)
+    staged_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"archive ds#{self.dataset_id} ({self.rows_count} rows)"
+
+
+class DatasetArchiveRow(models.Model):
+    """
+    Строки архивного датасета, развёрнутые для агрегатов (ingest.archive.stage_archives):
+    SQL читает их как обычную таблицу. Копия архива, удаляется по ARCHIVE_STAGE_TTL_SECONDS.
+    """
+    dataset = models.ForeignKey(Dataset, on_delete=models.CASCADE, related_name="+")
+    row_id = models.BigIntegerField()
+    data = models.JSONField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["dataset", "row_id"])]
+
+    def __str__(self):
+        return f"staged row#{self.row_id} / ds#{self.dataset_id}"
+
+
+class DatasetTypedRow(models.Model):
+    """
+    Типизированная проекция строки для аналитики: числовые ключи (nums) и ключи дат (dates),
+    разобранные один раз при записи датасета (analytics.typed_values), а не на каждом запросе.
+    Порядок ключей в массивах — Dataset.inferred_schema["typed"] = {"num": [...], "date": [...]};
+    без "typed" проекция датасета не используется.
+    """
+    # без ограничения в БД: строки могут лежать в секционированной таблице (ingest.partitioning)
+    row = models.OneToOneField(DatasetRow, on_delete=models.CASCADE, primary_key=True, related_name="typed",
+                               db_constraint=False)
+    dataset = models.ForeignKey(Dataset, on_delete=models.CASCADE, related_name="+")
+    nums = ArrayField(models.DecimalField(max_digits=38, decimal_places=10, null=True), default=list)
+    dates = ArrayField(models.DateField(null=True), default=list)
+
+    def __str__(self):
+        return f"typed row#{self.pk} / ds#{self.dataset_id}"
+
+
 # NEW: аудит строк с оптимистической блокировкой
 class DatasetRowRevision(models.Model):
-    row = models.ForeignKey(DatasetRow, on_delete=models.CASCADE, related_name='revisions')
+    """
+    Ревизия строки — дельта к предыдущей версии: patch {"set": {...}, "unset": [...]},
+    у опорных (keyframe) — полный снимок {"replace": data}. Запись и восстановление
+    любой версии — ingest.revisions. Строка без ревизий — в версии 1 (как загружена).
+    """
+    # без ограничения в БД: строки могут лежать в секционированной таблице (ingest.partitioning)
+    row = models.ForeignKey(DatasetRow, on_delete=models.CASCADE, related_name='revisions', db_constraint=False)
     version = models.PositiveIntegerField()  # номер ревизии строки
-    data_before = models.JSONField()
-    data_after = models.JSONField()
+    patch = models.JSONField(null=True, blank=True, default=None)
+    keyframe = models.BooleanField(default=False)
+    # прежний формат (полные копии до/после): переводится в patch командой compact_row_revisions
+    data_before = models.JSONField(null=True, blank=True, default=None)
+    data_after = models.JSONField(null=True, blank=True, default=None)
     changed_by = models.ForeignKey("auth.User", null=True, on_delete=models.SET_NULL)
     changed_at = models.DateTimeField(auto_now_add=True)
 
@@ -238,11 +320,13 @@ class UploadHistory(models.Model):
     ACTION_UPLOAD = "upload"
     ACTION_TRUNCATE_UPLOAD = "truncate_upload"
     ACTION_STATUS_CHANGE = "status_change"
+    ACTION_IMPORT = "import"
 
     ACTION_CHOICES = [
         (ACTION_UPLOAD, "upload"),
         (ACTION_TRUNCATE_UPLOAD, "truncate_upload"),
         (ACTION_STATUS_CHANGE, "status_change"),
+        (ACTION_IMPORT, "import"),
     ]
 
     user = models.ForeignKey("auth.User", null=True, on_delete=models.SET_NULL, related_name="upload_events")
@@ -266,6 +350,8 @@ class Meta:
         indexes = [
             models.Index(fields=["handle", "period_date", "created_at"]),
             models.Index(fields=["action", "created_at"]),
+            # лента изменений /api/changes/ — keyset по (created_at, id)
+            models.Index(fields=["created_at", "id"]),
         ]
 
     def __str__(self):
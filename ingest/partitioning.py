@@ -0,0 +1,176 @@
+# ingest/partitioning.py
+"""
+Секционирование строк датасетов: ingest_datasetrow — PARTITION BY HASH (dataset_id) на
+постоянный набор секций ingest_datasetrow_h0..h<N-1> (N = DATASET_ROW_PARTITIONS при переводе).
+
+  - запросы по одному датасету (WHERE dataset_id = ...) читают одну секцию и её индексы;
+  - удаление строк датасета — DELETE в одной секции (меньше индекс, короче VACUUM);
+  - набор секций не меняется: создание/удаление датасетов и загрузки не выполняют DDL и не берут
+    ACCESS EXCLUSIVE на родительскую таблицу — читатели (в т.ч. долгие выгрузки) им не мешают.
+
+Перевод существующей таблицы — команда partition_dataset_rows (в окно обслуживания: таблица
+копируется целиком под блокировкой). Функции ниже работают и без секционирования.
+
+У секционированной таблицы первичный ключ (id, dataset_id), поэтому внешние ключи на неё
+(DatasetRowRevision.row, DatasetTypedRow.row) — без ограничения в БД (db_constraint=False):
+зависимые строки удаляются здесь явно.
+"""
+from django.conf import settings
+from django.db import connection, transaction
+
+from .models import DatasetRow, DatasetRowRevision, DatasetTypedRow
+
+TABLE = DatasetRow._meta.db_table
+
+_partitioned: bool | None = None
+
+
+def partitions_count() -> int:
+    """Число секций для перевода таблицы (у уже секционированной — см. existing_partitions)."""
+    return max(1, int(getattr(settings, "DATASET_ROW_PARTITIONS", 16)))
+
+
+def partition_name(index: int) -> str:
+    return f"{TABLE}_h{int(index)}"
+
+
+def is_partitioned(refresh: bool = False) -> bool:
+    """Секционирована ли ingest_datasetrow (запоминается на процесс)."""
+    global _partitioned
+    if _partitioned is None or refresh:
+        if connection.vendor != "postgresql":
+            _partitioned = False
+        else:
+            with connection.cursor() as cur:
+                cur.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)", [TABLE])
+                _partitioned = cur.fetchone() is not None
+    return _partitioned
+
+
+def existing_partitions() -> list[str]:
+    """Имена секций ingest_datasetrow."""
+    with connection.cursor() as cur:
+        cur.execute(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(%s) ORDER BY c.relname",
+            [TABLE],
+        )
+        return [r[0] for r in cur.fetchall()]
+
+
+def _delete_dependents(cur, dataset_ids: list[int], revisions: bool = True):
+    """Ревизии и типизированная проекция строк датасетов (внешних ключей в БД на строки нет)."""
+    if revisions:
+        cur.execute(
+            f"DELETE FROM {DatasetRowRevision._meta.db_table} "
+            f"WHERE row_id IN (SELECT id FROM {TABLE} WHERE dataset_id = ANY(%s))",
+            [dataset_ids],
+        )
+        # строки архивных датасетов — только в архиве (ingest.archive), их id берём оттуда
+        from .archive import archived_row_ids
+        row_ids = archived_row_ids(dataset_ids)
+        if row_ids:
+            cur.execute(f"DELETE FROM {DatasetRowRevision._meta.db_table} WHERE row_id = ANY(%s)", [row_ids])
+    cur.execute(f"DELETE FROM {DatasetTypedRow._meta.db_table} WHERE dataset_id = ANY(%s)", [dataset_ids])
+
+
+def delete_dataset_rows(dataset_ids, keep_revisions: bool = False):
+    """
+    Строки датасетов вместе с зависимыми (перед удалением датасетов, архивация). Без DDL:
+    DELETE по dataset_id читает только секции этих датасетов.
+    keep_revisions — ревизии строк оставить (архив, ingest.archive: id строк сохраняются).
+    """
+    ids = sorted({int(i) for i in dataset_ids if i})
+    if not ids:
+        return
+    with transaction.atomic(), connection.cursor() as cur:
+        _delete_dependents(cur, ids, revisions=not keep_revisions)
+        cur.execute(f"DELETE FROM {TABLE} WHERE dataset_id = ANY(%s)", [ids])
+
+
+def partition_table(keep_old: bool = False, partitions: int | None = None, log=print):
+    """
+    Перевести ingest_datasetrow в секционированную: новая таблица + partitions HASH-секций
+    (по умолчанию DATASET_ROW_PARTITIONS), копия строк, те же индексы и внешний ключ на датасет.
+    Одна транзакция; запись в строки на это время заблокирована. keep_old — оставить прежнюю
+    таблицу как ingest_datasetrow_unpartitioned.
+    """
+    global _partitioned
+    if is_partitioned(refresh=True):
+        raise RuntimeError(f"{TABLE} уже секционирована")
+
+    modulus = max(1, int(partitions or partitions_count()))
+    new, seq = f"{TABLE}_part", f"{TABLE}_part_id_seq"
+    with transaction.atomic(), connection.cursor() as cur:
+        cur.execute(f"LOCK TABLE {TABLE} IN EXCLUSIVE MODE")
+        cur.execute(
+            "SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s AND indexname <> %s",
+            [TABLE, f"{TABLE}_pkey"],
+        )
+        indexes = cur.fetchall()
+        cur.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = to_regclass(%s) AND contype = 'f'",
+            [TABLE],
+        )
+        own_fks = cur.fetchall()
+        cur.execute(
+            "SELECT conrelid::regclass::text, conname FROM pg_constraint "
+            "WHERE confrelid = to_regclass(%s) AND contype = 'f'",
+            [TABLE],
+        )
+        incoming_fks = cur.fetchall()
+
+        # внешние ключи на строки: у секционированной таблицы нет UNIQUE (id)
+        for table, name in incoming_fks:
+            log(f"drop constraint {name} on {table}")
+            cur.execute(f"ALTER TABLE {table} DROP CONSTRAINT {name}")
+
+        # identity у секционированных таблиц до PostgreSQL 17 не наследуется — обычная последовательность
+        cur.execute(f"CREATE SEQUENCE {seq}")
+        cur.execute(
+            f"CREATE TABLE {new} (LIKE {TABLE} INCLUDING STORAGE INCLUDING COMPRESSION) "
+            "PARTITION BY HASH (dataset_id)"
+        )
+        cur.execute(f"ALTER TABLE {new} ALTER COLUMN id SET DEFAULT nextval('{seq}')")
+        cur.execute(f"ALTER SEQUENCE {seq} OWNED BY {new}.id")
+
+        for i in range(modulus):
+            cur.execute(
+                f"CREATE TABLE {new}_h{i} PARTITION OF {new} FOR VALUES WITH (MODULUS %s, REMAINDER %s)",
+                [modulus, i],
+            )
+        log(f"partitions: {modulus} (hash)")
+
+        columns = ", ".join(f.column for f in DatasetRow._meta.concrete_fields)
+        cur.execute(f"INSERT INTO {new} ({columns}) SELECT {columns} FROM {TABLE}")
+        log(f"rows copied: {cur.rowcount}")
+        cur.execute(f"SELECT setval('{seq}', coalesce((SELECT max(id) FROM {new}), 0) + 1, false)")
+
+        if keep_old:
+            old = f"{TABLE}_unpartitioned"
+            cur.execute(f"ALTER TABLE {TABLE} RENAME TO {old}")
+            for name, _ in indexes:
+                cur.execute(f"ALTER INDEX {name} RENAME TO {name[:40]}_old")
+            cur.execute(f"ALTER INDEX {TABLE}_pkey RENAME TO {old}_pkey")
+            cur.execute("SELECT pg_get_serial_sequence(%s, 'id')", [old])
+            old_seq = cur.fetchone()[0]
+            if old_seq:
+                cur.execute(f"ALTER SEQUENCE {old_seq} RENAME TO {old}_id_seq")
+            for name, _ in own_fks:
+                cur.execute(f"ALTER TABLE {old} DROP CONSTRAINT {name}")
+        else:
+            cur.execute(f"DROP TABLE {TABLE}")
+
+        cur.execute(f"ALTER TABLE {new} RENAME TO {TABLE}")
+        cur.execute(f"ALTER SEQUENCE {seq} RENAME TO {TABLE}_id_seq")
+        for i in range(modulus):
+            cur.execute(f"ALTER TABLE {new}_h{i} RENAME TO {partition_name(i)}")
+        cur.execute(f"ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_pkey PRIMARY KEY (id, dataset_id)")
+        for name, definition in indexes:
+            cur.execute(definition)
+        for name, definition in own_fks:
+            cur.execute(f"ALTER TABLE {TABLE} ADD CONSTRAINT {name} {definition}")
+        log(f"indexes: {len(indexes)}, foreign keys: {len(own_fks)}")
+
+    _partitioned = True
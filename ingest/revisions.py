@@ -0,0 +1,268 @@
+# ingest/revisions.py
+"""
+Ревизии строк датасета (DatasetRowRevision) в виде дельт: версия хранит только отличие
+от предыдущей — patch {"set": {ключ: значение}, "unset": [ключ, ...]} по верхнеуровневым
+ключам data. Каждая REVISIONS_KEYFRAME_EVERY-я версия — опорная (keyframe): полный снимок
+{"replace": data}, чтобы восстановление не проходило всю историю.
+
+  - загрузка ревизий не пишет: строка без ревизий — в версии 1, это её data;
+  - первое изменение (record_revision) сохраняет версию 1 опорной и дельту новой версии;
+  - row_version_data — data строки в любой версии: ближайшая опорная <= версии + дельты после неё;
+  - ревизии прежнего формата (полные data_before/data_after) читаются как опорные, переводятся
+    в дельты и сжимаются по сроку хранения командой compact_row_revisions;
+  - новая версия датасета получает строки с новыми id (ingest.versioning) — copy_row_revisions
+    переносит на них историю, иначе она ушла бы вместе с прежней версией при её удалении.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Max, Q
+from django.utils import timezone
+
+from .archive import archived_dataset_ids, iter_archive_records
+from .models import Dataset, DatasetRow, DatasetRowRevision
+
+
+class RevisionConflict(Exception):
+    """Строку уже изменили: expected_version устарела (оптимистическая блокировка)."""
+
+
+def keyframe_every() -> int:
+    return max(1, int(getattr(settings, "REVISIONS_KEYFRAME_EVERY", 20)))
+
+
+def is_keyframe_version(version: int) -> bool:
+    return (int(version) - 1) % keyframe_every() == 0
+
+
+def make_patch(before, after) -> dict:
+    """Дельта before -> after по верхнеуровневым ключам; не словари — полный снимок."""
+    if not isinstance(before, dict) or not isinstance(after, dict):
+        return {"replace": after}
+    patch = {}
+    changed = {k: v for k, v in after.items() if k not in before or before[k] != v}
+    removed = sorted(k for k in before if k not in after)
+    if changed:
+        patch["set"] = changed
+    if removed:
+        patch["unset"] = removed
+    return patch
+
+
+def apply_patch(data, patch: dict):
+    """data предыдущей версии + patch -> data этой версии."""
+    if "replace" in patch:
+        return patch["replace"]
+    out = dict(data) if isinstance(data, dict) else {}
+    for k in patch.get("unset") or []:
+        out.pop(k, None)
+    out.update(patch.get("set") or {})
+    return out
+
+
+def revision_patch(rev) -> dict:
+    """patch ревизии; ревизия прежнего формата — полный снимок data_after."""
+    if rev.patch is not None:
+        return rev.patch
+    return {"replace": rev.data_after if rev.data_after is not None else {}}
+
+
+def _keyframe_q() -> Q:
+    return Q(keyframe=True) | Q(patch__isnull=True)
+
+
+def current_version(row_id: int) -> int:
+    """Текущая версия строки (без ревизий — 1)."""
+    return DatasetRowRevision.objects.filter(row_id=row_id).aggregate(v=Max("version"))["v"] or 1
+
+
+def row_version_data(row_id: int, version: int | None = None):
+    """
+    data строки в версии version (None — текущая). None — строки нет или история
+    до этой версии сжата (compact_row_revisions --keep-days).
+    """
+    revs = DatasetRowRevision.objects.filter(row_id=row_id)
+    if version is None or (int(version) == 1 and not revs.exists()):
+        return DatasetRow.objects.filter(pk=row_id).values_list("data", flat=True).first()
+
+    base = revs.filter(_keyframe_q(), version__lte=version).aggregate(v=Max("version"))["v"]
+    if base is None:
+        return None
+    data = None
+    chain = revs.filter(version__gte=base, version__lte=version).order_by("version")
+    for rev in chain.only("version", "patch", "data_after"):
+        data = apply_patch(data, revision_patch(rev))
+    return data
+
+
+def record_revision(row_id: int, data, user=None, expected_version: int | None = None) -> DatasetRowRevision | None:
+    """
+    Записать новую data строки с ревизией. expected_version — версия, которую видел клиент:
+    если строку успели изменить, RevisionConflict. None — data не изменилась.
+    """
+    with transaction.atomic():
+        row = DatasetRow.objects.select_for_update().get(pk=row_id)
+        last = DatasetRowRevision.objects.filter(row_id=row.pk).aggregate(v=Max("version"))["v"] or 0
+        current = last or 1
+        if expected_version is not None and int(expected_version) != current:
+            raise RevisionConflict(f"row #{row.pk}: version {current}, expected {expected_version}")
+        if data == row.data:
+            return None
+
+        if not last:
+            # версия 1 (как загружена) до сих пор была неявной — теперь она опорная
+            DatasetRowRevision.objects.create(row=row, version=1, keyframe=True, patch={"replace": row.data})
+        version = current + 1
+        keyframe = is_keyframe_version(version)
+        rev = DatasetRowRevision.objects.create(
+            row=row, version=version, keyframe=keyframe,
+            patch={"replace": data} if keyframe else make_patch(row.data, data),
+            changed_by=user,
+        )
+        row.data = data
+        row.save(update_fields=["data"])
+        from analytics.caching import handle_data_changed
+        from analytics.dataset_keys import dataset_rows_changed
+        dataset_rows_changed(row.dataset_id)
+        # версия датасета та же — ChartResult и кэши handle сами не устареют
+        handle_data_changed(
+            Dataset.objects.filter(pk=row.dataset_id).values_list("sheet__workbook__handle", flat=True).first()
+        )
+    return rev
+
+
+def copy_row_revisions(src_dataset_id: int, dst_dataset_id: int) -> int:
+    """
+    Ревизии строк src -> соответствующие строки dst. Строки копируются в порядке id
+    (ingest.versioning.copy_dataset_rows), так что k-я строка src — это k-я строка dst.
+    Возвращает число скопированных ревизий.
+    """
+    revs = DatasetRowRevision._meta.db_table
+    rows = DatasetRow._meta.db_table
+    if int(src_dataset_id) in archived_dataset_ids([src_dataset_id]):
+        # id строк архивного датасета — из архива (ревизии при архивации не удаляются)
+        src_ids = [rec["id"] for rec in iter_archive_records(src_dataset_id)]
+        if not DatasetRowRevision.objects.filter(row_id__in=src_ids).exists():
+            return 0
+        src_sql, src_params = "SELECT id, rn FROM unnest(%s::bigint[]) WITH ORDINALITY AS s(id, rn)", [src_ids]
+    else:
+        with connection.cursor() as cur:
+            cur.execute(
+                f"SELECT EXISTS (SELECT 1 FROM {revs} v JOIN {rows} r ON r.id = v.row_id WHERE r.dataset_id = %s)",
+                [int(src_dataset_id)],
+            )
+            if not cur.fetchone()[0]:
+                return 0
+        src_sql = f"SELECT id, row_number() OVER (ORDER BY id) AS rn FROM {rows} WHERE dataset_id = %s"
+        src_params = [int(src_dataset_id)]
+    with connection.cursor() as cur:
+        cur.execute(
+            f"""
+            INSERT INTO {revs} (row_id, version, patch, keyframe, data_before, data_after, changed_by_id, changed_at)
+            SELECT d.id, v.version, v.patch, v.keyframe, v.data_before, v.data_after, v.changed_by_id, v.changed_at
+            FROM ({src_sql}) s
+            JOIN (SELECT id, row_number() OVER (ORDER BY id) AS rn FROM {rows} WHERE dataset_id = %s) d ON d.rn = s.rn
+            JOIN {revs} v ON v.row_id = s.id
+            """,
+            src_params + [int(dst_dataset_id)],
+        )
+        return cur.rowcount
+
+
+def _rows_chunks(qs, batch: int):
+    row_ids = list(qs.order_by("row_id").values_list("row_id", flat=True).distinct())
+    for start in range(0, len(row_ids), batch):
+        yield row_ids[start:start + batch]
+
+
+def convert_legacy_revisions(batch: int = 500, dry_run: bool = False) -> int:
+    """Ревизии прежнего формата (полные копии) -> дельты с опорными версиями. Возвращает число ревизий."""
+    legacy = DatasetRowRevision.objects.filter(patch__isnull=True)
+    if dry_run:
+        return legacy.count()
+    converted = 0
+    for row_ids in _rows_chunks(legacy, batch):
+        with transaction.atomic():
+            revs = list(
+                DatasetRowRevision.objects.select_for_update()
+                .filter(row_id__in=row_ids).order_by("row_id", "version")
+            )
+            prev_row, data = None, None
+            changed = []
+            for rev in revs:
+                first = rev.row_id != prev_row
+                full = apply_patch(data, revision_patch(rev))
+                if rev.patch is None:
+                    keyframe = first or is_keyframe_version(rev.version)
+                    rev.keyframe = keyframe
+                    rev.patch = {"replace": full} if keyframe else make_patch(data, full)
+                    rev.data_before = rev.data_after = None
+                    changed.append(rev)
+                prev_row, data = rev.row_id, full
+            DatasetRowRevision.objects.bulk_update(changed, ["patch", "keyframe", "data_before", "data_after"])
+            converted += len(changed)
+    return converted
+
+
+def drop_implicit_revisions(dry_run: bool = False) -> int:
+    """
+    Единственная ревизия строки — версия 1, совпадающая с её data (полная копия при загрузке):
+    не нужна, версия 1 строки без ревизий — сама строка.
+    """
+    table = DatasetRowRevision._meta.db_table
+    where = f"""
+        FROM {table} r, {DatasetRow._meta.db_table} d
+        WHERE d.id = r.row_id AND r.version = 1
+          AND coalesce(r.patch -> 'replace', r.data_after) = d.data
+          AND NOT EXISTS (SELECT 1 FROM {table} n WHERE n.row_id = r.row_id AND n.version > 1)
+    """
+    with connection.cursor() as cur:
+        if dry_run:
+            cur.execute(f"SELECT count(*) {where}")
+            return cur.fetchone()[0]
+        cur.execute(f"DELETE FROM {table} WHERE id IN (SELECT r.id {where})")
+        return cur.rowcount
+
+
+def squash_revisions(keep_days: int, batch: int = 500, dry_run: bool = False) -> int:
+    """
+    Срок хранения истории: у строки из ревизий старше keep_days остаётся только последняя —
+    опорной (полный снимок), более ранние удаляются. Версии новее срока не меняются.
+    Возвращает число удалённых ревизий.
+    """
+    cutoff = timezone.now() - timedelta(days=int(keep_days))
+    squashable = (
+        DatasetRowRevision.objects.filter(changed_at__lt=cutoff)
+        .values("row_id").annotate(n=Count("id")).filter(n__gt=1)
+    )
+    if dry_run:
+        return sum(item["n"] - 1 for item in squashable)
+    deleted = 0
+    row_ids = sorted(item["row_id"] for item in squashable)
+    for start in range(0, len(row_ids), batch):
+        with transaction.atomic():
+            revs = list(
+                DatasetRowRevision.objects.select_for_update()
+                .filter(row_id__in=row_ids[start:start + batch]).order_by("row_id", "version")
+            )
+            last_old = {}
+            for rev in revs:
+                if rev.changed_at < cutoff:
+                    last_old[rev.row_id] = rev.version
+            keep, drop = [], []
+            data = None
+            for rev in revs:
+                squash_to = last_old.get(rev.row_id)
+                if squash_to is None or rev.version > squash_to:
+                    continue
+                data = apply_patch(data, revision_patch(rev))
+                if rev.version < squash_to:
+                    drop.append(rev.id)
+                else:
+                    rev.keyframe, rev.patch = True, {"replace": data}
+                    rev.data_before = rev.data_after = None
+                    keep.append(rev)
+            DatasetRowRevision.objects.bulk_update(keep, ["patch", "keyframe", "data_before", "data_after"])
+            deleted += DatasetRowRevision.objects.filter(id__in=drop).delete()[0]
+    return deleted
@@ -0,0 +1,25 @@
+# ingest/signals.py
+from django.db.models.signals import pre_save, post_save
+from django.dispatch import receiver
+
+from .models import DatasetRow
+from .utils.luckysheet import compact_luckysheet
+
+
+@receiver(pre_save, sender=DatasetRow)
+def compact_luckysheet_on_save(sender, instance, update_fields=None, **kwargs):
+    """
+    Компактная форма сетки Luckysheet считается один раз — при записи строки.
+    bulk_create и INSERT ... SELECT сигналы не вызывают: там data_compact задаётся явно
+    (import_excel) или копируется вместе с data (ingest.versioning, ingest.archive).
+    """
+    if update_fields is not None and "data" not in update_fields:
+        return
+    instance.data_compact = compact_luckysheet(instance.data)
+
+
+@receiver(post_save, sender=DatasetRow)
+def compact_luckysheet_partial_save(sender, instance, update_fields=None, **kwargs):
+    """save(update_fields=["data"]) не запишет data_compact сам — дописываем отдельно."""
+    if update_fields is not None and "data" in update_fields and "data_compact" not in update_fields:
+        DatasetRow.objects.filter(pk=instance.pk).update(data_compact=instance.data_compact)
@@ -1,3 +1,49 @@
-from django.test import TestCase
+from types import SimpleNamespace
 
-# Create your tests here.
+from django.test import SimpleTestCase, override_settings
+
+from .revisions import apply_patch, is_keyframe_version, make_patch, revision_patch
+
+
+class PatchRoundTripTests(SimpleTestCase):
+    def assertRoundTrip(self, before, after):
+        self.assertEqual(apply_patch(before, make_patch(before, after)), after)
+
+    def test_set_and_unset(self):
+        before = {"a": 1, "b": [1, 2], "c": "x"}
+        after = {"a": 1, "b": [1, 3], "d": None}
+        patch = make_patch(before, after)
+        self.assertEqual(patch, {"set": {"b": [1, 3], "d": None}, "unset": ["c"]})
+        self.assertRoundTrip(before, after)
+
+    def test_no_changes(self):
+        data = {"a": {"n": 1}}
+        self.assertEqual(make_patch(data, dict(data)), {})
+        self.assertRoundTrip(data, dict(data))
+
+    def test_not_dict_is_replace(self):
+        for before, after in (([1], {"a": 1}), ({"a": 1}, [1, 2]), (None, {"a": 1})):
+            self.assertEqual(make_patch(before, after), {"replace": after})
+            self.assertRoundTrip(before, after)
+
+    def test_apply_does_not_mutate(self):
+        before = {"a": 1}
+        apply_patch(before, {"set": {"a": 2}, "unset": ["a"]})
+        self.assertEqual(before, {"a": 1})
+
+    def test_chain(self):
+        versions = [{"a": 1}, {"a": 2, "b": 1}, {"b": 1}, {"b": 2, "c": [3]}]
+        data = versions[0]
+        for prev, cur in zip(versions, versions[1:]):
+            data = apply_patch(data, make_patch(prev, cur))
+        self.assertEqual(data, versions[-1])
+
+    @override_settings(REVISIONS_KEYFRAME_EVERY=3)
+    def test_keyframe_versions(self):
+        self.assertEqual([v for v in range(1, 9) if is_keyframe_version(v)], [1, 4, 7])
+
+    def test_legacy_revision_is_replace(self):
+        legacy = SimpleNamespace(patch=None, data_after={"a": 1})
+        self.assertEqual(revision_patch(legacy), {"replace": {"a": 1}})
+        self.assertEqual(revision_patch(SimpleNamespace(patch=None, data_after=None)), {"replace": {}})
+        self.assertEqual(revision_patch(SimpleNamespace(patch={"set": {"a": 2}}, data_after=None)), {"set": {"a": 2}})
@@ -0,0 +1,175 @@
+# utils/luckysheet.py
+"""
+Сжатие сеток Luckysheet (v2-таблицы, HandleRegistry.table_kind == "v2").
+
+Сырые сетки приходят с кучей пустых ячеек/строк в хвостах. Компактная форма
+считается один раз при записи DatasetRow (DatasetRow.data_compact) и дальше
+отдаётся дашборду окнами по строкам.
+"""
+from django.conf import settings
+
+
+def is_empty_cell(c):
+    """Пуста ли ячейка Luckysheet: None, '' или {} без содержимого."""
+    if c is None:
+        return True
+    if c == "":
+        return True
+    if isinstance(c, dict):
+        # у Luckysheet полезные поля обычно 'v' или 'm'
+        return not any(k in c and c[k] not in (None, "") for k in ("v", "m"))
+    return False
+
+
+def trim_row_right(row):
+    """Обрезать справа полностью пустые ячейки (чтобы не таскать кучу {})."""
+    if not isinstance(row, list):
+        return row
+    i = len(row) - 1
+    while i >= 0 and is_empty_cell(row[i]):
+        i -= 1
+    return row[: i + 1]
+
+
+def row_is_all_empty(row):
+    """Вся ли строка пуста (после обрезки справа)."""
+    row = trim_row_right(row)
+    if not row:
+        return True
+    return all(is_empty_cell(c) for c in row)
+
+
+def compact_grid(grid, max_rows=None, trim=True):
+    """
+    Урезать 2D-сетку Luckysheet: взять первые max_rows строк
+    и/или почистить пустые хвосты строк и пустые нижние строки.
+    """
+    if not isinstance(grid, list):
+        return grid
+
+    # 1) срез по строкам
+    if isinstance(max_rows, int) and max_rows >= 0:
+        grid = grid[:max_rows]
+
+    if not trim:
+        return grid
+
+    # 2) обрезаем пустые ячейки справа в каждой строке
+    grid = [trim_row_right(r if isinstance(r, list) else [r]) for r in grid]
+
+    # 3) убираем полностью пустые строки снизу
+    j = len(grid) - 1
+    while j >= 0 and row_is_all_empty(grid[j]):
+        j -= 1
+    grid = grid[: j + 1]
+    return grid
+
+
+def grid_to_celldata(grid):
+    """Плотная сетка -> разреженный celldata Luckysheet: [{"r", "c", "v"}, ...] только непустые."""
+    out = []
+    for r, row in enumerate(grid or []):
+        if not isinstance(row, list):
+            continue
+        for c, cell in enumerate(row):
+            if is_empty_cell(cell):
+                continue
+            out.append({"r": r, "c": c, "v": cell if isinstance(cell, dict) else {"v": cell, "m": str(cell)}})
+    return out
+
+
+def _is_grid(grid):
+    return isinstance(grid, list) and (not grid or isinstance(grid[0], list))
+
+
+def _is_sheet(obj):
+    return isinstance(obj, dict) and (_is_grid(obj.get("data")) or isinstance(obj.get("celldata"), list))
+
+
+def is_luckysheet(obj) -> bool:
+    """
+    Поддерживаем 2 формы:
+      A) {"data": [[...], [...], ...]}  # single-sheet object
+      B) [{"data": [[...], ...], "name": "Sheet1"}, ...]  # массив листов
+    Лист может быть и в разреженной форме: {"celldata": [{"r", "c", "v"}, ...]}.
+    """
+    if isinstance(obj, list):
+        return bool(obj) and all(_is_sheet(s) for s in obj)
+    return _is_sheet(obj)
+
+
+def _map_sheets(obj, func):
+    if isinstance(obj, list):
+        return [func(dict(s)) for s in obj]
+    return func(dict(obj))
+
+
+def compact_luckysheet(obj, to_celldata=None):
+    """
+    Компактная форма для хранения рядом с сырой сеткой (все листы):
+    пустые хвосты строк/ячеек обрезаны; при to_celldata (по умолчанию
+    settings.LUCKYSHEET_COMPACT_CELLDATA) сетка заменяется на разреженный "celldata".
+    Если obj — не сетка Luckysheet, возвращает None.
+    """
+    if not is_luckysheet(obj):
+        return None
+    if to_celldata is None:
+        to_celldata = bool(getattr(settings, "LUCKYSHEET_COMPACT_CELLDATA", False))
+
+    def _compact_sheet(sheet):
+        if not _is_grid(sheet.get("data")):
+            return sheet  # уже celldata
+        grid = compact_grid(sheet["data"])
+        if to_celldata:
+            sheet.pop("data", None)
+            sheet["celldata"] = grid_to_celldata(grid)
+        else:
+            sheet["data"] = grid
+        return sheet
+
+    return _map_sheets(obj, _compact_sheet)
+
+
+def sheet_rows_total(obj) -> int:
+    """Сколько строк в (первом) листе компактной формы — для пагинации окон."""
+    sheet = obj[0] if isinstance(obj, list) and obj else obj
+    if not isinstance(sheet, dict):
+        return 0
+    if isinstance(sheet.get("data"), list):
+        return len(sheet["data"])
+    if isinstance(sheet.get("celldata"), list):
+        return max((c.get("r", 0) for c in sheet["celldata"]), default=-1) + 1
+    return 0
+
+
+def window_luckysheet(obj, offset=0, limit=None, to_celldata=False):
+    """
+    Окно строк [offset, offset+limit) компактной формы (каждого листа).
+    Плотная сетка режется срезом, celldata — фильтром по "r" (индексы остаются абсолютными).
+    to_celldata=True — дополнительно перевести плотную сетку окна в celldata (с абсолютными "r").
+    """
+    offset = max(0, int(offset or 0))
+    end = offset + limit if limit else None
+
+    def _window_sheet(sheet):
+        if isinstance(sheet.get("data"), list):
+            grid = sheet["data"][offset:end]
+            if to_celldata:
+                sheet.pop("data")
+                sheet["celldata"] = [
+                    {**cell, "r": cell["r"] + offset} for cell in grid_to_celldata(grid)
+                ]
+            else:
+                sheet["data"] = grid
+        elif isinstance(sheet.get("celldata"), list):
+            sheet["celldata"] = [
+                c for c in sheet["celldata"]
+                if c.get("r", 0) >= offset and (end is None or c.get("r", 0) < end)
+            ]
+        return sheet
+
+    if isinstance(obj, list):
+        return [_window_sheet(dict(s)) if isinstance(s, dict) else s for s in obj]
+    if isinstance(obj, dict):
+        return _window_sheet(dict(obj))
+    return obj
@@ -0,0 +1,190 @@
+# ingest/versioning.py
+"""
+Версии датасетов (copy-on-write): загрузка/импорт не меняют существующий Dataset,
+а создают новый черновик version = max + 1 (строки прежней версии копируются одним
+INSERT ... SELECT). Опубликованная версия при этом не трогается — читатели approved
+видят её до самого approve и не ждут пишущих.
+
+approve — короткая транзакция: указатель Workbook.approved_dataset + статусы
+(прежняя approved и более старые черновики -> superseded), время не зависит от числа строк.
+superseded-версии удаляются в фоне (gc_superseded_versions, задача gc_dataset_versions):
+опубликовать такую нельзя, и «последняя версия» (views_resolve и др.) их не видит.
+
+Запись версий одного воркбука сериализуется блокировкой строки Workbook.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .archive import insert_archive_rows
+from .models import Workbook, Dataset, DatasetRow, DatasetArchive
+from .partitioning import delete_dataset_rows
+from .revisions import copy_row_revisions
+
+
+def gc_grace_seconds() -> int:
+    return int(getattr(settings, "DATASET_VERSIONS_GC_GRACE_SECONDS", 3600))
+
+
+def _supersede(qs):
+    qs.update(status=Dataset.STATUS_SUPERSEDED, superseded_at=timezone.now())
+
+
+def copy_dataset_rows(src_id: int, dst_id: int) -> int:
+    """
+    Строки src -> dst (в порядке id) без чтения в Python, вместе с историей правок строк
+    (ingest.revisions.copy_row_revisions). Возвращает число строк.
+    """
+    if DatasetArchive.objects.filter(dataset_id=src_id).exists():
+        # версия из архива (ingest.archive): строки распаковываются и вставляются пачками
+        copied = insert_archive_rows(src_id, dst_id)
+    else:
+        table = DatasetRow._meta.db_table
+        with connection.cursor() as cur:
+            cur.execute(
+                f"INSERT INTO {table} (dataset_id, data, data_compact, imported_at) "
+                f"SELECT %s, data, data_compact, imported_at FROM {table} WHERE dataset_id = %s ORDER BY id",
+                [int(dst_id), int(src_id)],
+            )
+            copied = cur.rowcount
+    copy_row_revisions(src_id, dst_id)
+    return copied
+
+
+def create_version(workbook_id: int, base: Dataset | None = None, copy_rows: bool = True, **fields) -> Dataset:
+    """
+    Новая черновая версия датасета воркбука. base — с какой версии начать (её строки копируются,
+    если copy_rows); fields — поля нового Dataset (sheet, name, meta, ...), по умолчанию — как у base.
+    Прежние черновики воркбука -> superseded, опубликованная версия остаётся как есть.
+    """
+    with transaction.atomic():
+        Workbook.objects.select_for_update().filter(pk=workbook_id).values_list("id", flat=True).first()
+        versions = Dataset.objects.filter(sheet__workbook_id=workbook_id)
+        last = versions.aggregate(v=Max("version"))["v"] or 0
+
+        values = {}
+        if base is not None:
+            values = {
+                "sheet_id": base.sheet_id,
+                "name": base.name,
+                "meta": base.meta,
+                "primary_key": base.primary_key,
+                "period_date": base.period_date,
+            }
+        values.update(fields)
+        ds = Dataset.objects.create(status=Dataset.STATUS_DRAFT, version=last + 1, **values)
+        if base is not None and copy_rows:
+            copy_dataset_rows(base.id, ds.id)
+        _supersede(versions.filter(status=Dataset.STATUS_DRAFT).exclude(pk=ds.pk))
+    return ds
+
+
+def approve_dataset(dataset: Dataset) -> str:
+    """
+    Опубликовать версию: указатель воркбука на неё, прежняя approved и более старые черновики —
+    superseded, графики воркбука переводятся на неё. Возвращает прежний статус.
+    superseded-версию (её строки ждут удаления) — ValueError: новую версию делают из неё create_version.
+    """
+    from analytics.caching import handle_data_changed
+    from analytics.models import ChartConfig
+
+    with transaction.atomic():
+        workbook_id, handle = (
+            Dataset.objects.filter(pk=dataset.pk).values_list("sheet__workbook_id", "sheet__workbook__handle").get()
+        )
+        Workbook.objects.select_for_update().filter(pk=workbook_id).values_list("id", flat=True).first()
+        before = Dataset.objects.filter(pk=dataset.pk).values_list("status", flat=True).get()
+        if before == Dataset.STATUS_SUPERSEDED:
+            raise ValueError(f"dataset #{dataset.pk} is superseded and cannot be approved")
+
+        versions = Dataset.objects.filter(sheet__workbook_id=workbook_id).exclude(pk=dataset.pk)
+        _supersede(versions.filter(status=Dataset.STATUS_APPROVED))
+        _supersede(versions.filter(status=Dataset.STATUS_DRAFT, version__lt=dataset.version))
+        Dataset.objects.filter(pk=dataset.pk).update(status=Dataset.STATUS_APPROVED, superseded_at=None)
+        Workbook.objects.filter(pk=workbook_id).update(approved_dataset=dataset)
+        if ChartConfig.objects.filter(dataset__in=versions).update(dataset=dataset):
+            # update() минует сигналы графиков — сохранённые результаты сбрасываем явно
+            handle_data_changed(handle)
+
+    dataset.status = Dataset.STATUS_APPROVED
+    dataset.superseded_at = None
+    return before
+
+
+def set_dataset_status(dataset: Dataset, status: str) -> str:
+    """
+    approved — approve_dataset; draft — снять публикацию (указатель воркбука сбрасывается).
+    superseded-версию ни в какой статус не вернуть — ValueError.
+    """
+    if status == Dataset.STATUS_APPROVED:
+        return approve_dataset(dataset)
+    with transaction.atomic():
+        workbook_id = Dataset.objects.filter(pk=dataset.pk).values_list("sheet__workbook_id", flat=True).get()
+        Workbook.objects.select_for_update().filter(pk=workbook_id).values_list("id", flat=True).first()
+        before = Dataset.objects.filter(pk=dataset.pk).values_list("status", flat=True).get()
+        if before == Dataset.STATUS_SUPERSEDED:
+            raise ValueError(f"dataset #{dataset.pk} is superseded and cannot be changed to {status}")
+        Dataset.objects.filter(pk=dataset.pk).update(status=status, superseded_at=None)
+        Workbook.objects.filter(pk=workbook_id, approved_dataset=dataset).update(approved_dataset=None)
+    dataset.status = status
+    dataset.superseded_at = None
+    return before
+
+
+def dataset_row_count(dataset: Dataset) -> int:
+    """Число строк версии: из статистики ключей (версия неизменна — число точное), иначе COUNT."""
+    if dataset.archived:
+        return DatasetArchive.objects.filter(dataset_id=dataset.id).values_list("rows_count", flat=True).first() or 0
+    schema = dataset.inferred_schema if isinstance(dataset.inferred_schema, dict) else {}
+    stats = schema.get("keys") or {}
+    if isinstance(stats, dict) and "rows" in stats and not stats.get("sampled"):
+        return int(stats["rows"])
+    return dataset.rows.count()
+
+
+def backfill_approved_pointers() -> int:
+    """Воркбуки без указателя — на самую свежую approved-версию (данные до версионирования)."""
+    updated = 0
+    latest = (
+        Dataset.objects
+        .filter(status=Dataset.STATUS_APPROVED, sheet__workbook__approved_dataset__isnull=True)
+        .order_by("sheet__workbook_id", "-created_at", "-id")
+        .distinct("sheet__workbook_id")
+        .values_list("sheet__workbook_id", "id")
+    )
+    for workbook_id, ds_id in latest:
+        updated += Workbook.objects.filter(pk=workbook_id, approved_dataset__isnull=True).update(approved_dataset_id=ds_id)
+    return updated
+
+
+def gc_superseded_versions(grace_seconds: int | None = None, batch: int = 50, dry_run: bool = False) -> list[int]:
+    """
+    Удалить superseded-версии старше grace_seconds (читатели, начавшие до approve, успевают
+    дочитать). Версии, на которые ещё ссылаются графики или указатель воркбука, не трогаются.
+    Строки — delete_dataset_rows (вместе с ревизиями и проекцией).
+    """
+    grace = gc_grace_seconds() if grace_seconds is None else int(grace_seconds)
+    ids = list(
+        Dataset.objects
+        .filter(status=Dataset.STATUS_SUPERSEDED, superseded_at__lte=timezone.now() - timedelta(seconds=grace))
+        .exclude(id__in=Workbook.objects.filter(approved_dataset__isnull=False).values("approved_dataset_id"))
+        .exclude(chartconfig__isnull=False)
+        .order_by("id")
+        .values_list("id", flat=True)
+    )
+    if dry_run:
+        return ids
+    for start in range(0, len(ids), batch):
+        with transaction.atomic():
+            # версию могли успеть вернуть (approve superseded-версии) — перепроверяем под блокировкой
+            chunk = list(
+                Dataset.objects.select_for_update()
+                .filter(id__in=ids[start:start + batch], status=Dataset.STATUS_SUPERSEDED)
+                .values_list("id", flat=True)
+            )
+            delete_dataset_rows(chunk)
+            Dataset.objects.filter(id__in=chunk, status=Dataset.STATUS_SUPERSEDED).delete()
+    return ids